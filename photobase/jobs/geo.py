@@ -1,7 +1,6 @@
-from django.conf import settings
-import googlemaps
+from proto import geocoding
 
 
 def get_geo_location(location):
-    gmaps = googlemaps.Client(key=settings.GOOGLE_MAPS_KEY)
-    gmaps.geocode(location.full_address())
+    # (lat, lng) of the location's address, from the geocode cache if known
+    return geocoding.geocode(location.full_address())
@@ -109,6 +109,21 @@ DATABASES = {
 
 }
 
+# Cache shared by the gunicorn workers and the management commands, a linked
+# memcached container. Without it every process has its own memory cache,
+# which can't carry invalidations between workers (see SEARCH_CACHE_TIMEOUT).
+memcached_host = os.getenv('MEMCACHED_PORT_11211_TCP_ADDR')
+memcached_port = os.getenv('MEMCACHED_PORT_11211_TCP_PORT', '11211')
+SHARED_CACHE = bool(memcached_host)
+
+if SHARED_CACHE:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': '{}:{}'.format(memcached_host, memcached_port),
+        }
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/1.9/ref/settings/#auth-password-validators
 
@@ -136,8 +151,105 @@ REST_FRAMEWORK = {
 
 PHOTOS_PER_BATCH = 30
 
+# Searches estimated above this many photos show the planner estimate as
+# total instead of counting. None always counts exactly.
+SEARCH_APPROXIMATE_TOTAL_ABOVE = None
+
+# Photo search results, category counts and nearest-first radii are cached
+# per geohash cell of this precision (6 is about 1.2 x 0.6 km) for
+# SEARCH_CACHE_TIMEOUT seconds, 0 disables the cache. A search runs from its
+# own point, the cached result is then served as is to the searches from
+# anywhere else in the cell, off by at most the size of a cell. Invalidation
+# goes through the cache, so it is only on with the shared cache.
+SEARCH_CACHE_PRECISION = 6
+SEARCH_CACHE_TIMEOUT = 60 if SHARED_CACHE else 0
+SEARCH_CACHE_MAX_ROWS = 3000
+
+# Engine answering the photo and photographer searches: the PostGIS search
+# table or 'proto.search_memory.MemoryBackend', an in-process NumPy index
+# that is fully reloaded every SEARCH_MEMORY_MAX_AGE seconds.
+SEARCH_BACKEND = 'proto.search_backends.PostgisBackend'
+SEARCH_MEMORY_MAX_AGE = 300
+
+# Whether the model signals keep the PostGIS search table (PhotoSearch) in
+# sync. Only the memory backend runs without it, it then answers keyword and
+# popular searches itself, see photobase.settings_spatialite.
+SEARCH_TABLE = True
+
+# Searches without a range (or with geo[mode] = nearest) list the photos
+# nearest first, widening the radius until it holds SEARCH_NEAREST_PHOTOS
+# photos but never beyond SEARCH_NEAREST_MAX_KM.
+SEARCH_NEAREST_PHOTOS = 300
+SEARCH_NEAREST_MAX_KM = 200
+
+# The zip code autocomplete answers from an in-process sorted list that is
+# fully reloaded every ZIP_INDEX_MAX_AGE seconds.
+ZIP_INDEX_MAX_AGE = 300
+ZIP_AUTOCOMPLETE_LIMIT = 10
+
+# The home page samples its photos from a cached pool of PHOTO_POOL_SIZE
+# random active photo ids, rebuilt in the background every
+# PHOTO_POOL_REFRESH seconds.
+PHOTO_POOL_SIZE = 3000
+PHOTO_POOL_REFRESH = 300
+
+# Likes and impressions are written in batches by a background thread every
+# METRICS_FLUSH_INTERVAL_MS or once METRICS_FLUSH_EVENTS are waiting. Beyond
+# METRICS_MAX_PENDING waiting events new ones are dropped. With
+# METRICS_BUFFERED = False they are written during the request.
+METRICS_BUFFERED = True
+METRICS_FLUSH_INTERVAL_MS = 500
+METRICS_FLUSH_EVENTS = 500
+METRICS_MAX_PENDING = 20000
+
+# Impressions also fill the daily viewer sketches (see proto.viewers), which
+# are written with PostgreSQL-only statements.
+VIEWER_SKETCHES = True
+
+# `manage.py rollupmetrics` counts likes and impressions older than
+# ROLLUP_LAG seconds into the daily stats, ROLLUP_BATCH rows per transaction.
+ROLLUP_LAG = 300
+ROLLUP_BATCH = 100000
+
+# The scoreboard's unique viewers cover this many days, today included
+UNIQUE_VIEWERS_DAYS = 30
+
+# The stats API covers STATS_DEFAULT_DAYS up to today unless given a range,
+# answers are cached per photographer for STATS_CACHE_TIMEOUT seconds
+STATS_DEFAULT_DAYS = 30
+STATS_CACHE_TIMEOUT = 60
+
+# `manage.py rebuildleaderboard` ranks photographers per category and geohash
+# cell of LEADERBOARD_PRECISION (4 is about 39 x 20 km) by the weighted likes
+# and impressions of the last LEADERBOARD_DAYS. The API lists the first
+# LEADERBOARD_API_LIMIT of a board.
+LEADERBOARD_DAYS = 30
+LEADERBOARD_PRECISION = 4
+LEADERBOARD_LIKE_WEIGHT = 1.0
+LEADERBOARD_IMPRESSION_WEIGHT = 0.05
+LEADERBOARD_API_LIMIT = 20
+
+# The like and impression tables are partitioned by month. `manage.py
+# metricpartitions` creates METRICS_PARTITIONS_AHEAD months in advance and
+# archives partitions older than METRICS_RETENTION_MONTHS to gzipped CSV
+# files in METRICS_ARCHIVE_DIR, once they are rolled up.
+METRICS_PARTITIONS_AHEAD = 3
+METRICS_RETENTION_MONTHS = 13
+METRICS_ARCHIVE_DIR = os.path.join(BASE_DIR, 'archive', 'metrics')
+
+# Metric exports read this many rows per query, memory stays bounded by it
+EXPORT_CHUNK_ROWS = 5000
+
 TOP_PHOTOS_COUNT = 3
 
+# The portfolio page's counts and top photos are cached per photographer,
+# photo changes drop the entry, new likes show after this many seconds
+PORTFOLIO_CACHE_TIMEOUT = 300
+
+# A photographer's subscription and remaining quotas are cached this many
+# seconds, subscription and photo changes drop them earlier
+ENTITLEMENTS_CACHE_TIMEOUT = 300
+
 LANGUAGE_CODE = 'en-us'
 
 TIME_ZONE = 'UTC'
@@ -161,6 +273,21 @@ PHONENUMBER_DB_FORMAT = 'INTERNATIONAL'
 
 GOOGLE_MAPS_KEY = os.getenv('GOOGLE_MAPS_KEY')
 
+# Geocoded addresses are kept in the GeocodeCache table. Addresses without
+# results are asked again after GEOCODE_NEGATIVE_TTL seconds, failed requests
+# after GEOCODE_ERROR_TTL seconds.
+GEOCODE_NEGATIVE_TTL = 7 * 24 * 3600
+GEOCODE_ERROR_TTL = 600
+GEOCODE_URL = 'https://maps.googleapis.com/maps/api/geocode/json'
+GEOCODE_TIMEOUT = 5
+
+# Locations are saved pending until `manage.py geocodelocations` geocodes
+# them: GEOCODE_WORKER_BATCH per round with GEOCODE_WORKER_THREADS threads,
+# starting at most GEOCODE_RATE_LIMIT requests per second
+GEOCODE_WORKER_BATCH = 200
+GEOCODE_WORKER_THREADS = 4
+GEOCODE_RATE_LIMIT = 10
+
 SEARCH_DEFAULTS = {
     'resource': '/partial_photos/',
     'location': 'Mitte, Berlin',
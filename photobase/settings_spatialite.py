@@ -0,0 +1,24 @@
+from .settings_base import *
+
+# Runs the search without PostgreSQL, e.g. for the search tests:
+#   python manage.py test proto.tests.test_search \
+#       --settings=photobase.settings_spatialite
+# The migrations are PostgreSQL-only, the tables are created from the
+# models. The search table and the viewer sketches are left out, searches
+# are answered by the memory backend and the tests needing PostGIS skipped.
+
+DEBUG = True
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.contrib.gis.db.backends.spatialite',
+        'NAME': os.path.join(BASE_DIR, 'photobase.sqlite3'),
+    }
+}
+
+MIGRATION_MODULES = {'proto': None}
+
+SEARCH_BACKEND = 'proto.search_memory.MemoryBackend'
+SEARCH_TABLE = False
+SEARCH_CACHE_TIMEOUT = 0
+VIEWER_SKETCHES = False
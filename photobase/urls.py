@@ -45,6 +45,14 @@ urlpatterns = [
         name='partial_photographers'),
     url(r'^api/photos/$', api.PhotoList.as_view(),
         name='api_photos'),
+    url(r'^api/zip_codes/$', api.ZipCodeList.as_view(),
+        name='api_zip_codes'),
+    url(r'^api/facets/$', api.CategoryFacets.as_view(),
+        name='api_facets'),
+    url(r'^api/leaderboard/$', api.Leaderboard.as_view(),
+        name='api_leaderboard'),
+    url(r'^api/stats/$', api.MetricSeries.as_view(),
+        name='api_stats'),
 
     # user auth
     url(r'^login/$', auth.Login.as_view(), name='login'),
@@ -56,6 +64,8 @@ urlpatterns = [
         name='settings_personal'),
     url(r'^settings/scoreboard/?$', panel.ScoreBoard.as_view(),
         name='settings_scoreboard'),
+    url(r'^settings/metrics/export/?$', panel.MetricsExport.as_view(),
+        name='settings_metrics_export'),
     url(r'^settings/portfolio/?$', panel.Portfolio.as_view(),
         name='settings_portfolio'),
     url(r'^settings/portfolio/category/(?P<pk>\d+)/(?P<slug>[\w-]+)/?$',
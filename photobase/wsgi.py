@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "photobase.settings_dev")
 
 application = get_wsgi_application()
+
+# build in-process search indexes before the first request comes in
+from proto import search_backends, zip_index  # noqa
+search_backends.get_backend().warm_up()
+zip_index.warm_up()
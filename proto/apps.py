@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class ProtoConfig(AppConfig):
     name = 'proto'
+
+    def ready(self):
+        # connect the receivers keeping the denormalized tables in sync
+        from proto import signals  # noqa
@@ -0,0 +1,78 @@
+import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+
+from proto import rollups
+from proto.models import Photo, PhotographerSubscription
+
+# A photographer's active subscription and what is left of its quotas:
+# Subscription.photos caps the active photos, Subscription.likes the likes
+# they collect. Cached per photographer for ENTITLEMENTS_CACHE_TIMEOUT for
+# display; subscription and photo changes drop the entry, new likes are seen
+# after the timeout. Uploads count the active photos uncached. Without an
+# active subscription there are no limits.
+PREFIX = 'entitlements'
+
+
+def get(photographer_id):
+    # {'subscription': name or None, 'is_premium', 'photos', 'likes' (the
+    # limits, None for unlimited), 'photos_left', 'likes_left'}
+    key = _key(photographer_id)
+    result = cache.get(key)
+    if result is None:
+        result = _entitlements(photographer_id)
+        cache.set(key, result, settings.ENTITLEMENTS_CACHE_TIMEOUT)
+    return result
+
+
+def upload_refused(photographer_id):
+    # reason the photographer can't add a photo, None when they can. The
+    # limits and the likes come from the cached entry, the active photos are
+    # counted afresh: another process may not have dropped its entry yet.
+    current = get(photographer_id)
+    if current['photos'] is not None and _active_photos(photographer_id) >= \
+            current['photos']:
+        return 'Your membership plan allows {} photos.'.format(
+            current['photos'])
+    if current['likes_left'] is not None and current['likes_left'] <= 0:
+        return 'Your photos collected the {} likes of your membership ' \
+               'plan.'.format(current['likes'])
+    return None
+
+
+def changed(photographer_ids):
+    cache.delete_many([_key(pk) for pk in photographer_ids if pk is not None])
+
+
+def _entitlements(photographer_id):
+    today = datetime.date.today()
+    active = PhotographerSubscription.objects\
+        .filter(photographer_id=photographer_id, disabled=False,
+                start__lte=today, end__gte=today)\
+        .select_related('subscription')\
+        .order_by('-start', '-pk').first()
+    if active is None:
+        return {'subscription': None, 'is_premium': False, 'photos': None,
+                'likes': None, 'photos_left': None, 'likes_left': None}
+
+    subscription = active.subscription
+    photos = _active_photos(photographer_id)
+    likes = rollups.photographer_totals(photographer_id)['likes']
+    return {
+        'subscription': subscription.name,
+        'is_premium': subscription.is_premium,
+        'photos': subscription.photos,
+        'likes': subscription.likes,
+        'photos_left': max(subscription.photos - photos, 0),
+        'likes_left': max(subscription.likes - likes, 0),
+    }
+
+
+def _active_photos(photographer_id):
+    return Photo.objects.filter(photographer_id=photographer_id,
+                                disabled=False, deleted=False).count()
+
+
+def _key(photographer_id):
+    return '{}:{}'.format(PREFIX, photographer_id)
@@ -0,0 +1,93 @@
+import csv
+import datetime
+import json
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from proto.models import Impression, Like, Photo
+
+# Raw likes and impressions of a photographer as CSV or NDJSON lines. Rows
+# are read photo by photo in keyset chunks of EXPORT_CHUNK_ROWS on the
+# (photo_id, created_on) index: Django's .iterator() alone doesn't stop
+# psycopg2 from fetching the whole result, the chunks keep memory constant.
+METRICS = (('like', Like), ('impression', Impression))
+FORMATS = ('csv', 'ndjson')
+COLUMNS = ('metric', 'id', 'created_on', 'photo_id', 'user_id', 'ip')
+CONTENT_TYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+
+class Echo(object):
+    # file-like object handing csv.writer's lines straight back
+    def write(self, value):
+        return value
+
+
+def rows(photographer_id, start=None, end=None, metrics=None):
+    # (metric, id, created_on, photo_id, user_id, ip) between the days start
+    # and end (inclusive), photo by photo and by time
+    since, until = _bounds(start, end)
+    photo_ids = Photo.objects.filter(photographer_id=photographer_id)\
+        .order_by('pk').values_list('pk', flat=True)
+    for metric, model in METRICS:
+        if metrics and metric not in metrics:
+            continue
+        for photo_id in photo_ids.iterator():
+            for row in _photo_rows(model, photo_id, since, until):
+                yield (metric,) + row
+
+
+def lines(entries, format='csv'):
+    # text lines of the rows, with a header line for csv
+    if format == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(COLUMNS)
+        for row in entries:
+            yield writer.writerow([_text(value) for value in row])
+    else:
+        for row in entries:
+            yield json.dumps(dict(zip(COLUMNS, map(_text, row)))) + '\n'
+
+
+def _photo_rows(model, photo_id, since, until):
+    entries = model.objects.filter(photo_id=photo_id)
+    if since is not None:
+        entries = entries.filter(created_on__gte=since)
+    if until is not None:
+        entries = entries.filter(created_on__lt=until)
+    entries = entries.order_by('created_on', 'pk')\
+        .values_list('pk', 'created_on', 'photo_id', 'user_id', 'ip')
+    last = None
+    while True:
+        chunk = entries
+        if last is not None:
+            chunk = chunk.filter(
+                Q(created_on__gt=last[1]) |
+                Q(created_on=last[1], pk__gt=last[0]))
+        count = 0
+        for last in chunk[:settings.EXPORT_CHUNK_ROWS].iterator():
+            count += 1
+            yield last
+        if count < settings.EXPORT_CHUNK_ROWS:
+            return
+
+
+def _bounds(start, end):
+    # aware datetimes of the start of `start` and the end of `end`
+    tz = timezone.get_current_timezone()
+    since = until = None
+    if start is not None:
+        since = timezone.make_aware(
+            datetime.datetime.combine(start, datetime.time.min), tz)
+    if end is not None:
+        until = timezone.make_aware(
+            datetime.datetime.combine(end + datetime.timedelta(days=1),
+                                      datetime.time.min), tz)
+    return since, until
+
+
+def _text(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
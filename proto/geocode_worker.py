@@ -0,0 +1,104 @@
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.gis.geos import GEOSGeometry
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+from proto import geocoding
+from proto.models import GeocodeCache, Location
+from proto.signals import location_changed
+
+# Geocodes the due locations, oldest change first: the pending ones, and the
+# failed ones and those whose request failed once their cache entry expires
+# (geocode_retry_on). Addresses known to the geocode cache cost no request;
+# the others are asked from a thread pool, rate limited across its threads.
+# A location edited while being geocoded keeps its new address and is
+# queued again. Meant to run in a single process.
+
+
+class RateLimiter(object):
+    # lets at most `per_second` callers through per second, in any thread
+
+    def __init__(self, per_second):
+        self.interval = 1.0 / per_second if per_second else 0
+        self.lock = threading.Lock()
+        self.next_on = 0
+
+    def wait(self):
+        with self.lock:
+            now = time.time()
+            start = max(now, self.next_on)
+            self.next_on = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def drain(batch=None, threads=None, per_second=None):
+    # geocodes up to `batch` pending locations, returns {outcome: locations}
+    batch = settings.GEOCODE_WORKER_BATCH if batch is None else batch
+    threads = settings.GEOCODE_WORKER_THREADS if threads is None else threads
+    limiter = RateLimiter(settings.GEOCODE_RATE_LIMIT
+                          if per_second is None else per_second)
+    pending = list(due().order_by('modified_on', 'pk')[:batch])
+
+    if threads > 1:
+        def work(location):
+            try:
+                return geocode(location, limiter)
+            finally:
+                # every pool thread has its own connection
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            outcomes = list(pool.map(work, pending))
+    else:
+        outcomes = [geocode(location, limiter) for location in pending]
+    return dict(Counter(outcomes))
+
+
+def due():
+    now = timezone.now()
+    return Location.objects.filter(deleted=False).filter(
+        Q(geocode_status=Location.PENDING, geocode_retry_on__isnull=True) |
+        Q(geocode_status__in=[Location.PENDING, Location.FAILED],
+          geocode_retry_on__lte=now))
+
+
+def geocode(location, limiter):
+    # 'ok', 'failed', 'error' or 'changed' (edited meanwhile)
+    address = location.full_address()
+    # expired entries aren't returned, their address is asked again
+    entry = geocoding.lookup(address)
+    if entry is None:
+        limiter.wait()
+        entry = geocoding.resolve(address)
+
+    unchanged = Location.objects.filter(
+        pk=location.pk, geocode_status=location.geocode_status,
+        modified_on=location.modified_on)
+    if entry.status == GeocodeCache.ERROR:
+        # keeps its status until the error expires
+        updated = unchanged.update(geocode_retry_on=entry.expires_on,
+                                   modified_on=timezone.now())
+        return 'error' if updated else 'changed'
+    if entry.status == GeocodeCache.ZERO_RESULTS:
+        updated = unchanged.update(geocode_status=Location.FAILED,
+                                   geocode_retry_on=entry.expires_on,
+                                   modified_on=timezone.now())
+        return 'failed' if updated else 'changed'
+
+    updated = unchanged.update(
+        point=GEOSGeometry('POINT({} {})'.format(entry.lng, entry.lat),
+                           srid=4326),
+        geocode_status=Location.GEOCODED, geocode_retry_on=None,
+        modified_on=timezone.now())
+    if not updated:
+        return 'changed'
+    # update() sends no post_save, the search rows are refreshed here
+    location_changed(Location, location)
+    return 'ok'
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+import datetime
+import logging
+import re
+import unicodedata
+
+import requests
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+# Geocoding behind the GeocodeCache table. Addresses are normalized first,
+# so "Liboristr. 61" and "liboristraße  61" share one entry: found addresses
+# are kept, addresses without results for GEOCODE_NEGATIVE_TTL seconds and
+# failed requests for GEOCODE_ERROR_TTL seconds. The geocoder is asked over
+# HTTP at GEOCODE_URL, which speaks the Google Geocoding API.
+UMLAUTS = {u'ä': u'ae', u'ö': u'oe', u'ü': u'ue', u'ß': u'ss'}
+
+# abbreviations at the end of a word, "Hauptstr." or "Hauptstr"
+ABBREVIATIONS = (
+    (re.compile(r'str\b\.?'), u'strasse'),
+    (re.compile(r'pl\b\.?'), u'platz'),
+)
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(address):
+    address = (address or u'').lower()
+    for umlaut, replacement in UMLAUTS.items():
+        address = address.replace(umlaut, replacement)
+    # other accents are dropped, "é" is "e"
+    address = unicodedata.normalize('NFKD', address)
+    address = u''.join(char for char in address
+                       if not unicodedata.combining(char))
+    for pattern, replacement in ABBREVIATIONS:
+        address = pattern.sub(replacement, address)
+    address = re.sub(r'\s*,\s*', u', ', address)
+    return re.sub(r'\s+', u' ', address).strip(u' ,')
+
+
+def geocode(address):
+    # (lat, lng) of the address, None when it can't be found
+    entry = resolve(address)
+    if entry.status != entry.OK:
+        return None
+    return entry.lat, entry.lng
+
+
+def resolve(address):
+    # the address' cache entry, asking the geocoder when there is none
+    entry = lookup(address)
+    if entry is None:
+        entry = _geocode(normalize(address), address)
+    return entry
+
+
+def lookup(address):
+    # the unexpired cache entry of the address or None
+    # (proto.models imports this module)
+    from proto.models import GeocodeCache
+    return GeocodeCache.objects.filter(address=normalize(address))\
+        .exclude(expires_on__lte=timezone.now()).first()
+
+
+def remember(address, lat, lng, result=None):
+    # stores coordinates known from elsewhere, e.g. the mock data
+    from proto.models import GeocodeCache
+    return _store(normalize(address), GeocodeCache.OK, lat, lng, result)
+
+
+def _request(address):
+    response = requests.get(
+        settings.GEOCODE_URL,
+        params={'address': address, 'key': settings.GOOGLE_MAPS_KEY},
+        timeout=settings.GEOCODE_TIMEOUT)
+    response.raise_for_status()
+    return response.json()
+
+
+def _geocode(normalized, address):
+    from proto.models import GeocodeCache
+    try:
+        answer = _request(address)
+    except (requests.RequestException, ValueError) as e:
+        logger.warning('Geocoding %r failed: %s', address, e)
+        return _store(normalized, GeocodeCache.ERROR,
+                      ttl=settings.GEOCODE_ERROR_TTL)
+    status = answer.get('status')
+    results = answer.get('results')
+    if status == 'ZERO_RESULTS' or status == 'OK' and not results:
+        return _store(normalized, GeocodeCache.ZERO_RESULTS,
+                      ttl=settings.GEOCODE_NEGATIVE_TTL)
+    if status != 'OK':
+        # over the quota, denied key, ...
+        logger.warning('Geocoding %r failed: %s %s', address, status,
+                       answer.get('error_message', ''))
+        return _store(normalized, GeocodeCache.ERROR,
+                      ttl=settings.GEOCODE_ERROR_TTL)
+    location = results[0]['geometry']['location']
+    return _store(normalized, GeocodeCache.OK, location['lat'],
+                  location['lng'], results[0])
+
+
+def _store(normalized, status, lat=None, lng=None, result=None, ttl=None):
+    from proto.models import GeocodeCache
+    values = {
+        'status': status, 'lat': lat, 'lng': lng, 'result': result,
+        'expires_on': timezone.now() + datetime.timedelta(seconds=ttl)
+        if ttl is not None else None,
+    }
+    try:
+        with transaction.atomic():
+            entry, _ = GeocodeCache.objects.update_or_create(
+                address=normalized, defaults=values)
+    except IntegrityError:
+        # stored by a concurrent save of the same address
+        entry = GeocodeCache.objects.get(address=normalized)
+    return entry
@@ -0,0 +1,74 @@
+import math
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+KM_PER_DEGREE = 111.32
+
+
+def encode(lat, lng, precision):
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    cell, bits, bit_count, even = [], 0, 0, True
+    while len(cell) < precision:
+        rng, value = (lng_range, lng) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            cell.append(BASE32[bits])
+            bits, bit_count = 0, 0
+    return ''.join(cell)
+
+
+def spans(precision):
+    # (lat, lng) size of a cell in degrees
+    bits = 5 * precision
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+
+def center(cell):
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in cell:
+        bits = BASE32.index(char)
+        for shift in range(4, -1, -1):
+            rng = lng_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+            if bits >> shift & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+    return (lat_range[0] + lat_range[1]) / 2, (lng_range[0] + lng_range[1]) / 2
+
+
+def neighbourhood(cell):
+    # the cell and its 8 neighbours, fewer at the poles
+    lat, lng = center(cell)
+    lat_span, lng_span = spans(len(cell))
+    cells = set()
+    for d_lat in (-1, 0, 1):
+        n_lat = lat + d_lat * lat_span
+        if not -90 < n_lat < 90:
+            continue
+        for d_lng in (-1, 0, 1):
+            n_lng = (lng + d_lng * lng_span + 180) % 360 - 180
+            cells.add(encode(n_lat, n_lng, len(cell)))
+    return cells
+
+
+def covering_precision(lat, km, max_precision):
+    # finest precision whose cells are at least `km` wide and high at `lat`,
+    # a circle of that radius then stays inside the cell's neighbourhood.
+    # 0 means no cell is big enough.
+    cos_lat = max(math.cos(math.radians(lat)), 0.01)
+    for precision in range(max_precision, 0, -1):
+        lat_span, lng_span = spans(precision)
+        if min(lat_span * KM_PER_DEGREE,
+               lng_span * KM_PER_DEGREE * cos_lat) >= km:
+            return precision
+    return 0
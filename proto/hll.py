@@ -0,0 +1,51 @@
+import hashlib
+import math
+import struct
+
+# HyperLogLog sketches as bytes, one register per byte. 2 ** PRECISION
+# registers give a standard error of about 1.04 / sqrt(2 ** PRECISION),
+# 3.2% for 10. Sketches of different precisions can't be merged, stored
+# sketches have to be dropped when changing it.
+PRECISION = 10
+REGISTERS = 1 << PRECISION
+ALPHA = 0.7213 / (1 + 1.079 / REGISTERS)
+
+
+def empty():
+    return bytes(bytearray(REGISTERS))
+
+
+def add(sketch, values):
+    # sketch with the values added, values are hashed as text
+    registers = bytearray(sketch or empty())
+    for value in values:
+        digest = hashlib.sha1(str(value).encode('utf-8')).digest()
+        hashed = struct.unpack('>Q', digest[:8])[0]
+        index = hashed >> (64 - PRECISION)
+        rest = hashed & ((1 << (64 - PRECISION)) - 1)
+        # position of the first set bit in the remaining 64 - PRECISION bits
+        rank = (64 - PRECISION) - rest.bit_length() + 1
+        if rank > registers[index]:
+            registers[index] = rank
+    return bytes(registers)
+
+
+def merge(sketches):
+    # union of the sketches, register by register
+    registers = bytearray(empty())
+    for sketch in sketches:
+        for index, rank in enumerate(bytearray(sketch)):
+            if rank > registers[index]:
+                registers[index] = rank
+    return bytes(registers)
+
+
+def count(sketch):
+    registers = bytearray(sketch or empty())
+    estimate = ALPHA * REGISTERS ** 2 / sum(2.0 ** -rank
+                                            for rank in registers)
+    zeros = registers.count(0)
+    if estimate <= 2.5 * REGISTERS and zeros:
+        # linear counting is more precise for small cardinalities
+        estimate = REGISTERS * math.log(float(REGISTERS) / zeros)
+    return int(round(estimate))
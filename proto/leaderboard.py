@@ -0,0 +1,109 @@
+import datetime
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models.sql.constants import LOUTER
+from django.db.models.sql.datastructures import Join
+from django.db.models.sql.where import ExtraWhere
+from django.utils import timezone
+
+from proto import geohash
+from proto.models import PhotographerRank
+
+# Photographers ranked by the likes and impressions of their active photos
+# over the last LEADERBOARD_DAYS, per category and per geohash cell of
+# LEADERBOARD_PRECISION their locations are in. A photographer with
+# locations in several cells is ranked in each of them. The categories are
+# the photographer's, the ones the search table's category_slugs hold, so a
+# category board ranks the photographers a category search finds. Rebuilt
+# in one transaction from the daily rollups, readers keep the previous board
+# until it commits.
+REBUILD_SQL = """
+    WITH scores AS (
+        SELECT ph.photographer_id,
+               sum(s.likes) * %(like_weight)s +
+               sum(s.impressions) * %(impression_weight)s AS score
+          FROM proto_photodailystats s
+          JOIN proto_photo ph ON ph.id = s.photo_id
+         WHERE s.day >= %(since)s AND NOT ph.deleted AND NOT ph.disabled
+         GROUP BY ph.photographer_id
+    ), totals AS (
+        SELECT s.photographer_id, c.slug, s.score
+          FROM scores s
+          JOIN proto_category_photographers cp
+            ON cp.photographer_id = s.photographer_id
+          JOIN proto_category c ON c.id = cp.category_id AND NOT c.deleted
+         UNION ALL
+        SELECT photographer_id, '', score FROM scores
+    ), cells AS (
+        SELECT DISTINCT photographer_id,
+               ST_GeoHash(point::geometry, %(precision)s) AS cell
+          FROM proto_location
+         WHERE point IS NOT NULL AND NOT deleted
+    )
+    INSERT INTO proto_photographerrank
+           (category_slug, cell, photographer_id, score, rank)
+    SELECT t.slug, l.cell, t.photographer_id, t.score,
+           rank() OVER (PARTITION BY t.slug, l.cell
+                        ORDER BY t.score DESC)
+      FROM totals t
+      JOIN cells l ON l.photographer_id = t.photographer_id
+      JOIN proto_photographer p ON p.id = t.photographer_id
+     WHERE NOT p.deleted AND NOT p.disabled AND t.score > 0
+"""
+
+# Rank of the row's photographer on the search's board, joined with
+# join_board. Unranked photographers come last.
+UNRANKED = 2147483647
+RANK_SQL = 'coalesce({alias}.rank, %d)' % UNRANKED
+
+
+class BoardJoin(object):
+    # join_field of the LEFT JOIN from the search table to one board, on the
+    # unique (category_slug, cell, photographer) key
+
+    def __init__(self, category_slug, board_cell):
+        self.category_slug = category_slug
+        self.cell = board_cell
+
+    def get_joining_columns(self):
+        return (('photographer_id', 'photographer_id'),)
+
+    def get_extra_restriction(self, where_class, alias, related_alias):
+        return ExtraWhere(
+            ['{0}.category_slug = %s AND {0}.cell = %s'.format(alias)],
+            [self.category_slug, self.cell])
+
+
+def rebuild(days=None):
+    # replaces the board, returns the number of ranks written
+    days = settings.LEADERBOARD_DAYS if days is None else days
+    since = timezone.now().date() - datetime.timedelta(days=days - 1)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('DELETE FROM proto_photographerrank')
+        cursor.execute(REBUILD_SQL, {
+            'since': since,
+            'precision': settings.LEADERBOARD_PRECISION,
+            'like_weight': settings.LEADERBOARD_LIKE_WEIGHT,
+            'impression_weight': settings.LEADERBOARD_IMPRESSION_WEIGHT,
+        })
+        return cursor.rowcount
+
+
+def cell(pnt):
+    # board of a point
+    return geohash.encode(pnt.y, pnt.x, settings.LEADERBOARD_PRECISION)
+
+
+def join_board(query, category_slug, board_cell):
+    # left joins the board to the query's search rows, returns its alias
+    return query.join(Join(
+        PhotographerRank._meta.db_table, query.get_initial_alias(), None,
+        LOUTER, BoardJoin(category_slug or '', board_cell), True))
+
+
+def top(category_slug, board_cell, limit):
+    return PhotographerRank.objects\
+        .filter(category_slug=category_slug or '', cell=board_cell)\
+        .select_related('photographer')\
+        .order_by('rank', 'photographer_id')[:limit]
@@ -0,0 +1,36 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from proto import exports
+
+
+def day(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+
+class Command(BaseCommand):
+    help = 'Write the likes and impressions of a photographer as CSV or ' \
+           'NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('photographer', type=int,
+                            help='Photographer id')
+        parser.add_argument('--start', type=day, default=None,
+                            help='First day, YYYY-MM-DD')
+        parser.add_argument('--end', type=day, default=None,
+                            help='Last day, YYYY-MM-DD')
+        parser.add_argument('--format', choices=exports.FORMATS,
+                            default='csv')
+        parser.add_argument('--metric', action='append',
+                            choices=[metric for metric, _ in exports.METRICS],
+                            help='Only this metric, may be repeated')
+
+    def handle(self, *args, **options):
+        if options['start'] and options['end'] and \
+                options['start'] > options['end']:
+            raise CommandError('--start is after --end')
+        rows = exports.rows(options['photographer'], options['start'],
+                            options['end'], options['metric'])
+        for line in exports.lines(rows, options['format']):
+            self.stdout.write(line, ending='')
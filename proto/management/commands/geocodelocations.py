@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from proto import geocode_worker
+
+
+class Command(BaseCommand):
+    help = 'Geocode the locations saved without coordinates and retry ' \
+           'the failed ones once they are due'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=None,
+                            help='Locations per round '
+                                 '(default: GEOCODE_WORKER_BATCH)')
+        parser.add_argument('--threads', type=int, default=None,
+                            help='Concurrent requests '
+                                 '(default: GEOCODE_WORKER_THREADS)')
+        parser.add_argument('--rate', type=float, default=None,
+                            help='Requests per second '
+                                 '(default: GEOCODE_RATE_LIMIT)')
+        parser.add_argument('--loop', type=int, default=None,
+                            help='Keep running, waiting this many seconds '
+                                 'once nothing is pending')
+
+    def handle(self, *args, **options):
+        while True:
+            outcomes = geocode_worker.drain(options['batch'],
+                                            options['threads'],
+                                            options['rate'])
+            for outcome, count in sorted(outcomes.items()):
+                self.stdout.write('{} {}'.format(count, outcome))
+            if options['loop'] is None:
+                break
+            # failed requests aren't due before their error expires, the
+            # queue empties and the command waits
+            if not outcomes:
+                time.sleep(options['loop'])
@@ -1,4 +1,5 @@
 from django.core.management.base import BaseCommand, CommandError
+from proto import geocoding
 from proto.models import Photographer, PhotographerSubscription, Location,\
     Photo, Category, Subscription, Like
 from django.core.files import File
@@ -184,6 +185,8 @@ class Command(BaseCommand):
             if self.mockLocation:
                 location['lat'] = settings.SEARCH_DEFAULTS['lat']
                 location['lng'] = settings.SEARCH_DEFAULTS['lng']
+            else:
+                self.use_geocode_cache(location)
 
             components = obj['birth_date'].split('.')
 
@@ -232,9 +235,26 @@ class Command(BaseCommand):
 
             s.save()
 
+    def use_geocode_cache(self, location):
+        # coordinates of the csv seed the geocode cache, missing ones are
+        # looked up there before Location.save asks the API
+        address = Location(street=location['street'], city=location['city'],
+                           zip_code=location['zip_code']).full_address()
+        placeholder = settings.INCORRECT_LOCATION_PLACEHOLDER
+        if location['lat'] and location['lng'] and \
+                placeholder not in (location['lat'], location['lng']):
+            geocoding.remember(address, float(location['lat']),
+                               float(location['lng']))
+            return
+        entry = geocoding.lookup(address)
+        if entry is not None and entry.status == entry.OK:
+            location['lat'], location['lng'] = entry.lat, entry.lng
+
     def update_row_location(self, row, location):
         # Location lookup occurs in Location.save, optimize csv for next run without the API
-        if not self.mockLocation:
+        # Pending locations are geocoded later by `manage.py geocodelocations`
+        if not self.mockLocation and \
+                location.geocode_status != Location.PENDING:
             if location.point:
                 if row.get('lng') != location.point.x or\
                     row.get('lat') != location.point.y:
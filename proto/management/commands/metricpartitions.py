@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from proto import partitions
+
+
+class Command(BaseCommand):
+    help = 'Create the coming monthly partitions of the like and ' \
+           'impression tables and archive the expired ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=int,
+                            default=settings.METRICS_PARTITIONS_AHEAD,
+                            help='Months to create partitions for')
+        parser.add_argument('--retention', type=int,
+                            default=settings.METRICS_RETENTION_MONTHS,
+                            help='Months to keep before archiving')
+        parser.add_argument('--archive-dir',
+                            default=settings.METRICS_ARCHIVE_DIR,
+                            help='Directory for the archived partitions')
+
+    def handle(self, *args, **options):
+        created = partitions.create_ahead(options['ahead'])
+        self.stdout.write('{} partitions present'.format(len(created)))
+        for path in partitions.archive_expired(options['retention'],
+                                               options['archive_dir']):
+            self.stdout.write('Archived {}'.format(path))
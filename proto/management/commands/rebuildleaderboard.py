@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from proto import leaderboard
+
+
+class Command(BaseCommand):
+    help = 'Rank the photographers per category and region by the ' \
+           'engagement of their photos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='Days of likes and impressions to count '
+                                 '(default: LEADERBOARD_DAYS)')
+
+    def handle(self, *args, **options):
+        ranks = leaderboard.rebuild(options['days'])
+        self.stdout.write('{} ranks written'.format(ranks))
@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from proto import search_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the denormalized photo search table from scratch'
+
+    def handle(self, *args, **options):
+        if not settings.SEARCH_TABLE:
+            raise CommandError('The search table is off (SEARCH_TABLE)')
+        count = search_index.rebuild()
+        self.stdout.write('Indexed {} photos'.format(count))
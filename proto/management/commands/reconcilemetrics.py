@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from proto import metrics
+
+
+class Command(BaseCommand):
+    help = 'Compare the like and impression counters of every photo with ' \
+           'the Like and Impression rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', default=False,
+                            help='Recount the photos that differ')
+
+    def handle(self, *args, **options):
+        mismatches = metrics.reconcile(fix=options['fix'])
+        for photo_id, like_count, likes, impression_count, impressions \
+                in mismatches:
+            self.stdout.write(
+                'photo #{}: likes {} (counted {}), impressions {} '
+                '(counted {})'.format(photo_id, like_count, likes,
+                                      impression_count, impressions))
+        self.stdout.write('{} photos {}'.format(
+            len(mismatches), 'fixed' if options['fix'] else 'differ'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from proto import rollups
+
+
+class Command(BaseCommand):
+    help = 'Count new likes and impressions into the daily photo stats'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lag', type=int, default=None,
+                            help='Leave rows younger than this many seconds '
+                                 '(default: ROLLUP_LAG)')
+
+    def handle(self, *args, **options):
+        done = rollups.roll_up(lag=options['lag'])
+        for metric, rows in sorted(done.items()):
+            self.stdout.write('Rolled up {} {} rows'.format(rows, metric))
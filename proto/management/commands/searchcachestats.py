@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from proto import search_cache
+
+
+class Command(BaseCommand):
+    help = 'Show the hit/miss counters of the photo search cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', default=False,
+                            help='Reset the counters after showing them')
+
+    def handle(self, *args, **options):
+        stats = search_cache.stats()
+        lookups = stats['hits'] + stats['misses']
+        ratio = 100.0 * stats['hits'] / lookups if lookups else 0
+        self.stdout.write('hits: {hits}, misses: {misses}'.format(**stats))
+        self.stdout.write('hit ratio: {:.1f}%'.format(ratio))
+        if options['reset']:
+            search_cache.reset_stats()
@@ -0,0 +1,237 @@
+import atexit
+import logging
+import os
+import threading
+from collections import Counter, defaultdict, deque
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+
+from proto import viewers
+from proto.models import Impression, Like, Photo
+
+# Photo column counting the rows of each metric model
+COUNTERS = {Like: 'like_count', Impression: 'impression_count'}
+
+# Photos whose counters differ from their likes and impressions: the daily
+# rollups plus the raw rows past the watermark, archived partitions are only
+# left in the rollups
+COUNTED_SQL = """
+    SELECT photo_id, sum(amount) AS amount FROM (
+        SELECT photo_id, {column} AS amount FROM proto_photodailystats
+        UNION ALL
+        SELECT photo_id, count(*) FROM {table}
+         WHERE id > (SELECT coalesce(max(last_id), 0) FROM proto_metricrollup
+                      WHERE metric = '{metric}')
+         GROUP BY photo_id) counted
+     GROUP BY photo_id
+"""
+
+MISMATCHES_SQL = """
+    SELECT p.id, p.like_count, coalesce(l.amount, 0),
+           p.impression_count, coalesce(i.amount, 0)
+      FROM proto_photo p
+      LEFT JOIN ({likes}) l ON l.photo_id = p.id
+      LEFT JOIN ({impressions}) i ON i.photo_id = p.id
+     WHERE p.like_count <> coalesce(l.amount, 0)
+        OR p.impression_count <> coalesce(i.amount, 0)
+""".format(
+    likes=COUNTED_SQL.format(column='likes', table='proto_like',
+                             metric='like'),
+    impressions=COUNTED_SQL.format(column='impressions',
+                                   table='proto_impression',
+                                   metric='impression'))
+
+FIX_SQL = """
+    UPDATE proto_photo p
+       SET like_count = m.likes, impression_count = m.impressions
+      FROM (VALUES {values}) m (id, likes, impressions)
+     WHERE p.id = m.id
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsWriter(object):
+    # Collects Like and Impression instances in-process and writes them with
+    # one bulk_create per model from a background thread, every
+    # `interval_ms` or as soon as `batch_size` events are waiting. At most
+    # `max_pending` events are held, more are dropped and counted. created_on
+    # is set when the batch is written, at most one interval late. A failed
+    # batch is retried in halves down to the events that fail on their own.
+    # Drops and failed events are logged by the flush that sees them.
+
+    def __init__(self, interval_ms, batch_size, max_pending):
+        self.interval = interval_ms / 1000.0
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.condition = threading.Condition()
+        self.pending = deque()
+        self.counters = defaultdict(int)
+        # drops up to the last warning
+        self.reported_dropped = 0
+        self.thread = None
+        self.pid = None
+        self.stopping = False
+
+    def add(self, events):
+        with self.condition:
+            self.ensure_thread()
+            for event in events:
+                if len(self.pending) >= self.max_pending:
+                    self.counters['dropped'] += 1
+                    continue
+                self.pending.append(event)
+                self.counters['queued'] += 1
+            if len(self.pending) >= self.batch_size:
+                self.condition.notify()
+
+    def ensure_thread(self):
+        # (re)started lazily, forked workers don't inherit running threads
+        if self.pid == os.getpid() and self.thread.is_alive():
+            return
+        if self.pid != os.getpid():
+            self.pending.clear()
+        self.pid = os.getpid()
+        self.stopping = False
+        self.thread = threading.Thread(target=self.run,
+                                       name='metrics-writer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while True:
+            with self.condition:
+                if not self.stopping and len(self.pending) < self.batch_size:
+                    self.condition.wait(self.interval)
+                stopping = self.stopping
+            self.flush()
+            if stopping:
+                break
+        connection.close()
+
+    def flush(self):
+        with self.condition:
+            events, self.pending = self.pending, deque()
+            dropped = self.counters['dropped'] - self.reported_dropped
+            self.reported_dropped = self.counters['dropped']
+        if dropped:
+            logger.warning('Dropped %d metric events, %d were already '
+                           'waiting (%s)', dropped, self.max_pending,
+                           self.format_stats())
+        if not events:
+            return 0
+
+        batches = defaultdict(list)
+        for event in events:
+            batches[type(event)].append(event)
+        written = 0
+        for model, batch in batches.items():
+            written += self.write_batch(model, batch)
+        with self.condition:
+            self.counters['flushed'] += written
+        return written
+
+    def write_batch(self, model, batch):
+        # writes the batch, or its halves after a failure so a bad event
+        # only loses itself; returns the number of events written
+        try:
+            write(model, batch, self.batch_size)
+            return len(batch)
+        except Exception:
+            # a lost connection is opened again by the next write
+            if connection.connection is not None and \
+                    not connection.is_usable():
+                connection.close()
+            if len(batch) == 1:
+                with self.condition:
+                    self.counters['failed'] += 1
+                logger.exception('Writing a %s event failed (%s)',
+                                 model.__name__, self.format_stats())
+                return 0
+        middle = len(batch) // 2
+        return self.write_batch(model, batch[:middle]) + \
+            self.write_batch(model, batch[middle:])
+
+    def stop(self):
+        # writes whatever is pending, used on shutdown
+        with self.condition:
+            thread, self.stopping = self.thread, True
+            self.condition.notify()
+        if thread is not None and thread.is_alive() and \
+                self.pid == os.getpid():
+            thread.join()
+        self.flush()
+
+    def stats(self):
+        with self.condition:
+            stats = dict(self.counters)
+            stats['pending'] = len(self.pending)
+        return stats
+
+    def format_stats(self):
+        # "dropped=2 failed=0 ..." for the log
+        return ' '.join('{}={}'.format(name, count)
+                        for name, count in sorted(self.stats().items()))
+
+
+_writer = None
+_lock = threading.Lock()
+
+
+def get_writer():
+    global _writer
+    with _lock:
+        if _writer is None:
+            _writer = MetricsWriter(settings.METRICS_FLUSH_INTERVAL_MS,
+                                    settings.METRICS_FLUSH_EVENTS,
+                                    settings.METRICS_MAX_PENDING)
+            atexit.register(_writer.stop)
+        return _writer
+
+
+def record(events):
+    # Like / Impression instances, written later unless buffering is off
+    events = list(events)
+    if not events:
+        return
+    if settings.METRICS_BUFFERED:
+        get_writer().add(events)
+    else:
+        write(events[0].__class__, events)
+
+
+def write(model, events, batch_size=None):
+    # inserts the events and adds them to the photos' counters
+    with transaction.atomic():
+        model.objects.bulk_create(events, batch_size)
+        increment(model, Counter(event.photo_id for event in events))
+        if model is Impression:
+            viewers.record(events)
+
+
+def increment(model, counts):
+    # counts: {photo_id: new rows}, one UPDATE per distinct amount
+    column = COUNTERS[model]
+    by_amount = defaultdict(list)
+    for photo_id, amount in counts.items():
+        by_amount[amount].append(photo_id)
+    for amount, photo_ids in by_amount.items():
+        Photo.objects.filter(pk__in=sorted(photo_ids))\
+            .update(**{column: F(column) + amount})
+
+
+def reconcile(fix=False):
+    # [(photo_id, like_count, likes, impression_count, impressions)] of the
+    # photos whose counters drifted, recounted when `fix` is set
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(MISMATCHES_SQL)
+        mismatches = cursor.fetchall()
+        if fix and mismatches:
+            cursor.execute(
+                FIX_SQL.format(values=', '.join(
+                    ['(%s, %s, %s)'] * len(mismatches))),
+                [value for photo_id, _, likes, _, impressions in mismatches
+                 for value in (photo_id, likes, impressions)])
+    return mismatches
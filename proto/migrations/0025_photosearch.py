@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.gis.db.models.fields
+import django.contrib.postgres.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proto', '0024_photographer_is_mock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhotoSearch',
+            fields=[
+                ('photo', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_entry', serialize=False, to='proto.Photo')),
+                ('points', django.contrib.gis.db.models.fields.MultiPointField(geography=True, null=True, spatial_index=False, srid=4326)),
+                ('category_slugs', django.contrib.postgres.fields.ArrayField(base_field=models.SlugField(), default=list, size=None)),
+                ('disabled', models.BooleanField(default=False)),
+                ('deleted', models.BooleanField(default=False)),
+                ('photographer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_entries', to='proto.Photographer')),
+            ],
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX proto_photosearch_active_points '
+            'ON proto_photosearch USING GIST (points) '
+            'WHERE disabled = false AND deleted = false',
+            reverse_sql='DROP INDEX proto_photosearch_active_points',
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX proto_photosearch_category_slugs '
+            'ON proto_photosearch USING GIN (category_slugs)',
+            reverse_sql='DROP INDEX proto_photosearch_category_slugs',
+        ),
+    ]
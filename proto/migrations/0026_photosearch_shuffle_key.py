@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# must match proto.search_index.SHUFFLE_SEEDS
+SHUFFLE_SEEDS = 8
+
+CREATE_FUNCTION = """
+    CREATE OR REPLACE FUNCTION proto_shuffle_key(seed integer, id integer)
+    RETURNS integer AS $$
+        SELECT ('x' || substr(md5(seed::text || ':' || id::text), 1, 8))
+               ::bit(32)::integer
+    $$ LANGUAGE sql IMMUTABLE STRICT
+"""
+
+CREATE_INDEX = """
+    CREATE INDEX proto_photosearch_shuffle_{seed}
+    ON proto_photosearch (proto_shuffle_key({seed}, photo_id), photo_id)
+    WHERE disabled = false AND deleted = false
+"""
+
+DROP_INDEX = 'DROP INDEX proto_photosearch_shuffle_{seed}'
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proto', '0025_photosearch'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            CREATE_FUNCTION,
+            reverse_sql='DROP FUNCTION proto_shuffle_key(integer, integer)',
+        ),
+    ] + [
+        migrations.RunSQL(CREATE_INDEX.format(seed=seed),
+                          reverse_sql=DROP_INDEX.format(seed=seed))
+        for seed in range(SHUFFLE_SEEDS)
+    ]
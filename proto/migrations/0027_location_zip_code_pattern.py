@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# zip code prefix searches (LIKE '105%') can only use a varchar_pattern_ops
+# index under non-C collations. Databases created by 0001 usually have one
+# already (Django adds a `_like` index next to db_index), so only create it
+# where it is missing.
+CREATE_INDEX = """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (
+            SELECT 1 FROM pg_indexes
+            WHERE tablename = 'proto_location'
+              AND indexdef LIKE '%(zip_code varchar_pattern_ops)%'
+        ) THEN
+            CREATE INDEX proto_location_zip_code_pattern
+            ON proto_location (zip_code varchar_pattern_ops);
+        END IF;
+    END
+    $$
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proto', '0026_photosearch_shuffle_key'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            CREATE_INDEX,
+            reverse_sql='DROP INDEX IF EXISTS proto_location_zip_code_pattern',
+        ),
+    ]
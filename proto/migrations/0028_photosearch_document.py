@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# Weighted full-text document of every search row: photo title (A), company
+# name (B) and photo description (C). Django has no tsvector field, the
+# column is only read and written through raw SQL in proto.search_index.
+ADD_COLUMN = """
+    ALTER TABLE proto_photosearch ADD COLUMN document tsvector;
+
+    UPDATE proto_photosearch s
+       SET document =
+           setweight(to_tsvector('simple', coalesce(ph.title, '')), 'A') ||
+           setweight(to_tsvector('simple', coalesce(p.company_name, '')), 'B') ||
+           setweight(to_tsvector('simple', coalesce(ph.description, '')), 'C')
+      FROM proto_photo ph
+      JOIN proto_photographer p ON p.id = ph.photographer_id
+     WHERE ph.id = s.photo_id;
+
+    CREATE INDEX proto_photosearch_document
+    ON proto_photosearch USING gin (document)
+    WHERE disabled = false AND deleted = false;
+"""
+
+DROP_COLUMN = """
+    DROP INDEX proto_photosearch_document;
+    ALTER TABLE proto_photosearch DROP COLUMN document;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proto', '0027_location_zip_code_pattern'),
+    ]
+
+    operations = [
+        migrations.RunSQL(ADD_COLUMN, reverse_sql=DROP_COLUMN),
+    ]
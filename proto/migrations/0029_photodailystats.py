@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proto', '0028_photosearch_document'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetricRollup',
+            fields=[
+                ('metric', models.CharField(max_length=20, primary_key=True, serialize=False)),
+                ('last_id', models.BigIntegerField(default=0)),
+                ('rolled_up_on', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PhotoDailyStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(db_index=True)),
+                ('likes', models.PositiveIntegerField(default=0)),
+                ('impressions', models.PositiveIntegerField(default=0)),
+                ('photo', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='daily_stats', to='proto.Photo')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='photodailystats',
+            unique_together=set([('photo', 'day')]),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+BACKFILL = """
+    UPDATE proto_photo p
+       SET like_count = (SELECT count(*) FROM proto_like
+                          WHERE photo_id = p.id),
+           impression_count = (SELECT count(*) FROM proto_impression
+                                WHERE photo_id = p.id)
+"""
+
+# Photographer.top_photos(): the photographer's photos by likes
+CREATE_INDEX = """
+    CREATE INDEX proto_photo_top
+    ON proto_photo (photographer_id, like_count DESC, created_on, modified_on)
+    WHERE deleted = false
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proto', '0029_photodailystats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='impression_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunSQL(BACKFILL, reverse_sql=migrations.RunSQL.noop),
+        migrations.RunSQL(CREATE_INDEX,
+                          reverse_sql='DROP INDEX proto_photo_top'),
+    ]
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proto', '0030_photo_metric_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhotographerViewerSketch',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('registers', models.BinaryField()),
+                ('photographer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='viewer_sketches', to='proto.Photographer')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PhotoViewerSketch',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('registers', models.BinaryField()),
+                ('photo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='viewer_sketches', to='proto.Photo')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='photoviewersketch',
+            unique_together=set([('photo', 'day')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='photographerviewersketch',
+            unique_together=set([('photographer', 'day')]),
+        ),
+    ]
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# Creates the monthly partition of `parent` holding `month`, if missing.
+# Rows that already went to the default partition for that month are moved
+# over, otherwise attaching the partition would fail. Also used by
+# `manage.py metricpartitions` (see proto.partitions).
+CREATE_FUNCTION = """
+    CREATE OR REPLACE FUNCTION proto_create_month_partition(parent text,
+                                                            month date)
+    RETURNS text AS $$
+    DECLARE
+        lower_bound timestamptz := date_trunc('month', month::timestamp)
+                                   AT TIME ZONE 'UTC';
+        upper_bound timestamptz := (date_trunc('month', month::timestamp) +
+                                    interval '1 month') AT TIME ZONE 'UTC';
+        name text := parent || '_' || to_char(month, 'YYYY_MM');
+    BEGIN
+        IF to_regclass(name) IS NOT NULL THEN
+            RETURN name;
+        END IF;
+        EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS)',
+                       name, parent);
+        EXECUTE format(
+            'WITH moved AS (DELETE FROM %I WHERE created_on >= %L '
+            'AND created_on < %L RETURNING *) '
+            'INSERT INTO %I SELECT * FROM moved',
+            parent || '_default', lower_bound, upper_bound, name);
+        EXECUTE format(
+            'ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+            parent, name, lower_bound, upper_bound);
+        RETURN name;
+    END
+    $$ LANGUAGE plpgsql
+"""
+
+DROP_FUNCTION = 'DROP FUNCTION proto_create_month_partition(text, date)'
+
+# Swaps the table for a copy partitioned by month of created_on. The primary
+# key has to include the partition column, ids still come from the old
+# sequence and stay unique.
+PARTITION = """
+    ALTER TABLE {table} RENAME TO {table}_unpartitioned;
+
+    CREATE TABLE {table} (LIKE {table}_unpartitioned INCLUDING DEFAULTS)
+    PARTITION BY RANGE (created_on);
+    ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id;
+
+    ALTER TABLE {table} ADD PRIMARY KEY (id, created_on);
+    ALTER TABLE {table} ADD CONSTRAINT {table}_photo_id_fk
+        FOREIGN KEY (photo_id) REFERENCES proto_photo (id)
+        DEFERRABLE INITIALLY DEFERRED;
+    ALTER TABLE {table} ADD CONSTRAINT {table}_user_id_fk
+        FOREIGN KEY (user_id) REFERENCES auth_user (id)
+        DEFERRABLE INITIALLY DEFERRED;
+    CREATE INDEX {table}_photo_id_created_on ON {table} (photo_id, created_on);
+    CREATE INDEX {table}_user_id ON {table} (user_id);
+    CREATE INDEX {table}_id ON {table} (id);
+
+    CREATE TABLE {table}_default PARTITION OF {table} DEFAULT;
+    SELECT proto_create_month_partition('{table}', m::date)
+      FROM generate_series(
+               date_trunc('month', coalesce(
+                   (SELECT min(created_on) FROM {table}_unpartitioned),
+                   now())),
+               date_trunc('month', now()) + interval '3 months',
+               interval '1 month') m;
+
+    INSERT INTO {table} SELECT * FROM {table}_unpartitioned;
+    DROP TABLE {table}_unpartitioned;
+"""
+
+UNPARTITION = """
+    CREATE TABLE {table}_partitioned (LIKE {table} INCLUDING DEFAULTS);
+    INSERT INTO {table}_partitioned SELECT * FROM {table};
+    ALTER SEQUENCE {table}_id_seq OWNED BY {table}_partitioned.id;
+    DROP TABLE {table};
+    ALTER TABLE {table}_partitioned RENAME TO {table};
+
+    ALTER TABLE {table} ADD PRIMARY KEY (id);
+    ALTER TABLE {table} ADD CONSTRAINT {table}_photo_id_fk
+        FOREIGN KEY (photo_id) REFERENCES proto_photo (id)
+        DEFERRABLE INITIALLY DEFERRED;
+    ALTER TABLE {table} ADD CONSTRAINT {table}_user_id_fk
+        FOREIGN KEY (user_id) REFERENCES auth_user (id)
+        DEFERRABLE INITIALLY DEFERRED;
+    CREATE INDEX {table}_photo_id ON {table} (photo_id);
+    CREATE INDEX {table}_user_id ON {table} (user_id);
+"""
+
+TABLES = ('proto_like', 'proto_impression')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proto', '0031_viewer_sketches'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_FUNCTION, reverse_sql=DROP_FUNCTION),
+    ] + [
+        migrations.RunSQL(PARTITION.format(table=table),
+                          reverse_sql=UNPARTITION.format(table=table))
+        for table in TABLES
+    ]
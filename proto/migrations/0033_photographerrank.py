@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proto', '0032_partition_metrics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhotographerRank',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category_slug', models.CharField(blank=True, max_length=50)),
+                ('cell', models.CharField(max_length=12)),
+                ('score', models.FloatField()),
+                ('rank', models.PositiveIntegerField()),
+                ('photographer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ranks', to='proto.Photographer')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='photographerrank',
+            unique_together=set([('category_slug', 'cell', 'photographer')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='photographerrank',
+            index_together=set([('category_slug', 'cell', 'rank')]),
+        ),
+    ]
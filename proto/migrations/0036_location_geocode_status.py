@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+# the geocoding worker's queue
+CREATE_INDEX = """
+    CREATE INDEX proto_location_geocode_pending
+    ON proto_location (modified_on, id)
+    WHERE geocode_status = 'pending'
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proto', '0035_geocodecache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='location',
+            name='geocode_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('ok', 'Geocoded'), ('failed', 'Not found')], default='ok', max_length=10),
+        ),
+        migrations.RunSQL(CREATE_INDEX,
+                          reverse_sql='DROP INDEX proto_location_geocode_pending'),
+    ]
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+# the geocoding worker's queue takes the failed locations back once they
+# are due
+CREATE_INDEX = """
+    CREATE INDEX proto_location_geocode_queue
+    ON proto_location (modified_on, id)
+    WHERE geocode_status <> 'ok'
+"""
+
+CREATE_PENDING_INDEX = """
+    CREATE INDEX proto_location_geocode_pending
+    ON proto_location (modified_on, id)
+    WHERE geocode_status = 'pending'
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proto', '0036_location_geocode_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='location',
+            name='geocode_retry_on',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunSQL('DROP INDEX proto_location_geocode_pending',
+                          reverse_sql=CREATE_PENDING_INDEX),
+        migrations.RunSQL(CREATE_INDEX,
+                          reverse_sql='DROP INDEX proto_location_geocode_queue'),
+    ]
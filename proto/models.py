@@ -1,19 +1,20 @@
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.gis.db import models
 from django.core.files.storage import FileSystemStorage
-from django.db.models import Count
 from django.contrib.auth.models import User
 from django.conf import settings
 from django.contrib.gis.geos import GEOSGeometry
+from django.contrib.postgres.fields import ArrayField, JSONField
 from phonenumber_field.modelfields import PhoneNumberField
 from django.template.defaultfilters import slugify
 import datetime
-import googlemaps
 import logging
 
 from safedelete import safedelete_mixin_factory, SOFT_DELETE, \
     DELETED_VISIBLE_BY_PK, safedelete_manager_factory, DELETED_INVISIBLE
 
+from proto import geocoding, rollups, sampling
+
 
 class TimeStampedModel(models.Model):
     created_on = models.DateTimeField(auto_now_add=True)
@@ -79,9 +80,8 @@ class Photographer(TimeStampedModel, SoftDeletableModel):
     is_mock = models.BooleanField(default=False)
 
     def top_photos(self):
-        # Returns n top photos by likes
+        # Returns n top photos by likes, an index scan on proto_photo_top
         return self.photos\
-            .annotate(like_count=Count('likes'))\
             .order_by('-like_count', 'created_on', 'modified_on')\
             [:settings.TOP_PHOTOS_COUNT]
 
@@ -90,17 +90,22 @@ class Photographer(TimeStampedModel, SoftDeletableModel):
         # only one
         today = datetime.date.today()
         photographer_subscription = \
-            self.subscriptions.get(disabled=False, start__gte=today,
-                                   end__lte=today)
+            self.subscriptions.get(disabled=False, start__lte=today,
+                                   end__gte=today)
         return photographer_subscription.subscription
 
     def likes(self):
-        photos = self.photos.all()
-        return Like.objects.filter(photo__in=photos).count()
+        return self.metric_totals()['likes']
 
     def impressions(self):
-        photos = self.photos.all()
-        return Impression.objects.filter(photo__in=photos).count()
+        return self.metric_totals()['impressions']
+
+    def metric_totals(self):
+        # daily rollups plus the raw rows not rolled up yet, read once per
+        # instance
+        if not hasattr(self, '_metric_totals'):
+            self._metric_totals = rollups.photographer_totals(self.pk)
+        return self._metric_totals
 
     def active_categories(self):
         return Category.objects.filter(photos__in=self.active_photos()).distinct()
@@ -109,7 +114,8 @@ class Photographer(TimeStampedModel, SoftDeletableModel):
         return self.active_photos().filter(category__in=[category])
 
     def random_category_photo(self, category):
-        return self.category_photos(category).order_by('?').first()
+        photos = sampling.sample(self.category_photos(category), 1)
+        return photos[0] if photos else None
 
     def active_photos(self):
         return self.photos.filter(disabled=False, deleted=False)
@@ -126,11 +132,17 @@ class Photo(TimeStampedModel, SoftDeletableModel):
     description = models.CharField(max_length=255, default='')
     image = models.ImageField(upload_to='proto/gallery')
     photographer = models.ForeignKey(Photographer, related_name='photos')
+    # running totals of the photo's Like and Impression rows, kept by the
+    # metric write path and checked by `manage.py reconcilemetrics`
+    like_count = models.PositiveIntegerField(default=0)
+    impression_count = models.PositiveIntegerField(default=0)
     categories = models.ManyToManyField('Category',
                                         through=Category.photos.through)
 
     class Meta:
-        ordering = ['?']
+        # newest first, served by the primary key; random photos come from
+        # proto.sampling and proto.photo_pool
+        ordering = ['-id']
 
     def __str__(self):
         return "{} #{}".format(self.photographer.full_name(),
@@ -138,7 +150,14 @@ class Photo(TimeStampedModel, SoftDeletableModel):
 
 
 class Location(TimeStampedModel, SoftDeletableModel):
-    SCALE = 100
+    # geocode_status: addresses without coordinates are saved pending and
+    # geocoded by `manage.py geocodelocations`, searches only see geocoded
+    # locations
+    PENDING = 'pending'
+    GEOCODED = 'ok'
+    FAILED = 'failed'
+    GEOCODE_STATUSES = ((PENDING, 'Pending'), (GEOCODED, 'Geocoded'),
+                        (FAILED, 'Not found'))
     zip_code = models.CharField(max_length=10, db_index=True)
     country = models.CharField(max_length=255)
     state = models.CharField(max_length=255)
@@ -148,32 +167,52 @@ class Location(TimeStampedModel, SoftDeletableModel):
                                      related_name='locations')
     objects = models.GeoManager()
     point = models.PointField(null=True, blank=True, srid=4326, geography=True)
+    geocode_status = models.CharField(max_length=10, choices=GEOCODE_STATUSES,
+                                      default=GEOCODED)
+    # when the worker asks again for a failed address or one whose request
+    # failed, None for new addresses and not found ones that don't expire
+    geocode_retry_on = models.DateTimeField(null=True, blank=True)
 
     def __init__(self, *args, **kwargs):
         self.lat = kwargs.pop('lat', None)
         self.lng = kwargs.pop('lng', None)
         super(Location, self).__init__(*args, **kwargs)
+        # the address the point belongs to
+        self._saved_address = self.full_address() if self.pk else None
 
     def save(self, *args, **kwargs):
-        # TODO: implement test that checks that this logic does not occur when
-        # values are passed
+        # Never waits for the geocoder: coordinates are passed, kept from the
+        # unchanged address or known to the geocode cache, otherwise the
+        # location is saved pending
+        placeholder = settings.INCORRECT_LOCATION_PLACEHOLDER
+        address = self.full_address()
+        if (not self.lat or not self.lng) and self.point is not None and \
+                address == self._saved_address:
+            # an edit of other fields or a soft delete
+            super(Location, self).save(*args, **kwargs)
+            return
+
+        retry_on = None
         if not self.lat or not self.lng:
-            try:
-                client = googlemaps.Client(key=settings.GOOGLE_MAPS_KEY)
-                geo_data = client.geocode(self.full_address())
-                location = geo_data[0]['geometry']['location']
-                self.lng = location['lng']
-                self.lat = location['lat']
-
-            except (AttributeError, IndexError, googlemaps.exceptions.Timeout) as e:
-                logging.warning("GeoLocation not found for {} \n Exception: {}\n\n"
-                                .format(self.full_address(), e))
-
-        if all([cord not in [None, settings.INCORRECT_LOCATION_PLACEHOLDER] for
-                cord in [self.lat, self.lng]]):
+            entry = geocoding.lookup(address)
+            if entry is not None and entry.status == entry.OK:
+                self.lat, self.lng = entry.lat, entry.lng
+            elif entry is not None and entry.status == entry.ZERO_RESULTS:
+                self.lat = self.lng = placeholder
+                retry_on = entry.expires_on
+
+        if placeholder in (self.lat, self.lng):
+            logging.warning("GeoLocation not found for {}".format(address))
+            self.point, self.geocode_status = None, self.FAILED
+        elif self.lat and self.lng:
             point = "POINT({} {})".format(self.lng, self.lat)
             self.point = GEOSGeometry(point, srid=4326)
-            super(Location, self).save(*args, **kwargs)
+            self.geocode_status = self.GEOCODED
+        else:
+            self.point, self.geocode_status = None, self.PENDING
+        self.geocode_retry_on = retry_on
+        super(Location, self).save(*args, **kwargs)
+        self._saved_address = address
 
     def full_address(self):
         return "{}, {}, {}"\
@@ -185,6 +224,34 @@ class Location(TimeStampedModel, SoftDeletableModel):
                                    self.point)
 
 
+class PhotoSearch(models.Model):
+    # Flat copy of everything the photo search filters on, one row per photo.
+    # Kept in sync by proto.signals, rebuilt with `manage.py rebuildsearchindex`
+    photo = models.OneToOneField(Photo, on_delete=models.CASCADE,
+                                 primary_key=True,
+                                 related_name='search_entry')
+    photographer = models.ForeignKey(Photographer, on_delete=models.CASCADE,
+                                     related_name='search_entries')
+    # partial GiST index over active rows is created in the migration
+    points = models.MultiPointField(null=True, srid=4326, geography=True,
+                                    spatial_index=False)
+    category_slugs = ArrayField(models.SlugField(), default=list)
+    disabled = models.BooleanField(default=False)
+    deleted = models.BooleanField(default=False)
+    # plus a `document` tsvector column for keyword search, added by
+    # migration 0028 and only used through raw SQL
+    objects = models.GeoManager()
+
+    if not settings.SEARCH_TABLE:
+        # see settings.SEARCH_TABLE; only then, so the migrations' state of
+        # the model stays the same
+        class Meta:
+            managed = False
+
+    def __str__(self):
+        return "search entry for photo #{}".format(self.photo_id)
+
+
 class Subscription(TimeStampedModel, SoftDeletableModel):
     name = models.CharField(max_length=150)
     description = models.CharField(max_length=255, blank=True)
@@ -227,3 +294,81 @@ class Impression(Metric):
     photo = models.ForeignKey(Photo,
                               on_delete=models.DO_NOTHING,
                               related_name='impressions')
+
+
+class PhotoDailyStats(models.Model):
+    # Likes and impressions per photo and UTC day, filled from the raw metric
+    # tables by `manage.py rollupmetrics` (see proto.rollups)
+    photo = models.ForeignKey(Photo, on_delete=models.DO_NOTHING,
+                              related_name='daily_stats')
+    day = models.DateField(db_index=True)
+    likes = models.PositiveIntegerField(default=0)
+    impressions = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('photo', 'day')
+
+
+class MetricRollup(models.Model):
+    # Watermark of a raw metric table: rows up to last_id are in
+    # PhotoDailyStats
+    metric = models.CharField(max_length=20, primary_key=True)
+    last_id = models.BigIntegerField(default=0)
+    rolled_up_on = models.DateTimeField(auto_now=True)
+
+
+class PhotoViewerSketch(models.Model):
+    # HyperLogLog sketch of a photo's viewers on one UTC day (see
+    # proto.viewers)
+    photo = models.ForeignKey(Photo, on_delete=models.CASCADE,
+                              related_name='viewer_sketches')
+    day = models.DateField()
+    registers = models.BinaryField()
+
+    class Meta:
+        unique_together = ('photo', 'day')
+
+
+class PhotographerViewerSketch(models.Model):
+    # HyperLogLog sketch of the viewers of all of a photographer's photos on
+    # one UTC day
+    photographer = models.ForeignKey(Photographer, on_delete=models.CASCADE,
+                                     related_name='viewer_sketches')
+    day = models.DateField()
+    registers = models.BinaryField()
+
+    class Meta:
+        unique_together = ('photographer', 'day')
+
+
+class PhotographerRank(models.Model):
+    # Leaderboard row: the photographer's engagement score and rank among
+    # the photographers of one category ('' for all) with a location in one
+    # geohash cell, rebuilt by `manage.py rebuildleaderboard` (see
+    # proto.leaderboard)
+    category_slug = models.CharField(max_length=50, blank=True)
+    cell = models.CharField(max_length=12)
+    photographer = models.ForeignKey(Photographer, on_delete=models.CASCADE,
+                                     related_name='ranks')
+    score = models.FloatField()
+    rank = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ('category_slug', 'cell', 'photographer')
+        index_together = ('category_slug', 'cell', 'rank')
+
+
+class GeocodeCache(TimeStampedModel):
+    # Geocoding answer for a normalized address (see proto.geocoding), the
+    # failed ones too so they aren't asked again before expires_on
+    OK = 'OK'
+    ZERO_RESULTS = 'ZERO_RESULTS'
+    ERROR = 'ERROR'
+    STATUSES = ((OK, 'Found'), (ZERO_RESULTS, 'Not found'), (ERROR, 'Failed'))
+
+    address = models.TextField(unique=True)
+    status = models.CharField(max_length=20, choices=STATUSES)
+    lat = models.FloatField(null=True, blank=True)
+    lng = models.FloatField(null=True, blank=True)
+    result = JSONField(null=True, blank=True)
+    expires_on = models.DateTimeField(null=True, blank=True)
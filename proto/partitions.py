@@ -0,0 +1,109 @@
+import datetime
+import gzip
+import logging
+import os
+import re
+
+from django.db import connection, transaction
+
+from proto.models import MetricRollup
+from proto.rollups import METRICS
+
+# Monthly partitions of the raw metric tables (see migration 0032), named
+# <table>_<yyyy>_<mm>. Old partitions are archived as gzipped CSV once their
+# rows are in the daily rollups, then dropped.
+PARTITION_NAME = re.compile(r'^(?P<table>\w+)_(?P<year>\d{4})_(?P<month>\d{2})$')
+
+PARTITIONS_SQL = """
+    SELECT c.relname
+      FROM pg_inherits i
+      JOIN pg_class c ON c.oid = i.inhrelid
+      JOIN pg_class p ON p.oid = i.inhparent
+     WHERE p.relname = %s
+     ORDER BY c.relname
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def create_ahead(months, today=None):
+    # makes sure the partitions from this month to `months` ahead exist
+    month = _month(today or datetime.date.today())
+    created = []
+    with connection.cursor() as cursor:
+        for _ in range(months + 1):
+            for _, table, _ in METRICS:
+                cursor.execute('SELECT proto_create_month_partition(%s, %s)',
+                               [table, month])
+                created.append(cursor.fetchone()[0])
+            month = _next_month(month)
+    return created
+
+
+def archive_expired(retention_months, directory, today=None):
+    # Detaches, archives and drops the partitions that ended more than
+    # `retention_months` ago. Partitions with rows past the rollup
+    # watermark are kept. Returns the archive files written.
+    cutoff = _month(today or datetime.date.today())
+    for _ in range(retention_months):
+        cutoff = _previous_month(cutoff)
+    watermarks = dict(MetricRollup.objects.values_list('metric', 'last_id'))
+
+    archived = []
+    for metric, table, _ in METRICS:
+        for name in expired(table, cutoff):
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT max(id) FROM {}'.format(name))
+                last_id = cursor.fetchone()[0]
+            if last_id is not None and last_id > watermarks.get(metric, 0):
+                logger.warning('Not archiving %s, it is not rolled up yet',
+                               name)
+                continue
+            archived.append(_archive(table, name, directory))
+    return archived
+
+
+def expired(table, cutoff):
+    # partitions of `table` for months before the `cutoff` month
+    with connection.cursor() as cursor:
+        cursor.execute(PARTITIONS_SQL, [table])
+        names = [row[0] for row in cursor.fetchall()]
+    found = []
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match and match.group('table') == table:
+            month = datetime.date(int(match.group('year')),
+                                  int(match.group('month')), 1)
+            if month < cutoff:
+                found.append(name)
+    return found
+
+
+def _archive(table, name, directory):
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    path = os.path.join(directory, '{}.csv.gz'.format(name))
+    with transaction.atomic(), connection.cursor() as cursor:
+        # detached first, so nothing can be written to it while copying
+        cursor.execute('ALTER TABLE {} DETACH PARTITION {}'.format(table,
+                                                                   name))
+        partial = path + '.partial'
+        with gzip.open(partial, 'wb') as archive:
+            cursor.copy_expert(
+                'COPY {} TO STDOUT WITH (FORMAT csv, HEADER)'.format(name),
+                archive)
+        os.rename(partial, path)
+        cursor.execute('DROP TABLE {}'.format(name))
+    return path
+
+
+def _month(day):
+    return day.replace(day=1)
+
+
+def _next_month(month):
+    return (month + datetime.timedelta(days=31)).replace(day=1)
+
+
+def _previous_month(month):
+    return (month - datetime.timedelta(days=1)).replace(day=1)
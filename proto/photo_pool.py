@@ -0,0 +1,57 @@
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from proto import search_backends
+from proto.models import Photo
+
+# Random active photo ids for the home page, kept in the cache. Reading the
+# pool never sorts the photo table: a stale pool is still served while one
+# request rebuilds it in a background thread, only an empty cache builds it
+# in the request itself.
+POOL = 'photo_pool'
+LOCK = POOL + ':lock'
+
+logger = logging.getLogger(__name__)
+
+
+def sample(count):
+    # up to `count` random active photos
+    ids = get_ids()
+    ids = random.sample(ids, min(count, len(ids)))
+    # the pool may be older than the last change of a photo
+    return Photo.objects.filter(pk__in=ids, disabled=False,
+                                photographer__disabled=False,
+                                photographer__deleted=False).order_by()
+
+
+def get_ids():
+    pool = cache.get(POOL)
+    if pool is None:
+        return refresh()
+    if time.time() - pool['built_on'] > settings.PHOTO_POOL_REFRESH:
+        # only one worker rebuilds, everybody keeps serving the old pool
+        if cache.add(LOCK, True, settings.PHOTO_POOL_REFRESH):
+            threading.Thread(target=_refresh_in_background).start()
+    return pool['ids']
+
+
+def refresh():
+    ids = search_backends.get_backend().sample_ids(settings.PHOTO_POOL_SIZE)
+    cache.set(POOL, {'ids': ids, 'built_on': time.time()}, None)
+    return ids
+
+
+def _refresh_in_background():
+    try:
+        refresh()
+    except Exception:
+        logger.exception('Refreshing the photo pool failed')
+    finally:
+        cache.delete(LOCK)
+        connection.close()
@@ -0,0 +1,61 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, IntegerField
+from django.db.models.expressions import RawSQL
+
+from proto.models import Category, Photo
+
+# Numbers of the settings panel's portfolio: the photographer's active photos
+# per category, in total and the top photos, from two grouped queries. Cached
+# per photographer, photo saves and deletes and changed photo categories drop
+# the entry; like counts only catch up after PORTFOLIO_CACHE_TIMEOUT.
+PREFIX = 'portfolio'
+
+ACTIVE_PHOTOS_SQL = """
+    SELECT count(*) FROM proto_photo
+     WHERE photographer_id = %s AND NOT disabled AND NOT deleted
+"""
+
+
+def summary(photographer_id):
+    # {'photos': active photos, 'categories': [(category, active photos)],
+    #  'top_photos': [photo]}
+    key = _key(photographer_id)
+    result = cache.get(key)
+    if result is None:
+        result = _summary(photographer_id)
+        cache.set(key, result, settings.PORTFOLIO_CACHE_TIMEOUT)
+    return result
+
+
+def changed(photographer_ids):
+    cache.delete_many([_key(pk) for pk in photographer_ids if pk is not None])
+
+
+def _summary(photographer_id):
+    categories = Category.objects.filter(
+        photos__photographer_id=photographer_id, photos__disabled=False,
+        photos__deleted=False)\
+        .annotate(photo_count=Count('photos'))\
+        .order_by('name', 'pk')
+    # the active total rides along with the top photos
+    top_photos = list(
+        Photo.objects.filter(photographer_id=photographer_id)
+        .annotate(active_photos=RawSQL(ACTIVE_PHOTOS_SQL, [photographer_id],
+                                       output_field=IntegerField()))
+        .order_by('-like_count', 'created_on', 'modified_on')
+        [:settings.TOP_PHOTOS_COUNT])
+    if top_photos:
+        photos = top_photos[0].active_photos
+    else:
+        photos = 0
+    return {
+        'photos': photos,
+        'categories': [(category, category.photo_count)
+                       for category in categories],
+        'top_photos': top_photos,
+    }
+
+
+def _key(photographer_id):
+    return '{}:{}'.format(PREFIX, photographer_id)
@@ -0,0 +1,183 @@
+import datetime
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+# Raw metric tables and the PhotoDailyStats column they are counted into.
+# Every table has a watermark row in proto_metricrollup: rows with an id up
+# to last_id are rolled up, the rest is the tail readers count themselves.
+METRICS = (
+    ('like', 'proto_like', 'likes'),
+    ('impression', 'proto_impression', 'impressions'),
+)
+
+ENSURE_WATERMARK_SQL = """
+    INSERT INTO proto_metricrollup (metric, last_id, rolled_up_on)
+    VALUES (%s, 0, now())
+    ON CONFLICT (metric) DO NOTHING
+"""
+
+LOCK_WATERMARK_SQL = """
+    SELECT last_id FROM proto_metricrollup WHERE metric = %s FOR UPDATE
+"""
+
+# Rows written within the last ROLLUP_LAG seconds stay in the tail, a
+# transaction still inserting below them would otherwise be skipped. Without
+# recent rows the bound is the largest bigint (PostgreSQL before 14 has no
+# numeric infinity).
+UPPER_ID_SQL = """
+    SELECT max(id), count(*) FROM (
+        SELECT id FROM {table}
+         WHERE id > %(last_id)s
+           AND id < coalesce((SELECT min(id) FROM {table}
+                               WHERE id > %(last_id)s
+                                 AND created_on > %(cutoff)s),
+                             9223372036854775807)
+         ORDER BY id
+         LIMIT %(batch)s) batch
+"""
+
+ROLLUP_SQL = """
+    INSERT INTO proto_photodailystats (photo_id, day, {column}, {other})
+    SELECT photo_id, (created_on AT TIME ZONE 'UTC')::date, count(*), 0
+      FROM {table}
+     WHERE id > %s AND id <= %s
+     GROUP BY 1, 2
+    ON CONFLICT (photo_id, day) DO UPDATE
+       SET {column} = proto_photodailystats.{column} + EXCLUDED.{column}
+"""
+
+MOVE_WATERMARK_SQL = """
+    UPDATE proto_metricrollup SET last_id = %s, rolled_up_on = now()
+     WHERE metric = %s
+"""
+
+# One statement, so rollups and tail are read from the same snapshot even
+# while a rollup commits.
+TOTALS_SQL = """
+    WITH photos AS (
+        SELECT id FROM proto_photo
+         WHERE photographer_id = %(photographer)s AND NOT deleted
+    ), marks AS (
+        SELECT coalesce(max(last_id) FILTER (WHERE metric = 'like'), 0)
+                   AS likes,
+               coalesce(max(last_id) FILTER (WHERE metric = 'impression'), 0)
+                   AS impressions
+          FROM proto_metricrollup
+    )
+    SELECT (SELECT coalesce(sum(likes), 0) FROM proto_photodailystats
+             WHERE photo_id IN (SELECT id FROM photos)) +
+           (SELECT count(*) FROM proto_like
+             WHERE photo_id IN (SELECT id FROM photos)
+               AND id > (SELECT likes FROM marks)),
+           (SELECT coalesce(sum(impressions), 0) FROM proto_photodailystats
+             WHERE photo_id IN (SELECT id FROM photos)) +
+           (SELECT count(*) FROM proto_impression
+             WHERE photo_id IN (SELECT id FROM photos)
+               AND id > (SELECT impressions FROM marks))
+"""
+
+# Likes and impressions per day, week or month of the photographer's photos:
+# the rollups of the range plus the tail rows, which the created_on bound
+# keeps to the range's partitions.
+SERIES_SQL = """
+    WITH photos AS (
+        SELECT id FROM proto_photo
+         WHERE photographer_id = %(photographer)s AND NOT deleted {filters}
+    ), marks AS (
+        SELECT coalesce(max(last_id) FILTER (WHERE metric = 'like'), 0)
+                   AS likes,
+               coalesce(max(last_id) FILTER (WHERE metric = 'impression'), 0)
+                   AS impressions
+          FROM proto_metricrollup
+    )
+    SELECT date_trunc(%(period)s, day::timestamp)::date, sum(likes),
+           sum(impressions)
+      FROM (
+        SELECT day, likes, impressions FROM proto_photodailystats
+         WHERE photo_id IN (SELECT id FROM photos)
+           AND day BETWEEN %(start)s AND %(end)s
+        UNION ALL
+        SELECT (created_on AT TIME ZONE 'UTC')::date, 1, 0 FROM proto_like
+         WHERE photo_id IN (SELECT id FROM photos)
+           AND id > (SELECT likes FROM marks)
+           AND created_on >= %(since)s AND created_on < %(until)s
+        UNION ALL
+        SELECT (created_on AT TIME ZONE 'UTC')::date, 0, 1
+          FROM proto_impression
+         WHERE photo_id IN (SELECT id FROM photos)
+           AND id > (SELECT impressions FROM marks)
+           AND created_on >= %(since)s AND created_on < %(until)s
+      ) daily
+     GROUP BY 1
+     ORDER BY 1
+"""
+
+PERIODS = ('day', 'week', 'month')
+
+
+def roll_up(lag=None, batch=None):
+    # Counts the raw rows past each watermark into PhotoDailyStats, one batch
+    # per transaction. Returns {metric: rows rolled up}.
+    lag = settings.ROLLUP_LAG if lag is None else lag
+    batch = settings.ROLLUP_BATCH if batch is None else batch
+    cutoff = timezone.now() - datetime.timedelta(seconds=lag)
+    done = {}
+    for metric, table, column in METRICS:
+        done[metric] = 0
+        while True:
+            rolled = _roll_up_batch(metric, table, column, cutoff, batch)
+            if not rolled:
+                break
+            done[metric] += rolled
+    return done
+
+
+def photographer_totals(photographer_id):
+    with connection.cursor() as cursor:
+        cursor.execute(TOTALS_SQL, {'photographer': photographer_id})
+        likes, impressions = cursor.fetchone()
+    return {'likes': int(likes), 'impressions': int(impressions)}
+
+
+def series(photographer_id, period, start, end, photo_id=None,
+           category_id=None):
+    # [(first day of the period, likes, impressions)] between the UTC days
+    # start and end, periods without any are left out
+    filters = ''
+    if photo_id is not None:
+        filters += ' AND id = %(photo)s'
+    if category_id is not None:
+        filters += ' AND id IN (SELECT photo_id FROM proto_category_photos' \
+                   ' WHERE category_id = %(category)s)'
+    since = datetime.datetime.combine(start, datetime.time.min)\
+        .replace(tzinfo=timezone.utc)
+    until = datetime.datetime.combine(end + datetime.timedelta(days=1),
+                                      datetime.time.min)\
+        .replace(tzinfo=timezone.utc)
+    with connection.cursor() as cursor:
+        cursor.execute(SERIES_SQL.format(filters=filters), {
+            'photographer': photographer_id, 'period': period,
+            'start': start, 'end': end, 'since': since, 'until': until,
+            'photo': photo_id, 'category': category_id})
+        return [(day, int(likes), int(impressions))
+                for day, likes, impressions in cursor.fetchall()]
+
+
+def _roll_up_batch(metric, table, column, cutoff, batch):
+    other = 'impressions' if column == 'likes' else 'likes'
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(ENSURE_WATERMARK_SQL, [metric])
+        cursor.execute(LOCK_WATERMARK_SQL, [metric])
+        last_id = cursor.fetchone()[0]
+        cursor.execute(UPPER_ID_SQL.format(table=table), {
+            'last_id': last_id, 'cutoff': cutoff, 'batch': batch})
+        upper_id, rows = cursor.fetchone()
+        if upper_id is None:
+            return 0
+        cursor.execute(
+            ROLLUP_SQL.format(table=table, column=column, other=other),
+            [last_id, upper_id])
+        cursor.execute(MOVE_WATERMARK_SQL, [upper_id, metric])
+    return rows
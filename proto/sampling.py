@@ -0,0 +1,53 @@
+import random
+
+from django.db import connection
+from django.db.models import Max, Min
+
+# Random rows without ORDER BY random(): every probe draws an id between the
+# smallest and the largest one and takes the first matching row from there,
+# one primary key index lookup per probe, all probes in one statement. Rows
+# following gaps in the ids are drawn more often, which is fine for showing
+# random photos but not for statistics.
+PROBES_SQL = """
+    SELECT DISTINCT s.id
+      FROM unnest(%s::bigint[]) r(start),
+           LATERAL ({}) s
+"""
+
+# probes per wanted row, and rounds before giving up on tiny or sparse sets
+OVERSAMPLING = 2
+ROUNDS = 3
+
+
+def sample_ids(queryset, count):
+    # up to `count` distinct random primary keys of the queryset's rows
+    bounds = queryset.aggregate(low=Min('pk'), high=Max('pk'))
+    if bounds['low'] is None or count <= 0:
+        return []
+    pk_column = '{}.{}'.format(
+        connection.ops.quote_name(queryset.model._meta.db_table),
+        connection.ops.quote_name(queryset.model._meta.pk.column))
+    probe = queryset.extra(where=[pk_column + ' >= r.start'])\
+        .order_by('pk').values('pk')[:1]
+    sql, params = probe.query.sql_with_params()
+
+    found = set()
+    for _ in range(ROUNDS):
+        missing = count - len(found)
+        starts = [random.randint(bounds['low'], bounds['high'])
+                  for _ in range(missing * OVERSAMPLING)]
+        with connection.cursor() as cursor:
+            cursor.execute(PROBES_SQL.format(sql), [starts] + list(params))
+            found.update(row[0] for row in cursor.fetchall())
+        if len(found) >= count:
+            break
+    ids = list(found)
+    random.shuffle(ids)
+    return ids[:count]
+
+
+def sample(queryset, count):
+    # up to `count` random instances, in random order
+    ids = sample_ids(queryset, count)
+    instances = queryset.in_bulk(ids)
+    return [instances[pk] for pk in ids if pk in instances]
@@ -0,0 +1,221 @@
+from collections import namedtuple
+
+from django.conf import settings
+from django.contrib.gis.measure import D
+from django.db import connection
+from django.utils.module_loading import import_string
+
+from proto import sampling, search_index
+from proto.models import Location, Photographer
+
+_backends = {}
+
+FACETS_SQL = """
+    SELECT slug, count(*)
+      FROM ({}) entries, unnest(entries.category_slugs) slug
+     GROUP BY slug
+"""
+
+# point: search origin, range: km, category: slug or None, seed: shuffle
+# seed, nearest: order by distance first (kNN mode) instead of shuffled,
+# keywords: full-text search terms or None, ranked matches come first,
+# popular: photographers' leaderboard rank first (see proto.leaderboard)
+Query = namedtuple('Query',
+                   'point range category seed nearest keywords popular')
+
+
+def get_backend():
+    # one instance per configured class and process
+    path = settings.SEARCH_BACKEND
+    if path not in _backends:
+        _backends[path] = import_string(path)()
+    return _backends[path]
+
+
+def photographers_changed(photographer_ids=None):
+    # None: anything may have changed
+    for backend in _backends.values():
+        backend.changed(photographer_ids)
+
+
+class SearchBackend(object):
+    # Answers the photo and photographer searches. Photo rows are
+    # (photo_id, key) tuples sorted by key, the key being the shuffle key,
+    # (distance in meters, shuffle key) in nearest mode, (negated rank,
+    # shuffle key) for keyword searches or (leaderboard rank, shuffle key)
+    # for popular ones.
+
+    def warm_up(self):
+        pass
+
+    def changed(self, photographer_ids):
+        pass
+
+    def page(self, query, page=0, cursor=None, with_total=False):
+        # returns (rows, total, total_is_approximate), total None when not
+        # asked for
+        raise NotImplementedError
+
+    def rows(self, query, limit):
+        # returns the first `limit` rows as (key, photo_id), the total
+        # number of matches and whether it is approximate
+        raise NotImplementedError
+
+    def nearest_distance(self, pnt, category, count):
+        # km to the count-th nearest photo, None when there are fewer
+        raise NotImplementedError
+
+    def facets(self, query):
+        # {category slug: number of matching photos}, the query's category
+        # is ignored
+        raise NotImplementedError
+
+    def photographers(self, zip_code, photo_ids=None):
+        raise NotImplementedError
+
+    def with_nearest_location(self, photographers, pnt=None):
+        # see search_index.with_nearest_location
+        return search_index.with_nearest_location(photographers, pnt)
+
+    def shuffled_ids(self, seed, limit):
+        # the first `limit` active photo ids in the seed's shuffle order,
+        # with or without a location
+        raise NotImplementedError
+
+    def sample_ids(self, count):
+        # up to `count` random active photo ids
+        raise NotImplementedError
+
+
+class PostgisBackend(SearchBackend):
+    # Queries the denormalized PhotoSearch table
+
+    def entries(self, query):
+        # geo-filtering, served by the partial GiST index on the search table
+        entries = search_index.active_entries()
+        if query.range > 0:
+            entries = entries.filter(
+                points__dwithin=(query.point, D(km=query.range)))
+        else:
+            entries = entries.filter(points__isnull=False)
+
+        # category filtering
+        if query.category:
+            entries = entries.filter(category_slugs__contains=[query.category])
+
+        if query.keywords:
+            entries = search_index.matching(entries, query.keywords)
+            return search_index.ranked(entries, query.keywords, query.seed)
+        if query.popular:
+            return search_index.popular_first(entries, query.point,
+                                              query.category, query.seed)
+        if query.nearest:
+            return search_index.nearest_first(entries, query.point, query.seed)
+        return search_index.shuffled(entries, query.seed)
+
+    @staticmethod
+    def key_fields(query):
+        if query.keywords:
+            return ['rank', 'shuffle_key']
+        if query.popular:
+            return ['popularity', 'shuffle_key']
+        if query.nearest:
+            return ['distance_m', 'shuffle_key']
+        return ['shuffle_key']
+
+    def key(self, query, values):
+        return tuple(values) if len(self.key_fields(query)) > 1 \
+            else values[0]
+
+    def page(self, query, page=0, cursor=None, with_total=False):
+        entries = self.entries(query)
+        total, approximate = None, False
+        if with_total:
+            total, approximate = self.estimate_total(entries)
+
+        key_fields = self.key_fields(query)
+        fields = ['photo_id'] + key_fields
+        if with_total and not total:
+            # exact total in the same round trip as the page
+            entries = search_index.with_total(entries)
+            fields.append('total')
+        rows = entries.values_list(*fields)
+        if cursor:
+            # keyset page: an index range scan, as cheap as page 0
+            rows = search_index.after_cursor(rows, cursor, query)
+            rows = rows[:settings.PHOTOS_PER_BATCH]
+        else:
+            # page numbers are still served for clients without a cursor
+            start = page * settings.PHOTOS_PER_BATCH
+            end = (page + 1) * settings.PHOTOS_PER_BATCH
+            rows = rows[start:end]
+        rows = list(rows)
+
+        if 'total' in fields:
+            total = rows[0][-1] if rows else 0
+        size = len(key_fields) + 1
+        return [(row[0], self.key(query, row[1:size])) for row in rows], \
+            total, approximate
+
+    def rows(self, query, limit):
+        entries = self.entries(query)
+        total, approximate = self.estimate_total(entries)
+        key_fields = self.key_fields(query)
+        fields = key_fields + ['photo_id']
+        if not total:
+            entries = search_index.with_total(entries)
+            fields.append('total')
+        rows = list(entries.values_list(*fields)[:limit])
+        if 'total' in fields:
+            total = rows[0][-1] if rows else 0
+        size = len(key_fields)
+        return [(self.key(query, row[:size]), row[size]) for row in rows], \
+            total, approximate
+
+    def nearest_distance(self, pnt, category, count):
+        entries = search_index.active_entries().filter(points__isnull=False)
+        if category:
+            entries = entries.filter(category_slugs__contains=[category])
+        distances = entries.annotate(knn=search_index.knn_distance(pnt))\
+            .order_by('knn').values_list('knn', flat=True)
+        found = list(distances[count - 1:count])
+        return found[0] / 1000.0 if found else None
+
+    def facets(self, query):
+        # one pass over the matching rows, grouped by their category slugs
+        entries = self.entries(query._replace(category=None))
+        sql, params = entries.values('category_slugs').order_by()\
+            .query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(FACETS_SQL.format(sql), params)
+            return dict(cursor.fetchall())
+
+    @staticmethod
+    def estimate_total(entries):
+        # planner estimate for big result sets, if enabled in the settings
+        threshold = settings.SEARCH_APPROXIMATE_TOTAL_ABOVE
+        if threshold is None:
+            return None, False
+        estimate = search_index.estimate_count(entries)
+        if estimate <= threshold:
+            return None, False
+        return estimate, True
+
+    def photographers(self, zip_code, photo_ids=None):
+        if photo_ids:
+            return Photographer.objects.filter(
+                locations__zip_code__startswith=zip_code,
+                locations__geocode_status=Location.GEOCODED,
+                photos__id__in=photo_ids)
+        return Photographer.objects.filter(
+            locations__zip_code__startswith=zip_code,
+            locations__geocode_status=Location.GEOCODED)
+
+    def shuffled_ids(self, seed, limit):
+        entries = search_index.shuffled(search_index.active_entries(), seed)
+        return list(entries.values_list('photo_id', flat=True)[:limit])
+
+    def sample_ids(self, count):
+        # random primary key probes on the search table (see proto.sampling),
+        # one index seek per photo instead of a scan or a sort of the table
+        return sampling.sample_ids(search_index.active_entries(), count)
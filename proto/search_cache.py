@@ -0,0 +1,168 @@
+import hashlib
+import uuid
+from bisect import bisect_right
+
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.core.cache import cache
+
+from proto import geohash
+
+# Cached photo searches, keyed by the quantized search point. Every entry
+# also carries the generations of the geohash cells its search circle can
+# reach; a change of the search table bumps the generations of the cells
+# around the changed points, so stale entries are simply never read again.
+PREFIX = 'photo_search'
+EPOCH = PREFIX + ':epoch'
+HITS = PREFIX + ':hits'
+MISSES = PREFIX + ':misses'
+
+
+class CachedResult(object):
+    # First SEARCH_CACHE_MAX_ROWS rows of a search as sorted (key, photo_id)
+    # tuples, plus the total number of matches, which may be the planner's
+    # estimate (see SEARCH_APPROXIMATE_TOTAL_ABOVE).
+
+    def __init__(self, rows, total, approximate=False):
+        self.rows = rows
+        self.total = total
+        self.approximate = approximate
+        # an estimate can't tell whether the rows hold every match
+        self.complete = len(rows) < settings.SEARCH_CACHE_MAX_ROWS or \
+            not approximate and len(rows) >= total
+
+    def page(self, page, cursor, size):
+        # (photo_id, key) rows of the page, None when the page reaches past
+        # the cached rows and has to come from the database
+        if cursor:
+            start = bisect_right(self.rows, (cursor['key'],
+                                             cursor['photo_id']))
+        else:
+            start = page * size
+        rows = self.rows[start:start + size]
+        if len(rows) < size and not self.complete:
+            return None
+        return [(photo_id, key) for key, photo_id in rows]
+
+
+def enabled():
+    return bool(settings.SEARCH_CACHE_TIMEOUT)
+
+
+def snap(pnt):
+    # center of the search point's cell, nearby searches share the entry
+    cell = geohash.encode(pnt.y, pnt.x, settings.SEARCH_CACHE_PRECISION)
+    lat, lng = geohash.center(cell)
+    return Point(lng, lat, srid=pnt.srid)
+
+
+def get(query, kind='rows'):
+    result = cache.get(_key(query, kind))
+    _count(HITS if result is not None else MISSES)
+    return result
+
+
+def store(query, rows, total, approximate=False):
+    result = CachedResult(rows, total, approximate)
+    cache.set(_key(query), result,
+              settings.SEARCH_CACHE_TIMEOUT)
+    return result
+
+
+def store_facets(query, counts):
+    # counts: {category slug: photos}, read back with get(query, 'facets')
+    cache.set(_key(query, 'facets'), counts, settings.SEARCH_CACHE_TIMEOUT)
+    return counts
+
+
+def nearest_distance(backend, pnt, category):
+    # backend.nearest_distance of SEARCH_NEAREST_PHOTOS photos, cached with
+    # the generations of the cells within SEARCH_NEAREST_MAX_KM: changes
+    # further away can only move it beyond the radius' bound
+    key = _cell_key(pnt, settings.SEARCH_NEAREST_MAX_KM, 'radius', category,
+                    settings.SEARCH_NEAREST_PHOTOS)
+    # a tuple, a search without photos caches None
+    found = cache.get(key)
+    if found is None:
+        found = (backend.nearest_distance(pnt, category,
+                                          settings.SEARCH_NEAREST_PHOTOS),)
+        cache.set(key, found, settings.SEARCH_CACHE_TIMEOUT)
+    return found[0]
+
+
+def invalidate(points):
+    # points: (lat, lng) pairs whose search rows changed
+    keys = set()
+    for lat, lng in points:
+        keys.add(_generation_key(''))
+        for precision in range(1, settings.SEARCH_CACHE_PRECISION + 1):
+            keys.add(_generation_key(geohash.encode(lat, lng, precision)))
+    if keys:
+        cache.set_many({key: _token() for key in keys}, None)
+
+
+def clear():
+    cache.set(EPOCH, _token(), None)
+
+
+def stats():
+    return {'hits': cache.get(HITS, 0), 'misses': cache.get(MISSES, 0)}
+
+
+def reset_stats():
+    cache.delete_many([HITS, MISSES])
+
+
+def _key(query, kind='rows'):
+    return _cell_key(query.point, query.range, kind, query.range,
+                     query.category, query.seed, int(query.nearest),
+                     query.keywords, int(query.popular))
+
+
+def _cell_key(pnt, geo_range, kind, *parts):
+    # key of the point's cell, valid until a cell within geo_range changes;
+    # the same for every point of the cell
+    pnt = snap(pnt)
+    cell = geohash.encode(pnt.y, pnt.x, settings.SEARCH_CACHE_PRECISION)
+    generations = _generations([EPOCH] + [
+        _generation_key(c) for c in sorted(_cells(pnt, geo_range))])
+    key = ':'.join(str(part) for part in
+                   (kind, cell) + parts + tuple(generations))
+    return '{}:{}'.format(PREFIX, hashlib.md5(key.encode()).hexdigest())
+
+
+def _cells(pnt, geo_range):
+    # cells whose changes can affect a search of geo_range km around pnt
+    if geo_range <= 0:
+        return {''}
+    precision = geohash.covering_precision(
+        pnt.y, geo_range, settings.SEARCH_CACHE_PRECISION)
+    if not precision:
+        return {''}
+    return geohash.neighbourhood(geohash.encode(pnt.y, pnt.x, precision))
+
+
+def _generations(keys):
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            # an evicted generation must never come back with an old value
+            cache.add(key, _token(), None)
+            found[key] = cache.get(key)
+    return [str(found[key]) for key in keys]
+
+
+def _generation_key(cell):
+    return '{}:gen:{}'.format(PREFIX, cell or '*')
+
+
+def _count(key):
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        pass
+
+
+def _token():
+    return uuid.uuid4().hex[:12]
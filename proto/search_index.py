@@ -0,0 +1,339 @@
+import json
+import random
+
+from django.conf import settings
+from django.core import signing
+from django.db import connection, transaction
+from django.db.models import CharField, F, FloatField, Func, IntegerField, \
+    Q, Value
+from django.db.models.expressions import RawSQL
+
+from proto import leaderboard, search_cache
+from proto.models import Photo, PhotoSearch
+
+
+# Number of distinct shuffle orders. Every seed has its own expression index
+# (see migration 0026), keep both in sync when changing it.
+SHUFFLE_SEEDS = 8
+
+CURSOR_SALT = 'proto.search_index.cursor'
+
+DISTANCE_METERS_SQL = 'CAST(ST_Distance(points, %s::geography) AS integer)'
+
+# Keyword search over the `document` column (see migration 0028). The rank is
+# negated so every sort key of the table ascends.
+MATCH_SQL = "document @@ plainto_tsquery('simple', %s)"
+RANK_SQL = "-ts_rank(document, plainto_tsquery('simple', %s))"
+
+
+# Builds search rows straight from the source tables: the photographer's
+# geocoded locations are collected into one multipoint, the photographer's
+# category slugs into an array and the photo's texts into one weighted
+# tsvector, so a search never has to join them again.
+SELECT_ROWS_SQL = """
+    SELECT ph.id,
+           ph.photographer_id,
+           (SELECT ST_Multi(ST_Collect(l.point::geometry))::geography
+              FROM proto_location l
+             WHERE l.photographer_id = ph.photographer_id
+               AND l.point IS NOT NULL
+               AND NOT l.deleted),
+           ARRAY(SELECT c.slug
+                   FROM proto_category c
+                   JOIN proto_category_photographers cp
+                     ON cp.category_id = c.id
+                  WHERE cp.photographer_id = ph.photographer_id
+                    AND NOT c.deleted
+                  ORDER BY c.slug),
+           ph.disabled OR p.disabled,
+           ph.deleted OR p.deleted,
+           setweight(to_tsvector('simple', coalesce(ph.title, '')), 'A') ||
+           setweight(to_tsvector('simple', coalesce(p.company_name, '')), 'B') ||
+           setweight(to_tsvector('simple', coalesce(ph.description, '')), 'C')
+      FROM proto_photo ph
+      JOIN proto_photographer p ON p.id = ph.photographer_id
+"""
+
+POINTS_SQL = """
+    SELECT DISTINCT ST_Y(d.geom), ST_X(d.geom)
+      FROM (SELECT (ST_Dump(points::geometry)).geom
+              FROM proto_photosearch
+             WHERE {} = ANY(%s)) d
+"""
+
+INSERT_ROWS_SQL = """
+    INSERT INTO proto_photosearch
+           (photo_id, photographer_id, points, category_slugs, disabled,
+            deleted, document)
+""" + SELECT_ROWS_SQL
+
+
+class ShuffleKey(Func):
+    # proto_shuffle_key(seed, photo_id): stable hash, indexed per seed
+    function = 'proto_shuffle_key'
+
+    def __init__(self, seed, **extra):
+        super(ShuffleKey, self).__init__(Value(seed), F('photo_id'),
+                                         output_field=IntegerField(), **extra)
+
+
+class DistanceMeters(RawSQL):
+    def __init__(self, pnt):
+        super(DistanceMeters, self).__init__(
+            DISTANCE_METERS_SQL, [pnt.ewkt], output_field=IntegerField())
+
+
+def active_entries():
+    return PhotoSearch.objects.filter(disabled=False, deleted=False)
+
+
+def new_seed():
+    return random.randrange(SHUFFLE_SEEDS)
+
+
+def parse_seed(value):
+    # returns None for missing or unknown seeds, callers issue a new one
+    try:
+        seed = int(value)
+    except (TypeError, ValueError):
+        return None
+    return seed if 0 <= seed < SHUFFLE_SEEDS else None
+
+
+def shuffled(entries, seed):
+    # same seed, same order: pages never repeat or skip photos
+    return entries.annotate(shuffle_key=ShuffleKey(seed))\
+        .order_by('shuffle_key', 'photo_id')
+
+
+def nearest_first(entries, pnt, seed):
+    # by distance to the photographer in whole meters, ties shuffled
+    return entries.annotate(distance_m=DistanceMeters(pnt),
+                            shuffle_key=ShuffleKey(seed))\
+        .order_by('distance_m', 'shuffle_key', 'photo_id')
+
+
+def matching(entries, keywords):
+    # served by the GIN index on the document column
+    return entries.extra(where=[MATCH_SQL], params=[keywords])
+
+
+def ranked(entries, keywords, seed):
+    # best matches first, ties shuffled
+    return entries.annotate(
+        rank=RawSQL(RANK_SQL, [keywords], output_field=FloatField()),
+        shuffle_key=ShuffleKey(seed))\
+        .order_by('rank', 'shuffle_key', 'photo_id')
+
+
+def popular_first(entries, pnt, category, seed):
+    # by the photographer's rank on the leaderboard of the point's cell and
+    # the category, ties and unranked photographers shuffled
+    entries = entries.all()
+    alias = leaderboard.join_board(entries.query, category,
+                                   leaderboard.cell(pnt))
+    return entries.annotate(
+        popularity=RawSQL(leaderboard.RANK_SQL.format(alias=alias), [],
+                          output_field=IntegerField()),
+        shuffle_key=ShuffleKey(seed))\
+        .order_by('popularity', 'shuffle_key', 'photo_id')
+
+
+def knn_distance(pnt):
+    # `<->` lets the GiST index hand out the rows nearest first
+    return RawSQL('points <-> %s::geography', [pnt.ewkt],
+                  output_field=FloatField())
+
+
+# Columns of a photographer's location nearest to the origin (or the first
+# location without one), one correlated subquery per column so a page of
+# photographers comes back in a single statement. Locations still waiting for
+# the geocoder are left out.
+NEAREST_LOCATION_SQL = (
+    'SELECT l.{column} FROM proto_location l '
+    'WHERE l.photographer_id = proto_photographer.id AND NOT l.deleted '
+    "AND l.geocode_status = 'ok' "
+    'ORDER BY {order} l.id LIMIT 1')
+NEAREST_LOCATION_ORDER = 'l.point <-> %s::geography NULLS LAST,'
+NEAREST_LOCATION_COLUMNS = ('country', 'city', 'street', 'zip_code')
+
+# geodesic distance from the origin to the nearest location, in km
+DISTANCE_KM_SQL = (
+    'SELECT min(ST_Distance(l.point, %s::geography)) / 1000 '
+    'FROM proto_location l '
+    'WHERE l.photographer_id = proto_photographer.id AND NOT l.deleted')
+
+
+def with_nearest_location(photographers, pnt=None):
+    # annotates nearest_<column> and distance_km, nearest first when the
+    # origin is known
+    order, params = ('', []) if pnt is None \
+        else (NEAREST_LOCATION_ORDER, [pnt.ewkt])
+    annotations = {
+        'nearest_' + column: RawSQL(
+            NEAREST_LOCATION_SQL.format(column=column, order=order), params,
+            output_field=CharField())
+        for column in NEAREST_LOCATION_COLUMNS}
+    if pnt is None:
+        annotations['distance_km'] = RawSQL('NULL', [],
+                                            output_field=FloatField())
+        return photographers.annotate(**annotations)
+
+    annotations['distance_km'] = RawSQL(DISTANCE_KM_SQL, [pnt.ewkt],
+                                        output_field=FloatField())
+    return photographers.annotate(**annotations)\
+        .order_by('distance_km', 'pk')
+
+
+# keywords of cursors issued before they were part of it
+MISSING = object()
+
+
+def encode_cursor(query, key, photo_id):
+    # opaque, signed token carrying the sort key of the last row served and
+    # the parameters the next pages have to keep
+    return signing.dumps([query.seed, key, photo_id, query.range,
+                          query.nearest, query.popular, query.keywords],
+                         salt=CURSOR_SALT)
+
+
+def decode_cursor(token):
+    if not token:
+        return None
+    try:
+        payload = signing.loads(token, salt=CURSOR_SALT)
+        seed, key, photo_id = payload[:3]
+    except (signing.BadSignature, TypeError, ValueError):
+        return None
+    if parse_seed(seed) is None:
+        return None
+    if isinstance(key, list):
+        key = tuple(key)
+    # older cursors only carry the first three, five or six values
+    extra = list(payload[3:7])
+    geo_range, nearest, popular, keywords = \
+        extra + [None, False, False, None][len(extra):]
+    return {'seed': seed, 'key': key, 'photo_id': photo_id,
+            'range': geo_range, 'nearest': nearest, 'popular': popular,
+            'keywords': keywords if len(payload) > 6 else MISSING}
+
+
+def cursor_fits(cursor, query):
+    # whether the cursor's key has the shape of the query's sort key, a
+    # cursor of another mode can't continue the query
+    paired = bool(query.keywords or query.popular or query.nearest)
+    return isinstance(cursor['key'], tuple) == paired
+
+
+def after_cursor(entries, cursor, query):
+    # row comparison, in shuffle order the (shuffle key, photo_id) index
+    # serves the range
+    if query.keywords:
+        rank, shuffle_key = cursor['key']
+        return entries.extra(
+            where=['(' + RANK_SQL + ', proto_shuffle_key(%s, photo_id), '
+                   'photo_id) > (%s::real, %s, %s)'],
+            params=[query.keywords, query.seed, rank, shuffle_key,
+                    cursor['photo_id']])
+    if query.popular:
+        # on the annotations, the board's alias is the query's
+        popularity, shuffle_key = cursor['key']
+        return entries.filter(
+            Q(popularity__gt=popularity) |
+            Q(popularity=popularity, shuffle_key__gt=shuffle_key) |
+            Q(popularity=popularity, shuffle_key=shuffle_key,
+              photo_id__gt=cursor['photo_id']))
+    if query.nearest:
+        distance_m, shuffle_key = cursor['key']
+        return entries.extra(
+            where=['(' + DISTANCE_METERS_SQL + ', '
+                   'proto_shuffle_key(%s, photo_id), photo_id) '
+                   '> (%s, %s, %s)'],
+            params=[query.point.ewkt, query.seed, distance_m, shuffle_key,
+                    cursor['photo_id']])
+    return entries.extra(
+        where=['(proto_shuffle_key(%s, photo_id), photo_id) > (%s, %s)'],
+        params=[query.seed, cursor['key'], cursor['photo_id']])
+
+
+def with_total(entries):
+    # window count: every row carries the size of the whole filtered set
+    return entries.annotate(
+        total=RawSQL('count(*) OVER ()', [], output_field=IntegerField()))
+
+
+def estimate_count(entries):
+    # row estimate of the query planner, no rows are read
+    sql, params = entries.values('photo_id').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def photos_in_order(ids):
+    # only the page is loaded as Photo instances, in the order of `ids`
+    photos = Photo.objects.in_bulk(ids)
+    return [photos[pk] for pk in ids if pk in photos]
+
+
+def refresh_photos(photo_ids):
+    _refresh('photo_id', 'ph.id', photo_ids)
+
+
+def refresh_photographers(photographer_ids):
+    _refresh('photographer_id', 'ph.photographer_id', photographer_ids)
+
+
+def refresh_category(category):
+    # photographers linked right now plus the ones still indexed with the
+    # category's slug, which covers renames, unlinks and deletes
+    if not settings.SEARCH_TABLE:
+        search_cache.clear()
+        return
+    photographer_ids = set(
+        category.photographers.values_list('pk', flat=True))
+    photographer_ids.update(
+        PhotoSearch.objects.filter(category_slugs__contains=[category.slug])
+        .values_list('photographer_id', flat=True))
+    refresh_photographers(photographer_ids)
+
+
+def rebuild():
+    # Drops and recreates every row, use when the table went out of sync
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('DELETE FROM proto_photosearch')
+        cursor.execute(INSERT_ROWS_SQL)
+    search_cache.clear()
+    return PhotoSearch.objects.count()
+
+
+def _refresh(column, source_column, ids):
+    if not settings.SEARCH_TABLE:
+        # no rows to refresh, nor their points to invalidate around
+        search_cache.clear()
+        return
+    ids = [int(pk) for pk in ids if pk is not None]
+    if not ids:
+        return
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        points = _points(cursor, column, ids)
+        cursor.execute(
+            'DELETE FROM proto_photosearch WHERE {} = ANY(%s)'.format(column),
+            [ids])
+        cursor.execute(
+            INSERT_ROWS_SQL + ' WHERE {} = ANY(%s)'.format(source_column),
+            [ids])
+        # cached searches around the old and the new points are stale
+        points.update(_points(cursor, column, ids))
+    search_cache.invalidate(points)
+
+
+def _points(cursor, column, ids):
+    if not search_cache.enabled():
+        return set()
+    cursor.execute(POINTS_SQL.format(column), [ids])
+    return set(cursor.fetchall())
@@ -0,0 +1,426 @@
+import hashlib
+import math
+import operator
+import re
+import threading
+import time
+from collections import defaultdict
+from functools import reduce
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Q
+
+from proto import leaderboard, search_index, zip_index
+from proto.models import Category, Location, Photo, Photographer, \
+    PhotographerRank
+from proto.search_backends import PostgisBackend, SearchBackend
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = 111.32
+# side of the grid cells bucketing the locations, in degrees
+GRID_DEGREES = 0.5
+
+# Keyword searches without the search table: the photo's texts holding the
+# words and their weights, ts_rank's defaults for the table's A, B and C
+WORD = re.compile(r'\w+')
+KEYWORD_WEIGHTS = (('title', 1.0), ('photographer__company_name', 0.4),
+                   ('description', 0.2))
+
+
+def shuffle_key(seed, photo_id):
+    # same value as the proto_shuffle_key SQL function
+    digest = hashlib.md5('{}:{}'.format(seed, photo_id).encode()).hexdigest()
+    value = int(digest[:8], 16)
+    return value - (1 << 32) if value >= 1 << 31 else value
+
+
+def haversine_km(lat, lng, lats, lngs):
+    # great circle distance from one point to arrays of points, in radians
+    a = np.sin((lats - lat) / 2) ** 2 + \
+        np.cos(lat) * np.cos(lats) * np.sin((lngs - lng) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+class MemoryBackend(SearchBackend):
+    # Keeps every searchable location and photo in NumPy arrays and answers
+    # searches without touching PostGIS. Built from the database on first use
+    # (or warm_up), photographers reported by the model signals are reloaded
+    # and the arrays rebuilt lazily. Other processes only see those changes
+    # after SEARCH_MEMORY_MAX_AGE seconds, when the whole engine is reloaded.
+    # Keyword and popular searches go to the search table's text index and
+    # leaderboard join. Without the table (settings.SEARCH_TABLE) they are
+    # answered here as well, the keywords from a scan of the photos' texts.
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.records = None
+        self.loaded_on = 0
+        self.dirty = set()
+        self.arrays = None
+        self.keys = defaultdict(dict)
+        self.database = PostgisBackend()
+
+    def warm_up(self):
+        self.reload()
+
+    def changed(self, photographer_ids):
+        with self.lock:
+            if photographer_ids is None:
+                self.records = None
+            else:
+                self.dirty.update(photographer_ids)
+
+    def reload(self):
+        with self.lock:
+            self.records = self.load()
+            self.loaded_on = time.time()
+            self.dirty = set()
+            self.arrays = None
+
+    def load(self, photographer_ids=None):
+        records = defaultdict(lambda: {'points': [], 'slugs': set(),
+                                       'photos': []})
+        photographers = Photographer.objects.filter(disabled=False,
+                                                    deleted=False)
+        locations = Location.objects.filter(deleted=False)
+        photos = Photo.objects.filter(disabled=False, deleted=False)
+        links = Category.photographers.through.objects.filter(
+            category__deleted=False)
+        if photographer_ids is not None:
+            photographers = photographers.filter(pk__in=photographer_ids)
+            locations = locations.filter(photographer_id__in=photographer_ids)
+            photos = photos.filter(photographer_id__in=photographer_ids)
+            links = links.filter(photographer_id__in=photographer_ids)
+
+        active = set(photographers.values_list('pk', flat=True))
+        for owner, point in locations.values_list('photographer_id', 'point'):
+            if point is not None:
+                records[owner]['points'].append((point.y, point.x))
+        for owner, slug in links.values_list('photographer_id',
+                                             'category__slug'):
+            records[owner]['slugs'].add(slug)
+        for photo_id, owner in photos.values_list('pk', 'photographer_id'):
+            if owner in active:
+                records[owner]['photos'].append(photo_id)
+        return dict(records)
+
+    def get_arrays(self):
+        with self.lock:
+            age = time.time() - self.loaded_on
+            if self.records is None or age > settings.SEARCH_MEMORY_MAX_AGE:
+                self.reload()
+            if self.dirty:
+                dirty, self.dirty = self.dirty, set()
+                for pk in dirty:
+                    self.records.pop(pk, None)
+                self.records.update(self.load(dirty))
+                self.arrays = None
+            if self.arrays is None:
+                self.arrays = self.build(self.records)
+            return self.arrays
+
+    @staticmethod
+    def build(records):
+        lats, lngs, loc_owners, photo_ids, photo_owners = [], [], [], [], []
+        slugs = defaultdict(list)
+        for owner, record in records.items():
+            for lat, lng in record['points']:
+                lats.append(lat)
+                lngs.append(lng)
+                loc_owners.append(owner)
+            photo_ids.extend(record['photos'])
+            photo_owners.extend([owner] * len(record['photos']))
+            for slug in record['slugs']:
+                slugs[slug].append(owner)
+
+        arrays = {
+            'lat': np.radians(np.array(lats, dtype=np.float64)),
+            'lng': np.radians(np.array(lngs, dtype=np.float64)),
+            'loc_owner': np.array(loc_owners, dtype=np.int64),
+            'photo_id': np.array(photo_ids, dtype=np.int64),
+            'photo_owner': np.array(photo_owners, dtype=np.int64),
+            'slugs': {slug: np.array(owners, dtype=np.int64)
+                      for slug, owners in slugs.items()},
+            'grid': defaultdict(list),
+            'keys': {},
+        }
+        for idx, (lat, lng) in enumerate(zip(lats, lngs)):
+            arrays['grid'][_grid_cell(lat, lng)].append(idx)
+        arrays['grid'] = {cell: np.array(idxs, dtype=np.int64)
+                          for cell, idxs in arrays['grid'].items()}
+        return arrays
+
+    def within(self, arrays, lat, lng, km):
+        # indexes of the locations at most `km` away, grid cells first
+        d_lat = km / KM_PER_DEGREE
+        d_lng = km / (KM_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01))
+        rows = range(int(math.floor((lat - d_lat) / GRID_DEGREES)),
+                     int(math.floor((lat + d_lat) / GRID_DEGREES)) + 1)
+        cols = range(int(math.floor((lng - d_lng) / GRID_DEGREES)),
+                     int(math.floor((lng + d_lng) / GRID_DEGREES)) + 1)
+        if len(rows) * len(cols) > len(arrays['grid']):
+            candidates = np.arange(len(arrays['lat']))
+        else:
+            cells = [arrays['grid'][(row, col)] for row in rows
+                     for col in cols if (row, col) in arrays['grid']]
+            if not cells:
+                return np.array([], dtype=np.int64)
+            candidates = np.concatenate(cells)
+        distances = haversine_km(math.radians(lat), math.radians(lng),
+                                 arrays['lat'][candidates],
+                                 arrays['lng'][candidates])
+        return candidates[distances <= km]
+
+    def nearest(self, lat, lng, k):
+        # (photographer ids, km) of the k closest locations, nearest first
+        arrays = self.get_arrays()
+        distances = haversine_km(math.radians(lat), math.radians(lng),
+                                 arrays['lat'], arrays['lng'])
+        k = min(k, len(distances))
+        if not k:
+            return np.array([], dtype=np.int64), np.array([])
+        closest = np.argpartition(distances, k - 1)[:k]
+        closest = closest[np.argsort(distances[closest])]
+        return arrays['loc_owner'][closest], distances[closest]
+
+    def matches(self, query):
+        # (first keys, shuffle keys, photo ids) of the matching photos,
+        # sorted. The first key is the negated rank for keywords, the
+        # leaderboard rank when popular, the distance in meters in nearest
+        # mode and 0 otherwise.
+        arrays = self.get_arrays()
+        lat, lng = query.point.y, query.point.x
+        if query.range > 0:
+            located = self.within(arrays, lat, lng, query.range)
+        else:
+            located = np.arange(len(arrays['lat']))
+        owners = arrays['loc_owner'][located]
+        if query.category:
+            keep = np.isin(owners, arrays['slugs'].get(
+                query.category, np.array([], np.int64)))
+            owners, located = owners[keep], located[keep]
+        mask = np.isin(arrays['photo_owner'], owners)
+        if query.keywords:
+            ranks = self.keyword_ranks(query.keywords)
+            mask &= np.isin(arrays['photo_id'],
+                            np.array(list(ranks), dtype=np.int64))
+        photo_ids = arrays['photo_id'][mask]
+        photo_owners = arrays['photo_owner'][mask]
+        keys = self.shuffle_keys(arrays, query.seed)[mask]
+
+        if query.keywords:
+            first = np.array([ranks[pk] for pk in photo_ids.tolist()],
+                             dtype=np.float64)
+        elif query.popular:
+            board = self.leaderboard(query)
+            first = np.array([board.get(owner, leaderboard.UNRANKED)
+                              for owner in photo_owners.tolist()],
+                             dtype=np.int64)
+        elif query.nearest and len(photo_ids):
+            # nearest location of every photographer, in whole meters
+            km = haversine_km(math.radians(lat), math.radians(lng),
+                              arrays['lat'][located], arrays['lng'][located])
+            unique, inverse = np.unique(owners, return_inverse=True)
+            closest = np.full(len(unique), np.inf)
+            np.minimum.at(closest, inverse, km)
+            first = np.floor(
+                closest[np.searchsorted(unique, photo_owners)] * 1000
+            ).astype(np.int64)
+        else:
+            first = np.zeros(len(photo_ids), dtype=np.int64)
+
+        order = np.lexsort((photo_ids, keys, first))
+        return first[order], keys[order], photo_ids[order]
+
+    @staticmethod
+    def keyword_ranks(keywords):
+        # {photo id: negated rank} of the photos with every word in their
+        # texts, a word counts the weights of the texts it is in
+        words = set(WORD.findall(keywords.lower()))
+        if not words:
+            return {}
+        fields = [field for field, _ in KEYWORD_WEIGHTS]
+        photos = Photo.objects.all()
+        for word in words:
+            photos = photos.filter(reduce(operator.or_, [
+                Q(**{field + '__icontains': word}) for field in fields]))
+        ranks = {}
+        for row in photos.values_list('pk', *fields):
+            texts = [set(WORD.findall((text or '').lower()))
+                     for text in row[1:]]
+            if not all(any(word in text for text in texts)
+                       for word in words):
+                # only inside longer words
+                continue
+            ranks[row[0]] = -sum(
+                weight for word in words
+                for (_, weight), text in zip(KEYWORD_WEIGHTS, texts)
+                if word in text)
+        return ranks
+
+    @staticmethod
+    def leaderboard(query):
+        # {photographer id: rank} on the board of the query's point and
+        # category
+        return dict(PhotographerRank.objects.filter(
+            category_slug=query.category or '',
+            cell=leaderboard.cell(query.point))
+            .values_list('photographer_id', 'rank'))
+
+    def shuffle_keys(self, arrays, seed):
+        # keys of every photo for the seed, hashes are memoized across builds
+        with self.lock:
+            if seed not in arrays['keys']:
+                memo = self.keys[seed]
+                for pk in arrays['photo_id'].tolist():
+                    if pk not in memo:
+                        memo[pk] = shuffle_key(seed, pk)
+                arrays['keys'][seed] = np.array(
+                    [memo[pk] for pk in arrays['photo_id'].tolist()],
+                    dtype=np.int64)
+            return arrays['keys'][seed]
+
+    @staticmethod
+    def delegated(query):
+        # answered by the search table
+        return settings.SEARCH_TABLE and bool(query.keywords or query.popular)
+
+    @staticmethod
+    def sort_keys(query, first, keys):
+        if query.keywords or query.popular or query.nearest:
+            return list(zip(first.tolist(), keys.tolist()))
+        return keys.tolist()
+
+    def page(self, query, page=0, cursor=None, with_total=False):
+        if self.delegated(query):
+            return self.database.page(query, page, cursor, with_total)
+        first, keys, photo_ids = self.matches(query)
+        if cursor:
+            # rows are sorted, everything up to the cursor comes before it
+            if isinstance(cursor['key'], tuple):
+                value, key = cursor['key']
+            else:
+                value, key = 0, cursor['key']
+            before = (first < value) | (first == value) & (
+                (keys < key) | (keys == key) & (photo_ids <= cursor['photo_id']))
+            start = int(before.sum())
+        else:
+            start = page * settings.PHOTOS_PER_BATCH
+        end = start + settings.PHOTOS_PER_BATCH
+        rows = list(zip(photo_ids[start:end].tolist(),
+                        self.sort_keys(query, first[start:end],
+                                       keys[start:end])))
+        return rows, len(photo_ids) if with_total else None, False
+
+    def rows(self, query, limit):
+        if self.delegated(query):
+            return self.database.rows(query, limit)
+        first, keys, photo_ids = self.matches(query)
+        rows = list(zip(self.sort_keys(query, first[:limit], keys[:limit]),
+                        photo_ids[:limit].tolist()))
+        return rows, len(photo_ids), False
+
+    def nearest_distance(self, pnt, category, count):
+        arrays = self.get_arrays()
+        km = haversine_km(math.radians(pnt.y), math.radians(pnt.x),
+                          arrays['lat'], arrays['lng'])
+        owners = arrays['loc_owner']
+        if category:
+            keep = np.isin(owners, arrays['slugs'].get(
+                category, np.array([], np.int64)))
+            km, owners = km[keep], owners[keep]
+        if not len(owners):
+            return None
+        unique, inverse = np.unique(owners, return_inverse=True)
+        closest = np.full(len(unique), np.inf)
+        np.minimum.at(closest, inverse, km)
+        # every photo of a photographer is as far away as the photographer
+        photos = np.bincount(np.searchsorted(
+            unique, arrays['photo_owner'][np.isin(arrays['photo_owner'],
+                                                  unique)]),
+            minlength=len(unique))
+        order = np.argsort(closest)
+        reached = np.cumsum(photos[order])
+        if reached[-1] < count:
+            return None
+        return float(closest[order][np.searchsorted(reached, count)])
+
+    def facets(self, query):
+        if query.keywords and settings.SEARCH_TABLE:
+            return self.database.facets(query)
+        arrays = self.get_arrays()
+        if query.range > 0:
+            located = self.within(arrays, query.point.y, query.point.x,
+                                  query.range)
+        else:
+            located = np.arange(len(arrays['lat']))
+        mask = np.isin(arrays['photo_owner'], arrays['loc_owner'][located])
+        if query.keywords:
+            mask &= np.isin(arrays['photo_id'], np.array(
+                list(self.keyword_ranks(query.keywords)), dtype=np.int64))
+        photo_owners = arrays['photo_owner'][mask]
+        counts = {}
+        for slug, owners in arrays['slugs'].items():
+            count = int(np.isin(photo_owners, owners).sum())
+            if count:
+                counts[slug] = count
+        return counts
+
+    def photographers(self, zip_code, photo_ids=None):
+        photographers = Photographer.objects.filter(
+            pk__in=zip_index.photographer_ids(zip_code))
+        if photo_ids:
+            photographers = photographers.filter(photos__id__in=photo_ids)
+        return photographers
+
+    def with_nearest_location(self, photographers, pnt=None):
+        # same annotations as search_index.with_nearest_location, the
+        # distances computed here instead of with PostGIS
+        if pnt is None:
+            return search_index.with_nearest_location(photographers)
+        photographers = list(photographers)
+        columns = search_index.NEAREST_LOCATION_COLUMNS
+        lat, lng = math.radians(pnt.y), math.radians(pnt.x)
+        nearest, distances = {}, {}
+        locations = Location.objects.filter(
+            photographer_id__in=[p.pk for p in photographers], deleted=False)\
+            .order_by('pk')\
+            .values_list('photographer_id', 'point', 'geocode_status',
+                         *columns)
+        for row in locations:
+            owner, point, status = row[:3]
+            km = None
+            if point is not None:
+                km = float(haversine_km(lat, lng, math.radians(point.y),
+                                        math.radians(point.x)))
+                distances[owner] = min(km, distances.get(owner, km))
+            # geocoded locations only, nearest first, then the oldest
+            order = (km is None, km or 0)
+            if status == Location.GEOCODED and (
+                    owner not in nearest or order < nearest[owner][0]):
+                nearest[owner] = (order, row[3:])
+        missing = (None, [None] * len(columns))
+        for photographer in photographers:
+            values = nearest.get(photographer.pk, missing)[1]
+            for column, value in zip(columns, values):
+                setattr(photographer, 'nearest_' + column, value)
+            photographer.distance_km = distances.get(photographer.pk)
+        return sorted(photographers, key=lambda p: (
+            p.distance_km is None, p.distance_km or 0, p.pk))
+
+    def shuffled_ids(self, seed, limit):
+        arrays = self.get_arrays()
+        order = np.lexsort((arrays['photo_id'],
+                            self.shuffle_keys(arrays, seed)))
+        return arrays['photo_id'][order[:limit]].tolist()
+
+    def sample_ids(self, count):
+        photo_ids = self.get_arrays()['photo_id']
+        return np.random.choice(photo_ids, min(count, len(photo_ids)),
+                                replace=False).tolist()
+
+
+def _grid_cell(lat, lng):
+    return (int(math.floor(lat / GRID_DEGREES)),
+            int(math.floor(lng / GRID_DEGREES)))
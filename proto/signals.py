@@ -0,0 +1,105 @@
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from proto import entitlements, metrics, portfolio, search_backends, \
+    search_index, viewers, zip_index
+from proto.models import Photo, Photographer, Location, Category, Like, \
+    Impression, PhotographerSubscription, Subscription
+
+
+@receiver(post_save, sender=Photo)
+def photo_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search_index.refresh_photos([instance.pk])
+        search_backends.photographers_changed([instance.photographer_id])
+        portfolio.changed([instance.photographer_id])
+        entitlements.changed([instance.photographer_id])
+
+
+@receiver(post_delete, sender=Photo)
+def photo_deleted(sender, instance, **kwargs):
+    # soft deletes are saves, this covers the hard ones
+    portfolio.changed([instance.photographer_id])
+    entitlements.changed([instance.photographer_id])
+
+
+@receiver(m2m_changed, sender=Category.photos.through)
+def photo_categories_changed(sender, instance, action, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if isinstance(instance, Photo):
+        portfolio.changed([instance.photographer_id])
+    elif action == 'post_clear':
+        portfolio.changed(Photographer.objects.values_list('pk', flat=True))
+    else:
+        portfolio.changed(set(Photo.objects.filter(pk__in=pk_set)
+                              .values_list('photographer_id', flat=True)))
+
+
+@receiver(post_save, sender=Photographer)
+def photographer_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search_index.refresh_photographers([instance.pk])
+        search_backends.photographers_changed([instance.pk])
+        zip_index.changed([instance.pk])
+
+
+@receiver(post_save, sender=Location)
+@receiver(post_delete, sender=Location)
+def location_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search_index.refresh_photographers([instance.photographer_id])
+        search_backends.photographers_changed([instance.photographer_id])
+        zip_index.changed([instance.photographer_id])
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search_index.refresh_category(instance)
+        search_backends.photographers_changed()
+
+
+@receiver(m2m_changed, sender=Category.photographers.through)
+def photographer_categories_changed(sender, instance, action, pk_set,
+                                    **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if isinstance(instance, Photographer):
+        search_index.refresh_photographers([instance.pk])
+        search_backends.photographers_changed([instance.pk])
+    elif action == 'post_clear':
+        search_index.refresh_category(instance)
+        search_backends.photographers_changed()
+    else:
+        search_index.refresh_photographers(pk_set)
+        search_backends.photographers_changed(pk_set)
+
+
+@receiver(post_save, sender=PhotographerSubscription)
+@receiver(post_delete, sender=PhotographerSubscription)
+def photographer_subscription_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        entitlements.changed([instance.photographer_id])
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def subscription_changed(sender, instance, raw=False, **kwargs):
+    # new limits for everyone on the plan
+    if not raw:
+        entitlements.changed(instance.subscriptions.values_list(
+            'photographer_id', flat=True))
+
+
+@receiver(post_save, sender=Like)
+@receiver(post_save, sender=Impression)
+def metric_saved(sender, instance, created, raw=False, **kwargs):
+    # single saves, the metric write path counts its bulk inserts itself
+    if created and not raw:
+        metrics.increment(sender, {instance.photo_id: 1})
+        if sender is Impression:
+            viewers.record([instance])
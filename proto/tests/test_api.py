@@ -1,10 +1,14 @@
 # coding:utf-8
 from django.core.urlresolvers import reverse
 
+from proto import leaderboard, metrics, rollups, zip_index
+from proto.models import Category, Impression, Like, Location
 from proto.tests.utils import UserTestCase
 
 
-__all__ = ['PhotoListTestCase']
+__all__ = ['PhotoListTestCase', 'ZipCodeListTestCase',
+           'CategoryFacetsTestCase', 'MetricSeriesTestCase',
+           'LeaderboardTestCase']
 
 
 class PhotoListTestCase(UserTestCase):
@@ -14,3 +18,146 @@ class PhotoListTestCase(UserTestCase):
 
         # tests
         self.assertGreater(len(response.data), 0)
+
+    def test_photo_list_filters_by_keywords(self):
+        # setup
+        photo = self.photographer.photos.first()
+        photo.title = 'Sonnenuntergang'
+        photo.save()
+        response = self.client.get(reverse('api_photos'),
+                                   {'q': 'sonnenuntergang'})
+
+        # tests
+        self.assertEqual([item['id'] for item in response.data], [photo.id])
+
+
+class ZipCodeListTestCase(UserTestCase):
+    def test_zip_codes_complete_the_prefix(self):
+        # setup
+        zip_index.warm_up()
+        location = Location(
+            zip_code='10559',
+            country='Deutschland',
+            state='Deutschland',
+            city='Berlin',
+            street='Liboristr. 61',
+            photographer=self.photographer,
+            lat=52.5299,
+            lng=13.3467,
+        )
+        location.save()
+        found = self.client.get(reverse('api_zip_codes'), {'q': '105'})
+        missing = self.client.get(reverse('api_zip_codes'), {'q': '106'})
+
+        # tests
+        self.assertIn({'zip_code': '10559', 'city': 'Berlin',
+                       'photographers': 1}, found.data)
+        self.assertEqual(missing.data, [])
+
+        # teardown
+        location.delete()
+        self.assertEqual(zip_index.photographer_ids('10559'), set())
+
+
+class CategoryFacetsTestCase(UserTestCase):
+    def test_facets_count_photos_per_category_in_range(self):
+        # setup
+        location = Location(
+            zip_code='10559',
+            country='Deutschland',
+            state='Deutschland',
+            city='Berlin',
+            street='Liboristr. 61',
+            photographer=self.photographer,
+            lat=52.5299,
+            lng=13.3467,
+        )
+        location.save()
+        category = self.photographer.category_set.first()
+        search = {'lat': 52.5167, 'lng': 13.3667, 'range': 10}
+        near = self.client.get(reverse('api_facets'), search)
+        search['range'] = 1
+        far = self.client.get(reverse('api_facets'), search)
+
+        # tests
+        near_counts = {item['slug']: item['count'] for item in near.data}
+        far_counts = {item['slug']: item['count'] for item in far.data}
+        self.assertEqual(near_counts[category.slug],
+                         self.photographer.active_photos().count())
+        self.assertEqual(sum(far_counts.values()), 0)
+        self.assertEqual(len(near.data), Category.objects.count())
+
+        # teardown
+        location.delete()
+
+
+class MetricSeriesTestCase(UserTestCase):
+    def test_series_adds_the_tail_to_the_rollups(self):
+        # setup
+        photo, other = self.photographer.photos.all()[:2]
+        metrics.record([Like(ip='10.0.0.1', photo_id=photo.pk)
+                        for _ in range(2)])
+        rollups.roll_up(lag=0)
+        metrics.record([Like(ip='10.0.0.1', photo_id=other.pk)])
+        metrics.record([Impression(ip='10.0.0.1', photo_id=photo.pk)
+                        for _ in range(3)])
+        days = self.client.get(reverse('api_stats'))
+        months = self.client.get(reverse('api_stats'), {'period': 'month',
+                                                        'photo': photo.pk})
+
+        # tests
+        self.assertEqual(len(days.data), 1)
+        self.assertEqual(days.data[0]['likes'], 3)
+        self.assertEqual(days.data[0]['impressions'], 3)
+        self.assertEqual(months.data[0]['likes'], 2)
+        self.assertTrue(months.data[0]['period'].endswith('-01'))
+
+    def test_series_needs_a_login(self):
+        # setup
+        self.client.logout()
+        response = self.client.get(reverse('api_stats'))
+
+        # tests
+        self.assertIn(response.status_code, (401, 403))
+
+        # teardown
+        self.client.login(username=self.user.username, password='password')
+
+
+class LeaderboardTestCase(UserTestCase):
+    def test_leaderboard_ranks_photographers_of_the_region(self):
+        # setup
+        location = Location(
+            zip_code='10117',
+            country='Deutschland',
+            state='Deutschland',
+            city='Berlin',
+            street='Unter den Linden 1',
+            photographer=self.photographer,
+            lat=52.52,
+            lng=13.37,
+        )
+        location.save()
+        photo = self.photographer.photos.first()
+        metrics.record([Like(ip='10.0.0.1', photo_id=photo.pk)
+                        for _ in range(2)])
+        rollups.roll_up(lag=0)
+        written = leaderboard.rebuild()
+        search = {'lat': 52.5167, 'lng': 13.3667}
+        everything = self.client.get(reverse('api_leaderboard'), search)
+        search['category'] = self.photographer.category_set.first().slug
+        in_category = self.client.get(reverse('api_leaderboard'), search)
+        far = self.client.get(reverse('api_leaderboard'),
+                              {'lat': 48.1374, 'lng': 11.5755})
+
+        # tests
+        # the photographer's one category and all categories
+        self.assertEqual(written, 2)
+        self.assertEqual(everything.data, [
+            {'rank': 1, 'score': 2.0, 'photographer': self.photographer.pk,
+             'company_name': self.photographer.company_name}])
+        self.assertEqual(in_category.data[0]['rank'], 1)
+        self.assertEqual(far.data, [])
+
+        # teardown
+        location.delete()
@@ -0,0 +1,175 @@
+import datetime
+import json
+import os
+import shutil
+import tempfile
+
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.test import override_settings
+from django.utils import timezone
+from django.utils.six import StringIO
+
+from proto import hll, metrics, partitions, rollups, viewers
+from proto.metrics import MetricsWriter
+from proto.models import Impression, Like, Photo
+from proto.tests.utils import UserTestCase
+
+__all__ = ['MetricsWriterTestCase', 'UniqueViewersTestCase',
+           'PartitionsTestCase', 'ExportTestCase']
+
+
+class MetricsWriterTestCase(UserTestCase):
+    def test_writer_batches_events_and_drops_the_overflow(self):
+        # setup
+        photo = self.photographer.photos.first()
+        writer = MetricsWriter(interval_ms=60000, batch_size=100,
+                               max_pending=3)
+        writer.add([Like(ip='127.0.0.1', photo_id=photo.pk)])
+        writer.add([Impression(ip='127.0.0.1', photo_id=photo.pk)
+                    for _ in range(3)])
+        # written from the test's thread, the writer's thread would not see
+        # the test's rows
+        with self.assertLogs('proto.metrics', 'WARNING') as logged:
+            flushed = writer.flush()
+        writer.stop()
+
+        # tests
+        self.assertEqual(flushed, 3)
+        self.assertEqual(photo.likes.count(), 1)
+        self.assertEqual(photo.impressions.count(), 2)
+        self.assertEqual(writer.stats(), {'queued': 3, 'dropped': 1,
+                                          'flushed': 3, 'pending': 0})
+        self.assertEqual(len(logged.output), 1)
+        self.assertIn('Dropped 1 metric events', logged.output[0])
+
+    def test_writer_keeps_the_batch_around_a_bad_event(self):
+        # setup
+        photo = self.photographer.photos.first()
+        writer = MetricsWriter(interval_ms=60000, batch_size=100,
+                               max_pending=100)
+        writer.add([Like(ip='127.0.0.1', photo_id=photo.pk),
+                    Like(ip='127.0.0.1', photo_id='x'),
+                    Like(ip='127.0.0.1', photo_id=photo.pk)])
+        # flushed from the test's thread, see above
+        with self.assertLogs('proto.metrics', 'ERROR') as logged:
+            flushed = writer.flush()
+        writer.stop()
+
+        # tests
+        self.assertEqual(flushed, 2)
+        self.assertEqual(photo.likes.count(), 2)
+        self.assertEqual(writer.stats()['failed'], 1)
+        self.assertEqual(len(logged.output), 1)
+
+    def test_counters_follow_writes_and_are_reconciled(self):
+        # setup
+        photo, other = self.photographer.photos.all()[:2]
+        metrics.record([Like(photo_id=photo.pk), Like(photo_id=photo.pk),
+                        Like(photo_id=other.pk)])
+        Impression.objects.create(photo=photo)
+        Photo.objects.filter(pk=other.pk).update(like_count=7)
+        mismatches = metrics.reconcile(fix=True)
+
+        # tests
+        photo.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((photo.like_count, photo.impression_count), (2, 1))
+        self.assertEqual([row[0] for row in mismatches], [other.pk])
+        self.assertEqual(other.like_count, 1)
+        self.assertEqual(metrics.reconcile(), [])
+
+
+class UniqueViewersTestCase(UserTestCase):
+    def test_sketches_count_distinct_viewers_per_photo_and_photographer(self):
+        # setup
+        photo, other = self.photographer.photos.all()[:2]
+        metrics.record([Impression(ip='10.0.0.{}'.format(n % 3),
+                                   photo_id=photo.pk) for n in range(9)])
+        metrics.record([Impression(ip='10.0.0.{}'.format(n), photo_id=other.pk)
+                        for n in range(5)])
+
+        # tests
+        self.assertEqual(viewers.unique_viewers(photo=photo), 3)
+        self.assertEqual(viewers.unique_viewers(photo=other), 5)
+        self.assertEqual(
+            viewers.unique_viewers(photographer=self.photographer), 5)
+
+    def test_sketches_merge_to_the_union(self):
+        # setup
+        first = hll.add(None, range(0, 6000))
+        second = hll.add(None, range(3000, 9000))
+
+        # tests
+        self.assertAlmostEqual(hll.count(hll.merge([first, second])), 9000,
+                               delta=9000 * 0.1)
+        self.assertEqual(hll.count(hll.merge([first, first])),
+                         hll.count(first))
+
+
+class PartitionsTestCase(UserTestCase):
+    def test_expired_partitions_are_archived_once_rolled_up(self):
+        # setup
+        photo = self.photographer.photos.first()
+        today = timezone.now().date()
+        old_month = (today - datetime.timedelta(days=3 * 366)).replace(day=1)
+        partitions.create_ahead(1, today=old_month)
+        like = Like.objects.create(photo=photo)
+        Like.objects.filter(pk=like.pk).update(
+            created_on=timezone.now() - datetime.timedelta(days=3 * 366))
+        directory = tempfile.mkdtemp()
+        kept = partitions.archive_expired(12, directory)
+        rollups.roll_up(lag=0)
+        archived = partitions.archive_expired(12, directory)
+
+        # tests
+        name = 'proto_like_{:%Y_%m}'.format(old_month)
+        path = os.path.join(directory, name + '.csv.gz')
+        self.assertNotIn(path, kept)
+        self.assertIn(path, archived)
+        self.assertFalse(Like.objects.filter(pk=like.pk).exists())
+        self.assertNotIn(name, partitions.expired('proto_like', today))
+        self.assertEqual(
+            self.photographer.__class__.objects.get(
+                pk=self.photographer.pk).likes(), 1)
+
+        # teardown
+        shutil.rmtree(directory)
+
+
+@override_settings(EXPORT_CHUNK_ROWS=2)
+class ExportTestCase(UserTestCase):
+    def test_export_streams_the_photographers_metrics(self):
+        # setup
+        photo = self.photographer.photos.first()
+        metrics.record([Like(ip='10.0.0.1', photo_id=photo.pk)])
+        metrics.record([Impression(ip='10.0.0.{}'.format(n),
+                                   photo_id=photo.pk) for n in range(5)])
+        response = self.client.get(reverse('settings_metrics_export'),
+                                   {'as': 'ndjson', 'metric': 'impression'})
+        rows = [json.loads(line.decode('utf-8')) for line
+                in b''.join(response.streaming_content).splitlines()]
+
+        # tests
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(len({row['id'] for row in rows}), 5)
+        self.assertEqual({row['metric'] for row in rows}, {'impression'})
+
+    def test_export_command_writes_csv_for_the_range(self):
+        # setup
+        photo = self.photographer.photos.first()
+        metrics.record([Like(ip='10.0.0.1', photo_id=photo.pk)
+                        for _ in range(3)])
+        today = timezone.localtime(timezone.now()).date()
+        out, empty = StringIO(), StringIO()
+        call_command('exportmetrics', str(self.photographer.pk),
+                     start=today, end=today, stdout=out)
+        call_command('exportmetrics', str(self.photographer.pk),
+                     end=today - datetime.timedelta(days=1), stdout=empty)
+
+        # tests
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0], 'metric,id,created_on,photo_id,user_id,ip')
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(len(empty.getvalue().splitlines()), 1)
@@ -1,11 +1,15 @@
 from django.conf import settings
+from django.core.management import call_command
 from django.db.models.aggregates import Count
 from django.test import TestCase
 from django.utils import timezone
+from django.utils.six import StringIO
 
-from proto.models import Category, Location, Subscription
-from proto.models import PhotographerSubscription, Like, Impression
-from proto.tests.utils import UserTestCase
+from proto import geocode_worker, geocoding, sampling
+from proto.models import Category, GeocodeCache, Location, Subscription
+from proto.models import PhotographerSubscription, Like, Impression, \
+    Photographer, PhotoDailyStats
+from proto.tests.utils import FakeGeocoder, UserTestCase
 
 __all__ = ['CategoryTestCase', 'PhotographerTestCase', 'LocationTestCase']
 
@@ -106,6 +110,26 @@ class PhotographerTestCase(UserTestCase):
         # teardown
         Impression.objects.all().delete()
 
+    def test_photographer_metrics_read_rollups_and_tail(self):
+        # setup
+        photo = self.photographer.photos.first()
+        for _ in range(3):
+            Like.objects.create(photo=photo)
+        Impression.objects.create(photo=photo)
+        call_command('rollupmetrics', lag=0, stdout=StringIO())
+        Like.objects.create(photo=photo)
+        photographer = Photographer.objects.get(pk=self.photographer.pk)
+
+        # tests
+        stats = PhotoDailyStats.objects.get(photo=photo)
+        self.assertEqual((stats.likes, stats.impressions), (3, 1))
+        self.assertEqual(photographer.likes(), 4)
+        self.assertEqual(photographer.impressions(), 1)
+
+        # teardown
+        Like.objects.all().delete()
+        Impression.objects.all().delete()
+
     def test_photographer_active_categories(self):
         # setup: we assume the only photos in the database are from this user.
         active_categories = \
@@ -133,6 +157,20 @@ class PhotographerTestCase(UserTestCase):
                 self.photographer.active_photos().filter(pk=photo.pk).count(),
                 1)
 
+    def test_sampling_draws_distinct_rows_of_the_queryset(self):
+        # setup
+        photos = self.photographer.active_photos()
+        ids = set(photos.values_list('pk', flat=True))
+        sampled = sampling.sample_ids(photos, 3)
+        everything = sampling.sample_ids(photos, len(ids) + 10)
+
+        # tests
+        self.assertTrue(0 < len(sampled) <= 3)
+        self.assertEqual(len(set(sampled)), len(sampled))
+        self.assertTrue(set(sampled) <= ids)
+        self.assertTrue(set(everything) <= ids)
+        self.assertEqual(sampling.sample_ids(photos.none(), 3), [])
+
     def test_photographer_active_photos(self):
         # setup
         photo = self.photographer.photos.first()
@@ -169,3 +207,148 @@ class LocationTestCase(UserTestCase):
 
         # teardown
         Location.objects.all().delete()
+
+    def test_location_reads_the_geocode_cache(self):
+        # setup
+        geocoding.remember(u'Liboristra\xdfe 61,  berlin, 10559', 52.5299,
+                           13.3467)
+        location = Location(
+            zip_code='10559',
+            country='Deutschland',
+            state='Deutschland',
+            city='Berlin',
+            street='Liboristr. 61',
+            photographer=self.photographer)
+        location.save()
+
+        # tests
+        self.assertAlmostEqual(location.point.y, 52.5299)
+        self.assertAlmostEqual(location.point.x, 13.3467)
+        self.assertEqual(GeocodeCache.objects.count(), 1)
+
+        # teardown
+        location.delete()
+        GeocodeCache.objects.all().delete()
+
+    def test_geocode_cache_keeps_negative_results_until_they_expire(self):
+        # setup
+        address = 'Nirgendwo 1, Nirgends, 00000'
+        GeocodeCache.objects.create(
+            address=geocoding.normalize(address),
+            status=GeocodeCache.ZERO_RESULTS,
+            expires_on=timezone.now() + timezone.timedelta(days=1))
+        found = geocoding.geocode(address)
+        GeocodeCache.objects.update(
+            expires_on=timezone.now() - timezone.timedelta(days=1))
+
+        # tests
+        self.assertIsNone(found)
+        self.assertIsNone(geocoding.lookup(address))
+
+        # teardown
+        GeocodeCache.objects.all().delete()
+
+    def test_locations_wait_for_the_geocoding_worker(self):
+        # setup
+        found = Location(
+            zip_code='10559',
+            country='Deutschland',
+            state='Deutschland',
+            city='Berlin',
+            street='Liboristr. 61',
+            photographer=self.photographer)
+        found.save()
+        missing = Location(
+            zip_code='00000',
+            country='Deutschland',
+            state='Deutschland',
+            city='Nirgends',
+            street='Nirgendwo 1',
+            photographer=self.photographer)
+        missing.save()
+        saved = set(Location.objects.filter(pk__in=[found.pk, missing.pk])
+                    .values_list('geocode_status', flat=True))
+        places = {geocoding.normalize(found.full_address()):
+                  (52.5299, 13.3467)}
+        with FakeGeocoder(places) as geocoder, \
+                self.settings(GEOCODE_URL=geocoder.url):
+            outcomes = geocode_worker.drain(threads=1, per_second=0)
+            again = geocode_worker.drain(threads=1, per_second=0)
+        found = Location.objects.get(pk=found.pk)
+
+        # tests
+        self.assertEqual(saved, {Location.PENDING})
+        self.assertEqual(outcomes, {'ok': 1, 'failed': 1})
+        self.assertEqual(again, {})
+        self.assertEqual(len(geocoder.asked), 2)
+        self.assertEqual(found.geocode_status, Location.GEOCODED)
+        self.assertAlmostEqual(found.point.y, 52.5299)
+        self.assertEqual(Location.objects.get(pk=missing.pk).geocode_status,
+                         Location.FAILED)
+
+        # teardown
+        Location.objects.all().delete()
+        GeocodeCache.objects.all().delete()
+
+    def test_failed_locations_are_geocoded_again_once_due(self):
+        # setup
+        location = Location(
+            zip_code='10559',
+            country='Deutschland',
+            state='Deutschland',
+            city='Berlin',
+            street='Liboristr. 61',
+            photographer=self.photographer)
+        location.save()
+        places = {geocoding.normalize(location.full_address()):
+                  (52.5299, 13.3467)}
+        with FakeGeocoder({}) as geocoder, \
+                self.settings(GEOCODE_URL=geocoder.url):
+            failed = geocode_worker.drain(threads=1, per_second=0)
+            not_due = geocode_worker.drain(threads=1, per_second=0)
+        expired = timezone.now() - timezone.timedelta(seconds=1)
+        GeocodeCache.objects.update(expires_on=expired)
+        Location.objects.update(geocode_retry_on=expired)
+        with FakeGeocoder(places) as geocoder, \
+                self.settings(GEOCODE_URL=geocoder.url):
+            retried = geocode_worker.drain(threads=1, per_second=0)
+
+        # tests
+        self.assertEqual(failed, {'failed': 1})
+        self.assertEqual(not_due, {})
+        self.assertEqual(retried, {'ok': 1})
+        self.assertEqual(Location.objects.get(pk=location.pk).geocode_status,
+                         Location.GEOCODED)
+
+        # teardown
+        Location.objects.all().delete()
+        GeocodeCache.objects.all().delete()
+
+    def test_saving_a_geocoded_location_keeps_its_point(self):
+        # setup
+        location = Location(
+            zip_code='10559',
+            country='Deutschland',
+            state='Deutschland',
+            city='Berlin',
+            street='Liboristr. 61',
+            photographer=self.photographer,
+            lat=52.5299,
+            lng=13.3467)
+        location.save()
+        location = Location.objects.get(pk=location.pk)
+        location.state = 'Berlin'
+        location.save()
+        kept = Location.objects.get(pk=location.pk)
+        location.street = 'Liboristr. 62'
+        location.save()
+        moved = Location.objects.get(pk=location.pk)
+
+        # tests
+        self.assertEqual(kept.geocode_status, Location.GEOCODED)
+        self.assertAlmostEqual(kept.point.y, 52.5299)
+        self.assertEqual(moved.geocode_status, Location.PENDING)
+        self.assertIsNone(moved.point)
+
+        # teardown
+        Location.objects.all().delete()
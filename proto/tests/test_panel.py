@@ -4,7 +4,9 @@ from django.core.urlresolvers import reverse
 from os import listdir
 from os.path import join
 
-from proto.models import Category, Photo
+from proto import entitlements, portfolio
+from proto.models import Category, Photo, PhotographerSubscription, \
+    Subscription
 from proto.tests.utils import UserTestCase, random_string
 
 __all__ = ['PersonalSettingsTestCase', 'PortfolioTestCase',
@@ -172,6 +174,21 @@ class PortfolioTestCase(UserTestCase):
         for photo in top_photos:
             self.assertIn(photo,  self.photographer.top_photos())
 
+    def test_portfolio_summary_takes_two_queries_until_a_photo_changes(self):
+        # setup
+        with self.assertNumQueries(2):
+            first = portfolio.summary(self.photographer.pk)
+        with self.assertNumQueries(0):
+            cached = portfolio.summary(self.photographer.pk)
+        self.photographer.photos.first().delete()
+        second = portfolio.summary(self.photographer.pk)
+
+        # tests
+        self.assertEqual(first['photos'],
+                         self.photographer.active_photos().count() + 1)
+        self.assertEqual(cached['photos'], first['photos'])
+        self.assertEqual(second['photos'], first['photos'] - 1)
+
 
 class CategoryDetailTestCase(UserTestCase):
     def test_category_detail_is_login_protected(self):
@@ -287,6 +304,69 @@ class UploadTestCase(UserTestCase):
         self.assertGreater(self.photographer.photos.count(), photo_count)
         self.assertEqual(Category.objects.filter(name=new_category).count(), 1)
 
+    def test_upload_enforces_the_photo_quota(self):
+        # setup
+        category = Category.objects.first()
+        image_path = listdir(join(settings.BASE_DIR, 'static', 'assets', 'img'))[0]
+        image_path = join(settings.BASE_DIR, 'static', 'assets', 'img', image_path)
+        photo_count = self.photographer.active_photos().count()
+        subscription = Subscription.objects.create(
+            name='Basic', likes=1000, photos=photo_count, price=10)
+        PhotographerSubscription.objects.create(
+            program='Test program', photographer=self.photographer,
+            subscription=subscription)
+        entitlements.get(self.photographer.pk)
+
+        with open(image_path, 'rb') as image:
+            photo_data = {
+                'title': random_string(10),
+                'description': random_string(10),
+                'image': image,
+                'categories': [category.pk]
+            }
+            response = self.client.post(reverse('settings_upload'), photo_data)
+
+        # tests
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['form'].non_field_errors())
+        self.assertEqual(response.context['entitlements']['photos_left'], 0)
+        self.assertEqual(self.photographer.active_photos().count(),
+                         photo_count)
+
+        # teardown
+        subscription.delete()
+
+    def test_upload_enforces_the_likes_quota(self):
+        # setup
+        category = Category.objects.first()
+        image_path = listdir(join(settings.BASE_DIR, 'static', 'assets', 'img'))[0]
+        image_path = join(settings.BASE_DIR, 'static', 'assets', 'img', image_path)
+        photo_count = self.photographer.active_photos().count()
+        subscription = Subscription.objects.create(
+            name='Basic', likes=0, photos=photo_count + 1, price=10)
+        PhotographerSubscription.objects.create(
+            program='Test program', photographer=self.photographer,
+            subscription=subscription)
+
+        with open(image_path, 'rb') as image:
+            photo_data = {
+                'title': random_string(10),
+                'description': random_string(10),
+                'image': image,
+                'categories': [category.pk]
+            }
+            response = self.client.post(reverse('settings_upload'), photo_data)
+
+        # tests
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['form'].non_field_errors())
+        self.assertEqual(response.context['entitlements']['likes_left'], 0)
+        self.assertEqual(self.photographer.active_photos().count(),
+                         photo_count)
+
+        # teardown
+        subscription.delete()
+
 
 class UpdateTestCase(UserTestCase):
     def test_update_is_login_protected(self):
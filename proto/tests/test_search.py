@@ -1,8 +1,17 @@
+import math
+
 from django.conf import settings
+from django.core.management import call_command
+from django.contrib.gis.geos import Point
 from django.core.urlresolvers import reverse
+from django.test import override_settings
 
-from proto.models import Category, Location, Impression
-from proto.tests.utils import UserTestCase
+from proto import geohash, leaderboard, metrics, photo_pool, rollups, \
+    search_backends, search_cache
+from proto.models import Category, Location, Impression, Like, \
+    PhotographerRank, PhotoSearch
+from proto.tests.utils import UserTestCase, create_user_and_photographer, \
+    postgres_only
 
 
 class PhotoListInitialTestCase(UserTestCase):
@@ -18,6 +27,20 @@ class PhotoListInitialTestCase(UserTestCase):
         self.assertLessEqual(response.context['photos'].count(),
                              settings.PHOTOS_PER_BATCH)
 
+    def test_home_samples_active_photos_from_the_pool(self):
+        # setup
+        photo_pool.refresh()
+        disabled = self.photographer.photos.first()
+        disabled.disabled = True
+        disabled.save()
+        response = self.client.get(reverse('home'))
+
+        # tests
+        photos = list(response.context['photos'])
+        self.assertEqual(len(photos),
+                         self.photographer.active_photos().count())
+        self.assertNotIn(disabled, photos)
+
 
 class PhotographersByPhotoTestCase(UserTestCase):
     def test_photographers_by_photo_returns_this_photographer(self):
@@ -52,6 +75,68 @@ class PhotographersByPhotoTestCase(UserTestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(likes + 1, photo.likes.count())
 
+    def test_photographers_by_photo_likes_active_photos_only(self):
+        # setup
+        photo, disabled = self.photographer.photos.all()[:2]
+        disabled.disabled = True
+        disabled.save()
+        response = self.client.post(
+            reverse('photographers'),
+            {
+                'ids': ',x,{},{},999999999'.format(photo.id, disabled.id),
+                'lat': 52.531677,
+                'lng': 13.381777,
+                'range': 100
+            })
+
+        # tests
+        self.assertEqual(response.status_code, 200)
+        self.assertListEqual(response.context['hidden_ids'], [photo.id])
+        self.assertEqual(Like.objects.count(), 1)
+        self.assertEqual(photo.likes.count(), 1)
+
+    def test_photographers_by_photo_annotates_nearest_location(self):
+        # setup
+        far = Location(
+            zip_code='80331',
+            country='Deutschland',
+            state='Bayern',
+            city='Muenchen',
+            street='Marienplatz 1',
+            photographer=self.photographer,
+            lat=48.1374,
+            lng=11.5755,
+        )
+        far.save()
+        near = Location(
+            zip_code='10559',
+            country='Deutschland',
+            state='Deutschland',
+            city='Berlin',
+            street='Liboristr. 61',
+            photographer=self.photographer,
+            lat=52.5299,
+            lng=13.3467,
+        )
+        near.save()
+        response = self.client.post(
+            reverse('photographers'),
+            {
+                'ids': self.photographer.active_photos().first().id,
+                'lat': 52.5167,
+                'lng': 13.3667,
+            })
+        photographer = response.context['photographers'][0]
+
+        # tests
+        self.assertEqual(photographer, self.photographer)
+        self.assertEqual(photographer.nearest_zip_code, '10559')
+        self.assertAlmostEqual(photographer.distance_km, 2.0, delta=0.05)
+
+        # teardown
+        near.delete()
+        far.delete()
+
 
 class PartialPhotosTestCase(UserTestCase):
     def test_partial_photos_wont_return_photos_when_lat_or_lng_are_present(self):
@@ -75,6 +160,8 @@ class PartialPhotosTestCase(UserTestCase):
             city='Berlin',
             street='Liboristr. 61',
             photographer=self.photographer,
+            lat=52.5299,
+            lng=13.3467,
         )
         location.save()
         response = self.client.post(
@@ -105,7 +192,9 @@ class PartialPhotosTestCase(UserTestCase):
             city='Berlin',
             street='Liboristr. 61',
             photographer=self.photographer,
-            point=None
+            point=None,
+            lat=52.5299,
+            lng=13.3467,
         )
         location.save()
         response = self.client.post(
@@ -134,6 +223,8 @@ class PartialPhotosTestCase(UserTestCase):
             city='Berlin',
             street='Liboristr. 61',
             photographer=self.photographer,
+            lat=52.5299,
+            lng=13.3467,
         )
         location.save()
         category = self.photographer.category_set.first()
@@ -155,6 +246,275 @@ class PartialPhotosTestCase(UserTestCase):
         # teardown
         location.delete()
 
+    def test_partial_photos_keeps_order_for_the_issued_seed(self):
+        # setup
+        location = Location(
+            zip_code='10559',
+            country='Deutschland',
+            state='Deutschland',
+            city='Berlin',
+            street='Liboristr. 61',
+            photographer=self.photographer,
+            lat=52.5299,
+            lng=13.3467,
+        )
+        location.save()
+        search = {
+            'geo[name]': 'Mitte, Berlin',
+            'geo[lat]': 52.5167,
+            'geo[lng]': 13.3667,
+            'geo[range]': 1000
+        }
+        first = self.client.post(reverse('partial_photos'), search)
+        search['seed'] = first.context['seed']
+        second = self.client.post(reverse('partial_photos'), search)
+
+        # tests
+        self.assertEqual(first.status_code, 200)
+        self.assertTrue(first.context['photos'])
+        self.assertListEqual(list(first.context['photos']),
+                             list(second.context['photos']))
+
+        # teardown
+        location.delete()
+
+    def test_partial_photos_cursor_walks_every_photo_once(self):
+        # setup
+        location = Location(
+            zip_code='10559',
+            country='Deutschland',
+            state='Deutschland',
+            city='Berlin',
+            street='Liboristr. 61',
+            photographer=self.photographer,
+            lat=52.5299,
+            lng=13.3467,
+        )
+        location.save()
+        search = {
+            'geo[name]': 'Mitte, Berlin',
+            'geo[lat]': 52.5167,
+            'geo[lng]': 13.3667,
+            'geo[range]': 1000
+        }
+        seen = []
+        with self.settings(PHOTOS_PER_BATCH=2):
+            response = self.client.post(reverse('partial_photos'), search)
+            seen.extend(response.context['photos'])
+            while response.context['cursor']:
+                search['cursor'] = response.context['cursor']
+                response = self.client.post(reverse('partial_photos'), search)
+                seen.extend(response.context['photos'])
+
+        # tests
+        self.assertTrue(seen)
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(len(seen), self.photographer.active_photos().count())
+
+        # teardown
+        location.delete()
+
+    def test_partial_photos_cursor_keeps_its_keywords(self):
+        # setup
+        location = Location(
+            zip_code='10559',
+            country='Deutschland',
+            state='Deutschland',
+            city='Berlin',
+            street='Liboristr. 61',
+            photographer=self.photographer,
+            lat=52.5299,
+            lng=13.3467,
+        )
+        location.save()
+        in_title, in_description = self.photographer.photos.all()[:2]
+        in_title.title = 'Hochzeit am Wannsee'
+        in_title.save()
+        in_description.description = 'Hochzeit im Standesamt'
+        in_description.save()
+        search = {
+            'geo[name]': 'Mitte, Berlin',
+            'geo[lat]': 52.5167,
+            'geo[lng]': 13.3667,
+            'geo[range]': 1000,
+            'keywords': 'hochzeit',
+        }
+        with self.settings(PHOTOS_PER_BATCH=1):
+            first = self.client.post(reverse('partial_photos'), search)
+            search['cursor'] = first.context['cursor']
+            del search['keywords']
+            dropped = self.client.post(reverse('partial_photos'), search)
+            plain = self.client.post(reverse('partial_photos'),
+                                     dict(search, cursor=''))
+            search['cursor'] = plain.context['cursor']
+            search['keywords'] = 'wannsee'
+            added = self.client.post(reverse('partial_photos'), search)
+
+        # tests
+        self.assertListEqual(list(first.context['photos']), [in_title])
+        self.assertEqual(dropped.status_code, 200)
+        self.assertListEqual(list(dropped.context['photos']),
+                             [in_description])
+        self.assertEqual(added.status_code, 200)
+        self.assertEqual(len(added.context['photos']), 1)
+
+        # teardown
+        location.delete()
+
+    @postgres_only
+    def test_partial_photos_total_is_counted_or_estimated(self):
+        # setup
+        location = Location(
+            zip_code='10559',
+            country='Deutschland',
+            state='Deutschland',
+            city='Berlin',
+            street='Liboristr. 61',
+            photographer=self.photographer,
+            lat=52.5299,
+            lng=13.3467,
+        )
+        location.save()
+        search = {
+            'geo[name]': 'Mitte, Berlin',
+            'geo[lat]': 52.5167,
+            'geo[lng]': 13.3667,
+            'geo[range]': 1000
+        }
+        exact = self.client.post(reverse('partial_photos'), search)
+        with self.settings(SEARCH_APPROXIMATE_TOTAL_ABOVE=0):
+            approximate = self.client.post(reverse('partial_photos'), search)
+
+        # tests
+        self.assertGreater(exact.context['total'], 0)
+        self.assertEqual(exact.context['total'],
+                         self.photographer.active_photos().count())
+        self.assertFalse(exact.context['total_approximate'])
+        self.assertTrue(approximate.context['total_approximate'])
+        self.assertGreater(approximate.context['total'], 0)
+
+        # teardown
+        location.delete()
+
+    def test_partial_photos_nearest_mode_widens_a_bounded_radius(self):
+        # setup
+        location = Location(
+            zip_code='10559',
+            country='Deutschland',
+            state='Deutschland',
+            city='Berlin',
+            street='Liboristr. 61',
+            photographer=self.photographer,
+            lat=52.5299,
+            lng=13.3467,
+        )
+        location.save()
+        search = {
+            'geo[name]': 'Mitte, Berlin',
+            'geo[lat]': 52.5167,
+            'geo[lng]': 13.3667,
+            'geo[range]': 0,
+        }
+        count = self.photographer.active_photos().count()
+        with self.settings(SEARCH_NEAREST_PHOTOS=count,
+                           SEARCH_NEAREST_MAX_KM=50, SEARCH_CACHE_TIMEOUT=0):
+            found = self.client.post(reverse('partial_photos'), search)
+        with self.settings(SEARCH_NEAREST_PHOTOS=count + 1,
+                           SEARCH_NEAREST_MAX_KM=50, SEARCH_CACHE_TIMEOUT=0):
+            bounded = self.client.post(reverse('partial_photos'), search)
+
+        # tests
+        self.assertTrue(found.context['nearest'])
+        self.assertEqual(found.context['radius'], 2)
+        self.assertEqual(found.context['total'], count)
+        self.assertEqual(bounded.context['radius'], 50)
+
+        # teardown
+        location.delete()
+
+    def test_partial_photos_keywords_rank_matching_photos(self):
+        # setup
+        location = Location(
+            zip_code='10559',
+            country='Deutschland',
+            state='Deutschland',
+            city='Berlin',
+            street='Liboristr. 61',
+            photographer=self.photographer,
+            lat=52.5299,
+            lng=13.3467,
+        )
+        location.save()
+        in_title, in_description = self.photographer.photos.all()[:2]
+        in_title.title = 'Hochzeit am Wannsee'
+        in_title.save()
+        in_description.description = 'Hochzeit im Standesamt'
+        in_description.save()
+        search = {
+            'geo[name]': 'Mitte, Berlin',
+            'geo[lat]': 52.5167,
+            'geo[lng]': 13.3667,
+            'geo[range]': 10,
+            'keywords': 'hochzeit',
+        }
+        response = self.client.post(reverse('partial_photos'), search)
+        search['keywords'] = self.photographer.company_name
+        by_company = self.client.post(reverse('partial_photos'), search)
+
+        # tests
+        self.assertListEqual(list(response.context['photos']),
+                             [in_title, in_description])
+        self.assertEqual(response.context['total'], 2)
+        self.assertEqual(by_company.context['total'],
+                         self.photographer.active_photos().count())
+
+        # teardown
+        location.delete()
+
+    @postgres_only
+    def test_partial_photos_popular_mode_ranks_liked_photographers_first(self):
+        # setup
+        _, other = create_user_and_photographer()
+        locations = [
+            Location(
+                zip_code='10117',
+                country='Deutschland',
+                state='Deutschland',
+                city='Berlin',
+                street='Unter den Linden 1',
+                photographer=photographer,
+                lat=52.52,
+                lng=13.37,
+            ) for photographer in (self.photographer, other)]
+        for location in locations:
+            location.save()
+        metrics.record([Like(ip='10.0.0.1', photo_id=photo.pk)
+                        for photo in other.photos.all()])
+        rollups.roll_up(lag=0)
+        leaderboard.rebuild()
+        search = {
+            'geo[name]': 'Mitte, Berlin',
+            'geo[lat]': 52.5167,
+            'geo[lng]': 13.3667,
+            'geo[range]': 10,
+            'sort': 'popular',
+        }
+        with self.settings(SEARCH_CACHE_TIMEOUT=0):
+            response = self.client.post(reverse('partial_photos'), search)
+
+        # tests
+        photos = list(response.context['photos'])
+        liked = other.active_photos().count()
+        self.assertTrue(response.context['popular'])
+        self.assertEqual({photo.photographer_id for photo in photos[:liked]},
+                         {other.pk})
+        self.assertEqual({photo.photographer_id for photo in photos[liked:]},
+                         {self.photographer.pk})
+
+        # teardown
+        for location in locations:
+            location.delete()
+
 
 class PartialPhotographersTestCase(UserTestCase):
     def test_post_return_photographer_without_hidden_ids(self):
@@ -166,6 +526,8 @@ class PartialPhotographersTestCase(UserTestCase):
             city='Berlin',
             street='Liboristr. 61',
             photographer=self.photographer,
+            lat=52.5299,
+            lng=13.3467,
         )
         location.save()
         response = self.client.post(
@@ -191,6 +553,8 @@ class PartialPhotographersTestCase(UserTestCase):
             city='Berlin',
             street='Liboristr. 61',
             photographer=self.photographer,
+            lat=52.5299,
+            lng=13.3467,
         )
         location.save()
         response = self.client.post(
@@ -207,3 +571,306 @@ class PartialPhotographersTestCase(UserTestCase):
 
         # teardown
         location.delete()
+
+
+@postgres_only
+class PhotoSearchTestCase(UserTestCase):
+    def test_search_entries_follow_photos_locations_and_categories(self):
+        # setup
+        location = Location(
+            zip_code='10559',
+            country='Deutschland',
+            state='Deutschland',
+            city='Berlin',
+            street='Liboristr. 61',
+            photographer=self.photographer,
+            lat=52.5167,
+            lng=13.3667,
+        )
+        location.save()
+        photo = self.photographer.photos.first()
+        photo.disabled = True
+        photo.save()
+        entries = PhotoSearch.objects.filter(photographer=self.photographer)
+
+        # tests
+        self.assertEqual(entries.count(), self.photographer.photos.count())
+        for entry in entries:
+            self.assertIsNotNone(entry.points)
+            self.assertListEqual(
+                entry.category_slugs,
+                sorted(self.photographer.category_set
+                       .values_list('slug', flat=True)))
+        self.assertTrue(entries.get(photo=photo).disabled)
+
+        # teardown
+        location.delete()
+
+    def test_rebuild_restores_search_entries(self):
+        # setup
+        PhotoSearch.objects.all().delete()
+        call_command('rebuildsearchindex')
+
+        # tests
+        self.assertEqual(
+            PhotoSearch.objects.filter(photographer=self.photographer).count(),
+            self.photographer.photos.count())
+
+
+@postgres_only
+@override_settings(SEARCH_CACHE_TIMEOUT=60)
+class SearchCacheTestCase(UserTestCase):
+    SEARCH = {
+        'geo[name]': 'Mitte, Berlin',
+        'geo[lat]': 52.5167,
+        'geo[lng]': 13.3667,
+        'geo[range]': 10,
+        'seed': 0,
+    }
+
+    def test_repeated_search_is_served_from_cache(self):
+        # setup
+        search_cache.reset_stats()
+        self.client.post(reverse('partial_photos'), self.SEARCH)
+        self.client.post(reverse('partial_photos'), self.SEARCH)
+
+        # tests
+        self.assertEqual(search_cache.stats(), {'hits': 1, 'misses': 1})
+
+    def test_search_from_the_edge_of_a_cell_uses_its_own_point(self):
+        # setup
+        center = search_cache.snap(Point(13.3667, 52.5167, srid=4326))
+        _, lng_span = geohash.spans(settings.SEARCH_CACHE_PRECISION)
+        km_per_lng = geohash.KM_PER_DEGREE * math.cos(math.radians(center.y))
+        # 0.9 km east of the cell's eastern edge, over 1.2 km from its center
+        edge = center.x + lng_span * 0.49
+        location = Location(
+            zip_code='10559',
+            country='Deutschland',
+            state='Deutschland',
+            city='Berlin',
+            street='Liboristr. 61',
+            photographer=self.photographer,
+            lat=center.y,
+            lng=edge + 0.9 / km_per_lng,
+        )
+        location.save()
+        search_cache.reset_stats()
+        search = dict(self.SEARCH, **{'geo[lat]': center.y, 'geo[range]': 1})
+        searches = [
+            self.client.post(reverse('partial_photos'),
+                             dict(search, **{'geo[lng]': lng}))
+            for lng in (edge, center.x, edge + lng_span * 0.02)]
+        at_edge, at_center, next_cell = searches
+
+        # tests
+        self.assertIn(self.photographer.photos.first(),
+                      at_edge.context['photos'])
+        # the cell's cached result, see SEARCH_CACHE_PRECISION
+        self.assertListEqual(list(at_center.context['photos']),
+                             list(at_edge.context['photos']))
+        self.assertEqual(search_cache.stats(), {'hits': 1, 'misses': 2})
+
+        # teardown
+        location.delete()
+
+    def test_location_in_range_invalidates_cached_search(self):
+        # setup
+        first = self.client.post(reverse('partial_photos'), self.SEARCH)
+        location = Location(
+            zip_code='10559',
+            country='Deutschland',
+            state='Deutschland',
+            city='Berlin',
+            street='Liboristr. 61',
+            photographer=self.photographer,
+            lat=52.5299,
+            lng=13.3467,
+        )
+        location.save()
+        second = self.client.post(reverse('partial_photos'), self.SEARCH)
+
+        # tests
+        self.assertNotIn(self.photographer.photos.first(),
+                         first.context['photos'])
+        self.assertIn(self.photographer.photos.first(),
+                      second.context['photos'])
+
+        # teardown
+        location.delete()
+
+    def test_cached_search_estimates_big_totals(self):
+        # setup
+        location = Location(
+            zip_code='10559',
+            country='Deutschland',
+            state='Deutschland',
+            city='Berlin',
+            street='Liboristr. 61',
+            photographer=self.photographer,
+            lat=52.5299,
+            lng=13.3467,
+        )
+        location.save()
+        with self.settings(SEARCH_APPROXIMATE_TOTAL_ABOVE=0):
+            approximate = self.client.post(reverse('partial_photos'),
+                                           self.SEARCH)
+        # drops the cached search
+        location.save()
+        exact = self.client.post(reverse('partial_photos'), self.SEARCH)
+
+        # tests
+        self.assertTrue(approximate.context['total_approximate'])
+        self.assertGreater(approximate.context['total'], 0)
+        self.assertListEqual(list(approximate.context['photos']),
+                             list(exact.context['photos']))
+        self.assertFalse(exact.context['total_approximate'])
+        self.assertEqual(exact.context['total'],
+                         self.photographer.active_photos().count())
+
+        # teardown
+        location.delete()
+
+    @override_settings(SEARCH_NEAREST_PHOTOS=1)
+    def test_nearest_radius_is_cached_until_a_photo_nearby_changes(self):
+        # setup
+        backend = search_backends.get_backend()
+        pnt = search_cache.snap(Point(13.3667, 52.5167, srid=4326))
+        asked = []
+
+        class CountingBackend(object):
+            def nearest_distance(self, *args):
+                asked.append(args)
+                return backend.nearest_distance(*args)
+
+        empty = search_cache.nearest_distance(CountingBackend(), pnt, None)
+        cached = search_cache.nearest_distance(CountingBackend(), pnt, None)
+        location = Location(
+            zip_code='10559',
+            country='Deutschland',
+            state='Deutschland',
+            city='Berlin',
+            street='Liboristr. 61',
+            photographer=self.photographer,
+            lat=52.5299,
+            lng=13.3467,
+        )
+        location.save()
+        found = search_cache.nearest_distance(CountingBackend(), pnt, None)
+
+        # tests
+        self.assertIsNone(empty)
+        self.assertIsNone(cached)
+        self.assertIsNotNone(found)
+        self.assertEqual(len(asked), 2)
+
+        # teardown
+        location.delete()
+
+
+@override_settings(SEARCH_BACKEND='proto.search_memory.MemoryBackend',
+                   SEARCH_CACHE_TIMEOUT=0)
+class MemoryBackendTestCase(UserTestCase):
+    def setUp(self):
+        super(MemoryBackendTestCase, self).setUp()
+        self.location = Location(
+            zip_code='10559',
+            country='Deutschland',
+            state='Deutschland',
+            city='Berlin',
+            street='Liboristr. 61',
+            photographer=self.photographer,
+            lat=52.5299,
+            lng=13.3467,
+        )
+        self.location.save()
+        search_backends.get_backend().reload()
+
+    def tearDown(self):
+        self.location.delete()
+        super(MemoryBackendTestCase, self).tearDown()
+
+    def test_partial_photos_filters_by_distance_in_memory(self):
+        # setup
+        search = {
+            'geo[name]': 'Mitte, Berlin',
+            'geo[lat]': 52.5167,
+            'geo[lng]': 13.3667,
+            'geo[range]': 10,
+        }
+        near = self.client.post(reverse('partial_photos'), search)
+        search['geo[range]'] = 1
+        far = self.client.post(reverse('partial_photos'), search)
+
+        # tests
+        self.assertEqual(near.context['total'],
+                         self.photographer.active_photos().count())
+        self.assertEqual(far.context['photos'], [])
+
+    def test_photo_changes_reach_the_engine(self):
+        # setup
+        photo = self.photographer.photos.first()
+        photo.disabled = True
+        photo.save()
+        response = self.client.post(reverse('partial_photos'), {
+            'geo[name]': 'Mitte, Berlin',
+            'geo[lat]': 52.5167,
+            'geo[lng]': 13.3667,
+            'geo[range]': 10,
+        })
+
+        # tests
+        self.assertNotIn(photo, response.context['photos'])
+
+    def test_partial_photographers_by_zip_prefix_in_memory(self):
+        # setup
+        response = self.client.post(reverse('partial_photographers'),
+                                    {'query_string': '105'})
+
+        # tests
+        self.assertIn(self.photographer, response.context['photographers'])
+
+    @override_settings(SEARCH_TABLE=False)
+    def test_keyword_and_popular_searches_without_the_search_table(self):
+        # setup
+        _, other = create_user_and_photographer()
+        location = Location(
+            zip_code='10559',
+            country='Deutschland',
+            state='Deutschland',
+            city='Berlin',
+            street='Liboristr. 61',
+            photographer=other,
+            lat=52.5299,
+            lng=13.3467,
+        )
+        location.save()
+        photo = self.photographer.photos.first()
+        photo.title = 'Hochzeit am Wannsee'
+        photo.save()
+        PhotographerRank.objects.create(
+            category_slug='', photographer=other, score=1, rank=1,
+            cell=leaderboard.cell(Point(13.3667, 52.5167, srid=4326)))
+        search = {
+            'geo[name]': 'Mitte, Berlin',
+            'geo[lat]': 52.5167,
+            'geo[lng]': 13.3667,
+            'geo[range]': 10,
+            'keywords': 'hochzeit',
+        }
+        found = self.client.post(reverse('partial_photos'), search)
+        del search['keywords']
+        search['sort'] = 'popular'
+        popular = self.client.post(reverse('partial_photos'), search)
+
+        # tests
+        self.assertListEqual(list(found.context['photos']), [photo])
+        photos = list(popular.context['photos'])
+        liked = other.active_photos().count()
+        self.assertEqual({photo.photographer_id for photo in photos[:liked]},
+                         {other.pk})
+        self.assertEqual({photo.photographer_id for photo in photos[liked:]},
+                         {self.photographer.pk})
+
+        # teardown
+        location.delete()
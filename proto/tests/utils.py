@@ -1,15 +1,28 @@
 # coding:utf-8
+import json
 import string
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
 
 import random
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, override_settings
 from django.utils import timezone
 
+from proto import geocoding, search_backends
 from proto.management.commands import importcategories
 from proto.models import Photographer, Category, Photo
 
 
+# tests of the search table, the planner or other PostgreSQL-only SQL, skipped
+# with photobase.settings_spatialite
+postgres_only = unittest.skipUnless(connection.vendor == 'postgresql',
+                                    'needs PostgreSQL')
+
+
 def random_string(number):
     return ''.join([random.choice(string.ascii_letters) for _ in range(number)])
 
@@ -62,9 +75,57 @@ def create_user_and_photographer():
     return user, photographer
 
 
+class FakeGeocoder(object):
+    # Local server answering like the Google Geocoding API, for GEOCODE_URL.
+    # `places` maps normalized addresses to (lat, lng), others have no
+    # results. The requested addresses are kept in `asked`.
+
+    def __init__(self, places):
+        geocoder = self
+        self.places = places
+        self.asked = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                address = parse_qs(urlparse(self.path).query)['address'][0]
+                geocoder.asked.append(address)
+                found = geocoder.places.get(geocoding.normalize(address))
+                answer = {'status': 'ZERO_RESULTS', 'results': []}
+                if found:
+                    answer = {'status': 'OK', 'results': [{
+                        'formatted_address': address,
+                        'geometry': {'location': {'lat': found[0],
+                                                  'lng': found[1]}}}]}
+                body = json.dumps(answer).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}/maps/api/geocode/json'.format(
+            self.server.server_port)
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# the metrics writer thread has its own connection and can't see the rows of
+# the test's transaction, tests write likes and impressions in the request
+@override_settings(METRICS_BUFFERED=False)
 class UserTestCase(TestCase):
 
     def setUp(self):
+        # in-process search engines still hold the rows of earlier tests
+        search_backends.photographers_changed()
         create_categories()
         self.user, self.photographer = create_user_and_photographer()
         self.client.login(username=self.user.username, password='password')
@@ -0,0 +1,102 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from proto import hll
+from proto.models import Photo, PhotographerViewerSketch, PhotoViewerSketch
+
+# Daily HyperLogLog sketches of the viewers (user or ip) of every photo and
+# photographer, filled from the impressions as they are written. Any range
+# of days is answered by merging its sketches, see proto.hll.
+TABLES = (
+    (PhotoViewerSketch._meta.db_table, 'photo_id'),
+    (PhotographerViewerSketch._meta.db_table, 'photographer_id'),
+)
+
+CREATE_SQL = """
+    INSERT INTO {table} ({column}, day, registers)
+    VALUES {values}
+    ON CONFLICT ({column}, day) DO NOTHING
+"""
+
+LOCK_SQL = """
+    SELECT {column}, day, registers FROM {table}
+     WHERE ({column}, day) IN ({keys})
+     ORDER BY {column}, day
+       FOR UPDATE
+"""
+
+UPDATE_SQL = """
+    UPDATE {table} t SET registers = v.registers
+      FROM (VALUES {values}) v (key, day, registers)
+     WHERE t.{column} = v.key AND t.day = v.day
+"""
+
+
+def record(impressions):
+    # adds the impressions' viewers to the sketches of their day
+    impressions = list(impressions)
+    if not impressions or not settings.VIEWER_SKETCHES:
+        return
+    owners = dict(Photo.objects.filter(
+        pk__in={impression.photo_id for impression in impressions})
+        .values_list('pk', 'photographer_id'))
+    viewers = {table: defaultdict(set) for table, _ in TABLES}
+    photo_table, photographer_table = [table for table, _ in TABLES]
+    for impression in impressions:
+        created_on = impression.created_on or timezone.now()
+        day = created_on.astimezone(timezone.utc).date()
+        viewer = 'user:{}'.format(impression.user_id) if impression.user_id \
+            else 'ip:{}'.format(impression.ip)
+        photo_id = int(impression.photo_id)
+        viewers[photo_table][photo_id, day].add(viewer)
+        if photo_id in owners:
+            viewers[photographer_table][owners[photo_id], day].add(viewer)
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        for table, column in TABLES:
+            if viewers[table]:
+                _add(cursor, table, column, viewers[table])
+
+
+def unique_viewers(photo=None, photographer=None, start=None, end=None):
+    # estimated distinct viewers between the days start and end (inclusive)
+    if photo is not None:
+        sketches = PhotoViewerSketch.objects.filter(photo=photo)
+    else:
+        sketches = PhotographerViewerSketch.objects.filter(
+            photographer=photographer)
+    if start is not None:
+        sketches = sketches.filter(day__gte=start)
+    if end is not None:
+        sketches = sketches.filter(day__lte=end)
+    return hll.count(hll.merge(
+        bytes(registers) for registers
+        in sketches.values_list('registers', flat=True)))
+
+
+def _add(cursor, table, column, viewers):
+    keys = sorted(viewers)
+    pairs = ', '.join(['(%s, %s)'] * len(keys))
+    flat = [value for key in keys for value in key]
+    binary = connection.Database.Binary
+    empty = binary(hll.empty())
+
+    # make sure every row exists, then lock them all for the merge
+    cursor.execute(
+        CREATE_SQL.format(table=table, column=column,
+                          values=', '.join(['(%s, %s, %s)'] * len(keys))),
+        [value for key in keys for value in key + (empty,)])
+    cursor.execute(LOCK_SQL.format(table=table, column=column, keys=pairs),
+                   flat)
+    rows = []
+    for key, day, registers in cursor.fetchall():
+        rows.extend([key, day,
+                     binary(hll.add(bytes(registers), viewers[key, day]))])
+    cursor.execute(
+        UPDATE_SQL.format(
+            table=table, column=column,
+            values=', '.join(['(%s, %s::date, %s::bytea)'] * len(keys))),
+        rows)
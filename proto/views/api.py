@@ -1,10 +1,19 @@
+import datetime
+
 from django.conf import settings
+from django.core.cache import cache
 from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from proto.models import Photo
+from proto import leaderboard, rollups, search_backends, search_cache, \
+    search_index, zip_index
+from proto.models import Category, Photo
 from proto.serializers import PhotoSerializer
+from proto.views.common import parse_point
 
 
 class PhotoList(APIView):
@@ -14,6 +23,13 @@ class PhotoList(APIView):
     # permission_classes = (GetOnly,)
 
     def get(self, request, format=None):
+        seed = search_index.parse_seed(request.GET.get('seed'))
+        keywords = request.GET.get('q', '').strip()
+        if keywords:
+            return self.get_matching(request, keywords, seed or 0)
+        if seed is not None:
+            return self.get_shuffled(request, seed)
+
         photos = Photo.objects.all()
 
         paginator = Paginator(photos, settings.PHOTOS_PER_BATCH)
@@ -29,3 +45,140 @@ class PhotoList(APIView):
             photos = paginator.page(paginator.num_pages)
         serializer = PhotoSerializer(photos, many=True)
         return Response(serializer.data)
+
+    def get_shuffled(self, request, seed):
+        # stable order per seed, only the requested page is loaded
+        entries = search_index.shuffled(search_index.active_entries(), seed)
+        return self.paginated(request, entries)
+
+    def get_matching(self, request, keywords, seed):
+        # full-text matches, best ranked first
+        entries = search_index.matching(search_index.active_entries(),
+                                        keywords)
+        entries = search_index.ranked(entries, keywords, seed)
+        return self.paginated(request, entries)
+
+    @staticmethod
+    def paginated(request, entries):
+        paginator = Paginator(entries.values_list('photo_id', flat=True),
+                              settings.PHOTOS_PER_BATCH)
+        try:
+            page = paginator.page(request.GET.get('page'))
+        except PageNotAnInteger:
+            page = paginator.page(1)
+        except EmptyPage:
+            page = paginator.page(paginator.num_pages)
+        photos = search_index.photos_in_order(list(page))
+        serializer = PhotoSerializer(photos, many=True)
+        return Response(serializer.data)
+
+
+class ZipCodeList(APIView):
+    """
+    Zip codes and cities starting with the `q` prefix, for autocompletion.
+    """
+
+    def get(self, request, format=None):
+        prefix = request.GET.get('q', '').strip()
+        if not prefix:
+            return Response([])
+        return Response([
+            {'zip_code': zip_code, 'city': city, 'photographers': count}
+            for zip_code, city, count in zip_index.lookup(
+                prefix, settings.ZIP_AUTOCOMPLETE_LIMIT)])
+
+
+class CategoryFacets(APIView):
+    """
+    Number of photos per category around `lat`/`lng` within `range` km,
+    optionally matching `keywords`.
+    """
+
+    def get(self, request, format=None):
+        pnt = parse_point(request.GET.get('lat'), request.GET.get('lng'))
+        if pnt is None:
+            return Response({'detail': 'lat and lng are required.'},
+                            status=400)
+        try:
+            geo_range = int(request.GET.get('range') or
+                            settings.SEARCH_DEFAULTS['range'])
+        except ValueError:
+            return Response({'detail': 'range must be a number.'},
+                            status=400)
+        keywords = request.GET.get('keywords', '').strip() or None
+
+        # cached per geohash cell like the photo search itself
+        cached = search_cache.enabled()
+        query = search_backends.Query(pnt, geo_range, None, 0, False,
+                                      keywords, False)
+        counts = search_cache.get(query, 'facets') if cached else None
+        if counts is None:
+            counts = search_backends.get_backend().facets(query)
+            if cached:
+                search_cache.store_facets(query, counts)
+
+        return Response([
+            {'slug': slug, 'name': name, 'count': counts.get(slug, 0)}
+            for slug, name in Category.objects.values_list('slug', 'name')])
+
+
+class Leaderboard(APIView):
+    """
+    Most popular photographers of the `category` (all when missing) around
+    `lat`/`lng`, from the precomputed leaderboard.
+    """
+
+    def get(self, request, format=None):
+        pnt = parse_point(request.GET.get('lat'), request.GET.get('lng'))
+        if pnt is None:
+            return Response({'detail': 'lat and lng are required.'},
+                            status=400)
+        ranks = leaderboard.top(request.GET.get('category'),
+                                leaderboard.cell(pnt),
+                                settings.LEADERBOARD_API_LIMIT)
+        return Response([
+            {'rank': rank.rank, 'score': rank.score,
+             'photographer': rank.photographer_id,
+             'company_name': rank.photographer.company_name}
+            for rank in ranks])
+
+
+class MetricSeries(APIView):
+    """
+    Likes and impressions of the logged-in photographer per `period` (day,
+    week or month) from `start` to `end`, optionally of one `photo` or
+    `category`.
+    """
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, format=None):
+        period = request.GET.get('period', 'day')
+        if period not in rollups.PERIODS:
+            return Response({'detail': 'period must be day, week or month.'},
+                            status=400)
+        try:
+            end = parse_date(request.GET.get('end') or '') or \
+                timezone.now().astimezone(timezone.utc).date()
+            start = parse_date(request.GET.get('start') or '') or \
+                end - datetime.timedelta(days=settings.STATS_DEFAULT_DAYS - 1)
+            photo_id, category_id = [
+                int(request.GET[key]) if request.GET.get(key) else None
+                for key in ('photo', 'category')]
+        except ValueError:
+            return Response({'detail': 'Malformed parameter.'}, status=400)
+        if start > end:
+            return Response({'detail': 'start is after end.'}, status=400)
+
+        photographer = request.user.photographer
+        key = 'metric_series:{}:{}:{}:{}:{}:{}'.format(
+            photographer.pk, period, start, end, photo_id, category_id)
+        data = cache.get(key)
+        if data is None:
+            data = [
+                {'period': day.isoformat(), 'likes': likes,
+                 'impressions': impressions}
+                for day, likes, impressions in rollups.series(
+                    photographer.pk, period, start, end, photo_id,
+                    category_id)]
+            cache.set(key, data, settings.STATS_CACHE_TIMEOUT)
+        return Response(data)
@@ -1,12 +1,22 @@
+from django.contrib.gis.geos import Point
 from django.http import HttpResponseRedirect, HttpResponseForbidden
 from django.views.generic import View
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.decorators import login_required
+from django.utils.functional import cached_property
 from django.views.generic.base import ContextMixin, TemplateResponseMixin
 from django.views.generic.edit import ProcessFormView
 
 
+def parse_point(lat, lng):
+    # search origin posted by the client, None when missing or malformed
+    try:
+        return Point(float(lng), float(lat), srid=4326)
+    except (TypeError, ValueError):
+        return None
+
+
 class SafeFormView(View):
     @method_decorator(csrf_exempt)
     def dispatch(self, request, *args, **kwargs):
@@ -19,6 +29,13 @@ class LoginRestrictedView(View):
         return super(LoginRestrictedView, self).dispatch(request, *args, **kwargs)
 
 
+class PhotographerMixin(object):
+    # the logged-in photographer, resolved once per request
+    @cached_property
+    def photographer(self):
+        return self.request.user.photographer
+
+
 class MultiFormMixin(ContextMixin):
     form_classes = {}
     prefixes = {}
@@ -1,13 +1,22 @@
 #coding:utf-8
+import datetime
+
+from django.conf import settings
 from django.core.urlresolvers import reverse_lazy
-from django.http import HttpResponseRedirect
-from django.views.generic import FormView, TemplateView, DetailView, CreateView, \
+from django.db import transaction
+from django.http import HttpResponseRedirect, HttpResponseBadRequest, \
+    StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.utils.functional import cached_property
+from django.views.generic import View, FormView, TemplateView, DetailView, CreateView, \
     DeleteView, UpdateView
 
+from proto import entitlements, exports, portfolio, viewers
 from proto.forms import PhotographerForm, PhotoUploadForm, UserPanelForm, \
     PhotoUpdateForm
-from proto.models import Category, Photo
-from .common import LoginRestrictedView, MultiFormsView
+from proto.models import Category, Photo, Photographer
+from .common import LoginRestrictedView, MultiFormsView, PhotographerMixin
 
 
 class PersonalSettings(LoginRestrictedView, MultiFormsView):
@@ -41,41 +50,75 @@ class ScoreBoard(LoginRestrictedView, TemplateView):
     def get_context_data(self, **kwargs):
         context = super(ScoreBoard, self).get_context_data(**kwargs)
         context['p'] = self.request.user.photographer
+        context['entitlements'] = entitlements.get(context['p'].pk)
+        start = timezone.now().date() - datetime.timedelta(
+            days=settings.UNIQUE_VIEWERS_DAYS - 1)
+        context['unique_viewers'] = viewers.unique_viewers(
+            photographer=context['p'], start=start)
+        context['unique_viewers_days'] = settings.UNIQUE_VIEWERS_DAYS
         return context
 
 
-class Portfolio(LoginRestrictedView, TemplateView):
+class MetricsExport(LoginRestrictedView, View):
+    # Streams the photographer's likes and impressions between `start` and
+    # `end` as `csv` or `ndjson` (`as`), staff may pass a `photographer`
+
+    def get(self, request, *args, **kwargs):
+        format = request.GET.get('as', 'csv')
+        if format not in exports.FORMATS:
+            return HttpResponseBadRequest('as must be csv or ndjson.')
+        try:
+            start, end = [parse_date(request.GET[key])
+                          if request.GET.get(key) else None
+                          for key in ('start', 'end')]
+        except ValueError:
+            return HttpResponseBadRequest('start and end must be dates.')
+        metrics = request.GET.getlist('metric') or None
+
+        if request.user.is_staff and request.GET.get('photographer'):
+            try:
+                photographer = Photographer.objects.get(
+                    pk=int(request.GET['photographer']))
+            except (ValueError, Photographer.DoesNotExist):
+                return HttpResponseBadRequest('Unknown photographer.')
+        else:
+            photographer = request.user.photographer
+
+        response = StreamingHttpResponse(
+            exports.lines(exports.rows(photographer.pk, start, end, metrics),
+                          format),
+            content_type=exports.CONTENT_TYPES[format])
+        response['Content-Disposition'] = \
+            'attachment; filename="metrics-{}.{}"'.format(photographer.pk,
+                                                          format)
+        return response
+
+
+class Portfolio(LoginRestrictedView, PhotographerMixin, TemplateView):
     template_name = 'settings/portfolio.html'
 
     def get_context_data(self, **kwargs):
         context = super(Portfolio, self).get_context_data(**kwargs)
-        context['photos'] = self.request.user.photographer.active_photos().count()
-        context['top_photos'] = self.request.user.photographer.top_photos()
-        categories = self.request.user.photographer.active_categories()
-        context['categories'] = [
-            (category,
-             self.request.user.photographer.category_photos(category).count())
-            for category in categories
-        ]
+        context.update(portfolio.summary(self.photographer.pk))
+        context['entitlements'] = entitlements.get(self.photographer.pk)
         return context
 
 
-class CategoryDetail(LoginRestrictedView, DetailView):
+class CategoryDetail(LoginRestrictedView, PhotographerMixin, DetailView):
     model = Category
     template_name = 'settings/category.html'
     context_object_name = 'category'
 
     def get_queryset(self):
-        return self.request.user.photographer.active_categories()
+        return self.photographer.active_categories()
 
     def get_context_data(self, **kwargs):
         context = super(CategoryDetail, self).get_context_data(**kwargs)
-        context['photos'] = \
-            self.request.user.photographer.category_photos(self.get_object())
+        context['photos'] = self.photographer.category_photos(self.object)
         return context
 
 
-class Upload(LoginRestrictedView, CreateView):
+class Upload(LoginRestrictedView, PhotographerMixin, CreateView):
     template_name = 'settings/upload.html'
     model = Photo
     form_class = PhotoUploadForm
@@ -84,13 +127,30 @@ class Upload(LoginRestrictedView, CreateView):
     def get_context_data(self, **kwargs):
         context = super(Upload, self).get_context_data(**kwargs)
         context['categories'] = Category.objects.all()
+        context['entitlements'] = self.entitlements
         return context
 
+    @cached_property
+    def entitlements(self):
+        return entitlements.get(self.photographer.pk)
+
     def form_valid(self, form):
-        instance = form.save(commit=False)
-        instance.photographer = self.request.user.photographer
-        instance.save()
-        form.save_m2m()
+        # quotas of the photographer's plan, see proto.entitlements; the
+        # photographer's uploads wait for each other here so each one
+        # counts the photos saved before it
+        with transaction.atomic():
+            Photographer.objects.select_for_update()\
+                .get(pk=self.photographer.pk)
+            refused = entitlements.upload_refused(self.photographer.pk)
+            if not refused:
+                instance = form.save(commit=False)
+                instance.photographer = self.photographer
+                instance.save()
+                form.save_m2m()
+        if refused:
+            entitlements.changed([self.photographer.pk])
+            form.add_error(None, refused)
+            return self.form_invalid(form)
         return HttpResponseRedirect(self.success_url)
 
 
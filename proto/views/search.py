@@ -1,23 +1,32 @@
+import math
+
 from django.shortcuts import render
 from django.views.generic import View
 from django.conf import settings
 from django.contrib.gis.geos import GEOSGeometry
-from django.contrib.gis.measure import D
-from proto.models import Photo, Photographer, Location, Category, Like, \
-    Impression
-from .common import SafeFormView
+from proto import metrics, photo_pool, search_backends, search_cache, \
+    search_index
+from proto.models import Photo, Photographer, Category, Like, Impression
+from .common import SafeFormView, parse_point
 
 
 class PhotoListInitial(View):
     template_name = 'index.html'
 
     def get(self, request):
-        photos = Photo.objects.all().order_by('?')[:settings.PHOTOS_PER_BATCH]
+        seed = search_index.parse_seed(request.GET.get('seed'))
+        if seed is not None:
+            photos = search_index.photos_in_order(
+                search_backends.get_backend().shuffled_ids(
+                    seed, settings.PHOTOS_PER_BATCH))
+        else:
+            photos = photo_pool.sample(settings.PHOTOS_PER_BATCH)
         categories = Category.objects.all()
         context = {
             'photos': photos,
             'categories': categories,
             'search_defaults': settings.SEARCH_DEFAULTS,
+            'seed': seed,
             'js_handler': 'photos'
         }
         return render(request, self.template_name, context)
@@ -27,36 +36,47 @@ class PhotographersByPhoto(SafeFormView):
     template_name = 'photographers.html'
 
     def post(self, request):
-        ids = request.POST.get('ids').split(",") or []
+        ids = self.active_photo_ids(request.POST.get('ids'))
         self.add_likes(request, ids)
-        photographers =\
-            Photographer.objects.filter(photos__id__in=ids).distinct()
-        point_str = 'SRID=4326;POINT({} {})'\
-            .format(request.POST.get('lng'), request.POST.get('lat'))
+        point = parse_point(request.POST.get('lat'), request.POST.get('lng'))
+        photographers = search_backends.get_backend().with_nearest_location(
+            Photographer.objects.filter(photos__id__in=ids).distinct(), point)
 
-        point = GEOSGeometry(point_str)
         context = {
             'photographers': photographers,
             'hidden_ids': ids,
             'js_handler': 'photographers',
-            'scale': Location.SCALE,
             'point': point,
         }
         return render(request, self.template_name, context)
 
+    @staticmethod
+    def active_photo_ids(value):
+        # the active photos among the comma separated ids, anything else
+        # would fail the whole batch of the metrics writer
+        ids = set()
+        for photo_id in (value or '').split(','):
+            try:
+                ids.add(int(photo_id))
+            except ValueError:
+                continue
+        if not ids:
+            return []
+        return list(Photo.objects.filter(
+            pk__in=ids, disabled=False, deleted=False,
+            photographer__disabled=False, photographer__deleted=False)
+            .order_by('pk').values_list('pk', flat=True))
+
     def add_likes(self, request, photo_ids):
         ip = request.META['REMOTE_ADDR']
         user = request.user if request.user.is_authenticated() else None
-        for id in photo_ids:
-            like = Like(ip=ip, user=user)
-            like.photo_id = id
-            like.save()
+        metrics.record(Like(ip=ip, user=user, photo_id=id)
+                       for id in photo_ids)
 
 
 class PartialPhotos(SafeFormView):
     TEMPLATE_NAME = 'partials/photos.html'
     DEFAULT_RANGE = settings.SEARCH_DEFAULTS['range']
-    SCALE = 1000
 
     def post(self, request):
         geo = {
@@ -70,37 +90,75 @@ class PartialPhotos(SafeFormView):
             return self.render_not_found(request)
 
         cat = request.POST.get('category')
+        if not cat or cat == settings.SEARCH_DEFAULTS['category']:
+            cat = None
         pnt_str = 'SRID=4326;POINT({} {})'.format(geo['lng'], geo['lat'])
         pnt = GEOSGeometry(pnt_str)
-
-        # geo-filtering
-        if geo_range > 0:
-            # short version
-            # photos = Photo.objects.filter(
-            #     photographer__locations__point__distance_lte=(
-            #           pnt, D(km=geo_range)))
-            # debug-able version
-
-            locations = Location.objects.filter(point__distance_lte=(pnt, D(km=geo_range)))\
-                .distance(pnt).order_by('distance')
-            photographers = Photographer.objects.filter(locations__in=locations)
-            photos = Photo.objects.filter(photographer__in=photographers).order_by('?')
-        else:
-            photos = Photo.objects.exclude(photographer__locations__point__isnull=True)
-
-        # category filtering
-        if cat and cat != settings.SEARCH_DEFAULTS['category']:
-            photos = photos.filter(photographer__categories__slug__exact=cat)
         page = int(request.POST.get('page', 0)) or 0
+        cursor = search_index.decode_cursor(request.POST.get('cursor'))
+        keywords = request.POST.get('keywords', '').strip() or None
+        popular = request.POST.get('sort') == 'popular'
+
+        # no range (or asking for it) searches nearest first
+        nearest = geo_range <= 0 or \
+            request.POST.get('geo[mode]') == 'nearest'
+
+        # the seed is issued with page 0 and echoed back by the client
+        if cursor:
+            seed = cursor['seed']
+            if cursor['range'] is not None:
+                geo_range, nearest = cursor['range'], cursor['nearest']
+            popular = bool(cursor['popular'])
+            if cursor['keywords'] is not search_index.MISSING:
+                keywords = cursor['keywords']
+        else:
+            seed = search_index.parse_seed(request.POST.get('seed'))
+        if seed is None:
+            seed = search_index.new_seed()
+
+        backend = search_backends.get_backend()
+        if nearest and not cursor:
+            geo_range = self.nearest_range(backend, pnt, cat, geo_range)
+        query = search_backends.Query(pnt, geo_range, cat, seed, nearest,
+                                      keywords, popular)
+        if cursor and not search_index.cursor_fits(cursor, query):
+            # issued for another mode, the search starts over
+            cursor = None
+
+        # nearby searches share one cached result, see proto.search_cache
+        cached = None
+        if search_cache.enabled():
+            cached = search_cache.get(query)
+            if cached is None:
+                rows, total, approximate = backend.rows(
+                    query, settings.SEARCH_CACHE_MAX_ROWS)
+                cached = search_cache.store(query, rows, total, approximate)
+
+        # the total is only shown with the first page of a search
+        first_page = not (page or cursor)
+        rows = cached.page(page, cursor, settings.PHOTOS_PER_BATCH) \
+            if cached else None
+        if rows is not None:
+            total, approximate = cached.total, cached.approximate
+        else:
+            rows, total, approximate = backend.page(
+                query, page, cursor, with_total=first_page)
 
         # paginate and add exposure metric
-        batch = self.paginate(photos, page)
+        batch, next_cursor = self.paginate(rows, query)
         self.add_impressions(batch, request)
 
         context = {
             'photos': batch,
             'geo': geo,
-            'total': len(photos) if not page else None,
+            'total': total if first_page else None,
+            'total_approximate': approximate,
+            'seed': seed,
+            'cursor': next_cursor,
+            'radius': geo_range,
+            'nearest': nearest,
+            'keywords': keywords,
+            'popular': popular,
         }
 
         return render(request, self.TEMPLATE_NAME, context)
@@ -110,21 +168,35 @@ class PartialPhotos(SafeFormView):
         return render(request, self.TEMPLATE_NAME, context)
 
     @staticmethod
-    def paginate(photos, page):
-        start = page * settings.PHOTOS_PER_BATCH
-        end = (page + 1) * settings.PHOTOS_PER_BATCH
-        batch = photos[start:end]
-        return batch
+    def nearest_range(backend, pnt, category, geo_range):
+        # grows the radius until it holds SEARCH_NEAREST_PHOTOS photos, the
+        # search stays bounded by SEARCH_NEAREST_MAX_KM in sparse areas
+        limit = settings.SEARCH_NEAREST_MAX_KM
+        if search_cache.enabled():
+            distance = search_cache.nearest_distance(backend, pnt, category)
+        else:
+            distance = backend.nearest_distance(
+                pnt, category, settings.SEARCH_NEAREST_PHOTOS)
+        if distance is None:
+            return limit
+        return min(limit, max(geo_range, int(math.ceil(distance)) or 1))
+
+    @staticmethod
+    def paginate(rows, query):
+        next_cursor = None
+        if len(rows) == settings.PHOTOS_PER_BATCH:
+            last_id, last_key = rows[-1]
+            next_cursor = search_index.encode_cursor(query, last_key, last_id)
+        batch = search_index.photos_in_order([pk for pk, _ in rows])
+        return batch, next_cursor
 
     @staticmethod
     def add_impressions(batch, request):
         ip = request.META['REMOTE_ADDR']
         user = request.user if request.user.is_authenticated() \
             else None
-        for photo in batch:
-            impression = Impression(ip=ip, user=user)
-            impression.photo_id = photo.id
-            impression.save()
+        metrics.record(Impression(ip=ip, user=user, photo_id=photo.id)
+                       for photo in batch)
 
 
 class PartialPhotographers(SafeFormView):
@@ -134,13 +206,12 @@ class PartialPhotographers(SafeFormView):
         zip_code = request.POST.get('query_string')
         photo_ids = request.POST.getlist('hidden_ids[]', [])
 
-        if photo_ids:
-            photographers = Photographer.objects.filter(
-                locations__zip_code__startswith=zip_code,
-                photos__id__in=photo_ids)
-        else:
-            photographers = Photographer.objects.filter(
-                locations__zip_code__startswith=zip_code)
+        point = parse_point(request.POST.get('geo[lat]'),
+                            request.POST.get('geo[lng]'))
+
+        backend = search_backends.get_backend()
+        photographers = backend.with_nearest_location(
+            backend.photographers(zip_code, photo_ids).distinct(), point)
 
         context = {
             'photographers': photographers,
@@ -0,0 +1,86 @@
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+
+from proto.models import Location
+
+# Zip codes of the active photographers' locations as one sorted list of
+# (zip_code, city, photographer_id) rows: the rows starting with a prefix are
+# one contiguous run found by bisection, so lookups never touch the database.
+# Photographers reported by the model signals are reloaded on the next
+# lookup, changes made by other processes show up after ZIP_INDEX_MAX_AGE
+# seconds, when the whole list is reloaded.
+_lock = threading.RLock()
+_state = {'rows': None, 'loaded_on': 0, 'dirty': set()}
+
+
+def warm_up():
+    with _lock:
+        _reload()
+
+
+def changed(photographer_ids=None):
+    # None: anything may have changed
+    with _lock:
+        if photographer_ids is None:
+            _state['rows'] = None
+        else:
+            _state['dirty'].update(photographer_ids)
+
+
+def photographer_ids(prefix):
+    return {owner for _, _, owner in _matches(prefix)}
+
+
+def lookup(prefix, limit=10):
+    # [(zip_code, city, number of photographers)] for the first `limit`
+    # zip codes and cities starting with the prefix
+    found = []
+    for zip_code, city, owner in _matches(prefix):
+        if found and found[-1][:2] == (zip_code, city):
+            found[-1][2].add(owner)
+            continue
+        if len(found) == limit:
+            break
+        found.append((zip_code, city, {owner}))
+    return [(zip_code, city, len(owners)) for zip_code, city, owners in found]
+
+
+def _matches(prefix):
+    prefix = prefix or ''
+    rows = _rows()
+    for row in rows[bisect_left(rows, (prefix,)):]:
+        if not row[0].startswith(prefix):
+            break
+        yield row
+
+
+def _rows():
+    with _lock:
+        age = time.time() - _state['loaded_on']
+        if _state['rows'] is None or age > settings.ZIP_INDEX_MAX_AGE:
+            _reload()
+        if _state['dirty']:
+            dirty, _state['dirty'] = _state['dirty'], set()
+            rows = [row for row in _state['rows'] if row[2] not in dirty]
+            _state['rows'] = sorted(rows + _load(dirty))
+        return _state['rows']
+
+
+def _reload():
+    _state['rows'] = sorted(_load())
+    _state['loaded_on'] = time.time()
+    _state['dirty'] = set()
+
+
+def _load(photographer_ids=None):
+    locations = Location.objects.filter(
+        deleted=False, geocode_status=Location.GEOCODED,
+        photographer__deleted=False, photographer__disabled=False)
+    if photographer_ids is not None:
+        locations = locations.filter(photographer_id__in=photographer_ids)
+    return [(zip_code, city or '', owner) for zip_code, city, owner
+            in locations.values_list('zip_code', 'city', 'photographer_id')
+            .distinct()]
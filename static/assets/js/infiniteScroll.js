@@ -2,6 +2,11 @@
     var RESOURCE_PHOTOGRAPHERS = '/photographers/',
         selectedIds = [],
         page = 0,
+        // shuffle seed issued with page 0, echoed back while scrolling
+        seed = '',
+        // keyset cursor of the next page, empty once the last page arrived
+        cursor = '',
+        lastPage = false,
         searchElem = $("#query_string");
 
     function updateCount(id, elem) {
@@ -44,6 +49,9 @@
             window.mapRefocus();
             lastTrigger = 0;
             page = 0;
+            seed = '';
+            cursor = '';
+            lastPage = false;
             updateCount(null);
         }
 
@@ -63,7 +71,9 @@
                 },
                 hidden_ids:  hiddenIds,
                 category: $("#category").val(),
-                page: !!query ? page : 0
+                page: !!query ? page : 0,
+                seed: seed,
+                cursor: cursor
             };
 
         $.post(resource, postData, function(data) {
@@ -83,6 +93,7 @@
                         .addClass('hidden');
 
                    total = $($items[0]).data('total');
+                   seed = $($items[0]).data('seed');
                    if(total) {
                        $("#counter").html(total);
                    }
@@ -95,6 +106,9 @@
                 }
             }
 
+            cursor = $items.filter('.next_cursor').data('cursor') || '';
+            lastPage = !cursor;
+
             // append items to grid
             $grid.append( $items )
             // add and lay out newly appended items
@@ -125,7 +139,7 @@
             //trigger at the middle of the scroll
             var triggerPoint = (lastTrigger + $(document).height()) / 2,
                 currentPos = $(window).scrollTop();
-            if (currentPos > triggerPoint) {
+            if (currentPos > triggerPoint && !lastPage) {
                 lastTrigger = currentPos;
                 page += 1;
                 loadMoreContent({type: 'scroll'});